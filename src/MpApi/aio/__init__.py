@@ -18,6 +18,18 @@ def monk():
         help="jobs file (optional, defaults to 'jobs.dsl')",
         default="jobs.dsl",
     )
+    parser.add_argument(
+        "--trace",
+        help="write a timeline of all requests to this file (Chrome trace format)",
+    )
+    parser.add_argument(
+        "--plan",
+        help="only count results and chunks per command, download nothing",
+        action="store_true",
+    )
     args = parser.parse_args()
-    m = Monk(conf_fn=args.dsl)
-    m.run_job(job=args.job)
+    m = Monk(conf_fn=args.dsl, trace=args.trace)
+    if args.plan:
+        m.plan_job(job=args.job)
+    else:
+        m.run_job(job=args.job)
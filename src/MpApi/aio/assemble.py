@@ -0,0 +1,47 @@
+"""
+Assembly of a chunk: the records of related modules are added to the chunk's
+document in one pass instead of with one Module += per related module, which copies
+and deduplicates the whole growing document every time. Client.get_items uses it
+for its batches, too.
+
+USAGE
+    from MpApi.aio.assemble import assemble_chunk
+
+    m = assemble_chunk(chunk=objectsM, related=[personsM, multimediaM])
+"""
+
+import copy
+from mpapi.constants import NSMAP
+from mpapi.module import Module
+
+
+def assemble_chunk(*, chunk: Module, related: list) -> Module:
+    """
+    Add the records of the related Modules to chunk's document in one pass and
+    return chunk: a module that chunk doesn't have yet is added as a whole, the
+    records of one it has are appended unless their ID is there already.
+
+    Elements are copied with lxml's deepcopy, which is done in C. Moving them from
+    one document to another looks cheaper, but lxml then fixes up every node and
+    that is several times slower (see test/bench_assemble.py).
+    """
+    modulesN = chunk.xpath("/m:application/m:modules")[0]
+    moduleD = {moduleN.get("name"): moduleN for moduleN in modulesN}
+    knownD: dict = dict()  # mtype -> IDs, only for modules we merge into
+    for relatedM in related:
+        for moduleN in relatedM.xpath("/m:application/m:modules/m:module"):
+            mtype = moduleN.get("name")
+            targetN = moduleD.get(mtype)
+            if targetN is None:
+                targetN = copy.deepcopy(moduleN)
+                modulesN.append(targetN)
+                moduleD[mtype] = targetN
+                continue
+            if mtype not in knownD:
+                knownD[mtype] = {itemN.get("id") for itemN in targetN}
+            known = knownD[mtype]
+            for itemN in moduleN.findall("m:moduleItem", namespaces=NSMAP):
+                if itemN.get("id") not in known:
+                    known.add(itemN.get("id"))
+                    targetN.append(copy.deepcopy(itemN))
+    return chunk
@@ -0,0 +1,164 @@
+"""
+Attachments (the binaries of Multimedia records) of every chunk, streamed to disk in
+the job dir while the chunks are downloaded, with a bounded number of downloads at a
+time.
+
+Files are named after the record's ID and the suffix of its original file name,
+e.g. jobname/attachments/1234.jpg. An index (attachments/index.json) records size
+and sha256 of every finished file; a file that is present with the recorded size (and
+hash, with verify) is not downloaded again, also not in later runs. Interrupted
+downloads are resumed from their .part file with a range request. An attachment that
+several chunks ask for at the same time is downloaded once.
+
+USAGE
+    from MpApi.aio.attachments import Attachments
+
+    attachments = Attachments(path="myjob/attachments", workers=4)
+    chnkr = Chunky(baseURL=baseURL, attachments=attachments)
+
+    await attachments.download(session, client=client, data=m)  # Multimedia in m
+    print(attachments.report())
+"""
+
+import asyncio
+from aiohttp import ClientSession
+import json
+from lxml import etree  # type: ignore
+from mpapi.module import Module
+from MpApi.aio.client import Client, file_sha256
+from pathlib import Path
+
+
+class Attachments:
+    def __init__(
+        self, *, path: str | Path, workers: int = 4, verify: bool = False
+    ) -> None:
+        """
+        path:    dir for the attachments and their index
+        workers: max number of downloads at the same time
+        verify:  also compare the sha256 of present files with the index
+        """
+        self.path = Path(path)
+        self.workers = int(workers)
+        self.verify = verify
+        self._sem = None  # per event loop, see _semaphore
+        self._loop = None
+        self._in_flight: dict = dict()  # ID -> task of the running download
+        self.downloaded = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.index: dict = dict()  # ID -> {file, size, sha256}
+        if self.index_path.exists():
+            with open(self.index_path, mode="r") as f:
+                self.index = json.load(f)
+
+    @property
+    def index_path(self) -> Path:
+        return self.path / "index.json"
+
+    async def download(
+        self, session: ClientSession, *, client: Client, data: Module
+    ) -> None:
+        """
+        Download the attachments of the Multimedia records in data that we don't
+        have yet.
+        """
+        itemsL = data.xpath(
+            "/m:application/m:modules/m:module[@name = 'Multimedia']"
+            "/m:moduleItem[@hasAttachments = 'true']"
+        )
+        if not itemsL:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        results = await asyncio.gather(
+            *[self._download(session, client=client, itemN=itemN) for itemN in itemsL],
+            return_exceptions=True,
+        )
+        # keep the downloads that finished, also if others failed
+        self._save()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def present(self, ID: str) -> bool:
+        """
+        True if the attachment of record ID is on disk as the index describes it.
+        """
+        entry = self.index.get(ID)
+        if entry is None:
+            return False
+        path = self.path / entry["file"]
+        if not path.exists() or path.stat().st_size != entry["size"]:
+            return False
+        if self.verify:
+            return file_sha256(path).hexdigest() == entry["sha256"]
+        return True
+
+    def report(self) -> str:
+        return (
+            f"attachments: {self.downloaded} downloaded ({self.bytes / 2**20:.1f} MB), "
+            f"{self.skipped} present already"
+        )
+
+    #
+    # helpers
+    #
+
+    async def _download(
+        self, session: ClientSession, *, client: Client, itemN: etree._Element
+    ) -> None:
+        ID = itemN.get("id")
+        task = self._in_flight.get(ID)
+        if task is None:
+            if self.present(ID):
+                self.skipped += 1
+                return
+            task = asyncio.ensure_future(
+                self._fetch(session, client=client, ID=ID, path=self._path(itemN))
+            )
+            self._in_flight[ID] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(ID, None))
+        # one download for everyone who wants it; a cancelled waiter doesn't cancel
+        # it for the others
+        await asyncio.shield(task)
+
+    async def _fetch(
+        self, session: ClientSession, *, client: Client, ID: str, path: Path
+    ) -> None:
+        async with self._semaphore():
+            size, sha256 = await client.get_attachment(
+                session, ID=int(ID), path=path
+            )
+        self.index[ID] = {"file": path.name, "size": size, "sha256": sha256}
+        self.downloaded += 1
+        self.bytes += size
+
+    def _path(self, itemN: etree._Element) -> Path:
+        return self.path / f"{itemN.get('id')}{_suffix(itemN)}"
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        """
+        One semaphore for all chunks; monk runs every command in its own event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.workers)
+        return self._sem
+
+    def _save(self) -> None:
+        tmp = self.index_path.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(self.index, f, indent=1)
+        tmp.replace(self.index_path)
+
+
+def _suffix(itemN: etree._Element) -> str:
+    """
+    Suffix of the record's original file name, e.g. ".jpg", or "".
+    """
+    names = itemN.xpath(
+        "m:dataField[@name = 'MulOriginalFileTxt']/m:value/text()",
+        namespaces={"m": etree.QName(itemN).namespace},
+    )
+    return Path(names[0]).suffix.lower() if names else ""
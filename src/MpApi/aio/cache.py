@@ -0,0 +1,101 @@
+"""
+Job-scoped cache of related records, so that a Person, Address, ObjectGroup etc. that
+is referenced from many chunks is downloaded only once per job.
+
+Records are kept as serialized moduleItems keyed by (module, __id). The cache is
+bounded; when it is full, the least recently used record is evicted. Optionally, the
+cache is saved to and loaded from a JSON file (module, ID and XML of every record, least
+recently used first), so later runs can reuse it. Records are reused as they are;
+delete the file to get fresh data.
+
+USAGE
+    from MpApi.aio.cache import RelatedCache
+
+    cache = RelatedCache(max_items=50000, path="myjob/related.cache")
+    cache.load()  # only if path exists
+    itemN = cache.get(mtype="Person", ID=1234)  # None if not cached
+    cache.put(mtype="Person", ID=1234, item=itemN)
+    cache.save()
+    print(cache.report())
+"""
+
+from collections import OrderedDict
+import json
+from lxml import etree  # type: ignore
+from pathlib import Path
+
+
+class RelatedCache:
+    def __init__(self, *, max_items: int = 10000, path: str | Path | None = None):
+        """
+        max_items: max number of records kept; least recently used are evicted first
+        path:      file to load from and save to, None for an in-memory cache
+        """
+        self.max_items = int(max_items)
+        self.path = Path(path) if path is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict = OrderedDict()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, *, mtype: str, ID: int) -> etree._Element | None:
+        """
+        Return a new copy of the cached moduleItem or None; counts hits and misses.
+        """
+        key = (mtype, int(ID))
+        try:
+            xml = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return etree.fromstring(xml)
+
+    def put(self, *, mtype: str, ID: int, item: etree._Element) -> None:
+        key = (mtype, int(ID))
+        self._items[key] = etree.tostring(item)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, mode="r", encoding="utf-8") as f:
+                items = json.load(f)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print(f"cache: {self.path} is not a cache file, ignored")
+            return
+        for mtype, ID, xml in items:
+            self._items[(mtype, int(ID))] = xml.encode()
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        print(f"cache: loaded {len(self._items)} records from {self.path}")
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        items = [
+            [mtype, ID, xml.decode()] for (mtype, ID), xml in self._items.items()
+        ]
+        with open(tmp, mode="w", encoding="utf-8") as f:
+            json.dump(items, f)
+        tmp.replace(self.path)
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return (
+            f"related cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hits), "
+            f"{self.evictions} evictions, {len(self._items)} records"
+        )
@@ -29,22 +29,71 @@ USAGE
 
 allowed_query_types = ["approval", "exhibit", "group", "loc", "query"]
 allowed_mtypes = ["Multimedia", "Object", "Person"]  # for query_maker
+light_fields = ["__id", "__lastModified"]  # for incremental mode
+# fields requested for modules without a projection in the job (see fields and
+# exclude_fields); I wish I could exclude only the offending way to long field
+default_fields = {
+    "Address": [
+        "__id",
+        "__lastModifiedUser",
+        "__lastModified",
+        "__createdUser",
+        "__created",
+        "__orgUnit",
+        "AdrSortTxt",
+        "AdrCityTxt",
+        "AdrNotesClb",
+        "AdrOrganisationTxt",
+        "AdrPostcodeTxt",
+        "AdrStreetTxt",
+        "AdrCatEntryTxt",
+        "AdrCatNameTxt",
+        "AdrCatLocationTxt",
+        "AdrTypeVoc",
+        "AdrContactGrp",
+    ]
+}
 
 import aiohttp
 from aiohttp.client_exceptions import ClientResponseError
 from aiohttp import ClientSession
 import asyncio
-from collections import deque
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import contextvars
 import datetime
-import itertools
-from MpApi.aio.client import Client
+import hashlib
+import time
+from lxml import etree  # type: ignore
+from MpApi.aio.assemble import assemble_chunk
+from MpApi.aio.attachments import Attachments
+from MpApi.aio.cache import RelatedCache
+from MpApi.aio.client import Client, Transfer, current_chunk
+from MpApi.aio.definition import DefinitionCache, field_names
+from MpApi.aio.limiter import AdaptiveLimiter
+from MpApi.aio.manifest import Manifest
+from MpApi.aio.query import search_xml
+from MpApi.aio.metrics import Metrics, NO_METRICS
+from MpApi.aio.retry import RetryPolicy
 from MpApi.aio.session import Session
+from MpApi.aio.sink import ZipSink
+from MpApi.aio.sizer import ChunkSizer
+from MpApi.aio.store import RecordStore, item_meta
+from MpApi.aio.trace import Tracer
 from mpapi.constants import NSMAP
 from mpapi.module import Module
 from mpapi.search import Search
 from typing import Iterator
 from pathlib import Path
 
+ETparser = etree.XMLParser(remove_blank_text=True)
+
+# (manifest, chunk label) of the chunk the current task works on, if checkpointing
+_checkpoint: contextvars.ContextVar = contextvars.ContextVar(
+    "checkpoint", default=None
+)
+
 
 # https://stackoverflow.com/questions/75204560/consuming-taskgroup-response
 class GatheringTaskGroup(asyncio.TaskGroup):
@@ -61,30 +110,193 @@ class GatheringTaskGroup(asyncio.TaskGroup):
         return [task.result() for task in self.__tasks]
 
 
+class ReferenceIndex:
+    """
+    The module references of a chunk, collected in one pass over the document:
+    - targets: target modules referenced directly from a record
+    - IDs:     target module -> sorted unique IDs (int), from references at any
+               depth (e.g. also inside repeatable groups)
+    - counts:  target module -> number of references, before deduplication
+    """
+
+    _reference = f"{{{NSMAP['m']}}}moduleReference"
+    _item = f"{{{NSMAP['m']}}}moduleItem"
+    _reference_item = f"{{{NSMAP['m']}}}moduleReferenceItem"
+
+    def __init__(self, data: Module) -> None:
+        self.targets: set = set()
+        self.counts: dict = dict()
+        seen: dict = dict()
+        for refN in data.toET().iter(self._reference):
+            target = refN.get("targetModule")
+            if refN.getparent().tag == self._item:
+                self.targets.add(target)
+            IDs = seen.setdefault(target, set())
+            # only reference items, not comments etc.; skip those without an ID
+            for itemN in refN.iterchildren(self._reference_item):
+                ID = itemN.get("moduleItemId")
+                if ID is None:
+                    continue
+                IDs.add(int(ID))
+                self.counts[target] = self.counts.get(target, 0) + 1
+        self.IDs = {target: sorted(IDs) for target, IDs in seen.items()}
+
+
+def _batch_key(*, target: str, IDs: list, fields: list | None) -> str:
+    """
+    Checkpoint key for a batch of records by ID: a hash of all (sorted) IDs and the
+    requested fields, so that batches with the same first and last ID differ.
+    """
+    digest = hashlib.sha256()
+    digest.update(",".join(str(ID) for ID in sorted(int(ID) for ID in IDs)).encode())
+    digest.update(b"|")
+    digest.update(",".join(fields if fields is not None else ["*"]).encode())
+    return f"{target}-{digest.hexdigest()[:16]}"
+
+
+def post_process_chunk(*, chunk: Module, chunk_fn: Path) -> None:
+    """
+    The CPU-bound part of saving a chunk: clean, zip and validate.
+    """
+    chunk_zip = chunk_fn.with_suffix(".zip")
+    print(f"zipping multi chunk {chunk_zip}...")
+    chunk.clean()
+    chunk.toZip(path=chunk_fn)  # write zip file to disk
+
+    print("validating multi chunk...", end="")
+    chunk.validate()
+    print("done")
+
+
+def post_process_xml(xml: bytes, chunk_fn: str) -> None:
+    """
+    Runs in a worker process: post_process_chunk for a serialized chunk.
+    """
+    tree = etree.fromstring(xml, ETparser).getroottree()
+    post_process_chunk(chunk=Module(tree=tree), chunk_fn=Path(chunk_fn))
+
+
 class Chunky:
     def __init__(
         self,
         *,
         baseURL: str,
         chunk_size: int = 1000,
+        chunk_target: tuple | None = None,
         exclude_modules: list = [],
         semaphore: int = 100,
+        job_semaphore: asyncio.Semaphore | None = None,
         parallel_chunks: int = 1,
+        stream: bool = False,
+        related_batch: int | None = None,
+        cache: RelatedCache | None = None,
+        store: RecordStore | None = None,
+        incremental: bool = False,
+        limiter: AdaptiveLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        post_workers: int = 0,
+        checkpoint: bool = False,
+        definitions: DefinitionCache | None = None,
+        fields: dict | None = None,
+        exclude_fields: dict | None = None,
+        transfer: Transfer | None = None,
+        metrics: Metrics = NO_METRICS,
+        tracer: Tracer | None = None,
+        snapshot: bool = False,
+        attachments: Attachments | None = None,
+        sinks: list | None = None,
+        validate: bool = True,
     ) -> None:
         """
         baseURL:          does not include "ria-ws/application"
-        chunk_size:       number of object items per chunk, defaults to 1000
+        chunk_size:       number of object items per chunk, defaults to 1000; with
+                          chunk_target only the size of the first chunk
+        chunk_target:     (target, unit) to size chunks adaptively, e.g. (30, "seconds")
+                          or (20 * 2**20, "bytes"), see MpApi.aio.sizer; needs
+                          checkpoint
         excludes_modules: list of related modules that should not be included, e.g. ObjectGroup
         semaphore:        semaphore's initial value, our default is 100, Python's 1.
+        job_semaphore:    semaphore shared with the other commands of a job that run
+                          concurrently; replaces the one per command from semaphore
+        stream:           parse responses incrementally while they arrive (see Client)
+        related_batch:    max number of IDs per related query, None for no limit
+        cache:            RelatedCache consulted before related records are downloaded;
+                          pass the same cache to every Chunky of a job
+        store:            RecordStore that records everything we save
+        incremental:      only download records that are new or changed compared to
+                          the store and assemble chunks from the store; needs store
+        limiter:          AdaptiveLimiter for all requests (in addition to semaphore)
+        retry:            RetryPolicy for transient failures, None = no retries
+        post_workers:     size of the process pool that cleans, zips and validates
+                          finished chunks; 0 does it in the event loop
+        checkpoint:       record finished sub-requests of every chunk in a manifest
+                          in the job dir, so an interrupted run resumes where it
+                          stopped (see MpApi.aio.manifest)
+        definitions:      DefinitionCache for the module definitions
+        fields:           per module, the only fields to request, e.g.
+                          {"Person": ["PerNennformTxt"]}; __id and __lastModified
+                          are always included. Keep the references you need!
+        exclude_fields:   per module, fields not to request, e.g.
+                          {"Address": ["AdrNotesClb"]}
+        transfer:         Transfer that counts bytes on the wire and decompressed;
+                          pass the same to every Chunky of a job
+        metrics:          Metrics registry for requests and chunk stage durations
+        tracer:           Tracer for a request timeline (see MpApi.aio.trace)
+        snapshot:         get the IDs of all results once per run, then every chunk
+                          by its IDs instead of running the query again with a
+                          growing offset; with checkpoint, the IDs are kept for a
+                          resumed run
+        attachments:      Attachments to download the attachments of the Multimedia
+                          records of every chunk before the chunk is saved
+        sinks:            where the records of every chunk go, see MpApi.aio.sink;
+                          defaults to [ZipSink()]; pass the same to every Chunky of
+                          a job and close them at the end
+        validate:         validate every search before it is sent; False skips the
+                          schema in production (see MpApi.aio.query)
         """
         self.baseURL = baseURL
         self.chunk_size = int(chunk_size)
-        self.client = Client(baseURL=baseURL)
+        self.chunk_target = chunk_target
+        self.sizer = None  # ChunkSizer of the current run, see _chunk_tasks
+        self.client = Client(
+            baseURL=baseURL,
+            stream=stream,
+            limiter=limiter,
+            retry=retry,
+            definitions=definitions,
+            transfer=transfer,
+            metrics=metrics,
+            tracer=tracer,
+            validate=validate,
+        )
+        self.metrics = metrics
         self.exclude_modules = exclude_modules
         self._semaphore = semaphore
+        self.job_semaphore = job_semaphore
+        self.records = 0  # main records downloaded, i.e. not skipped or related
         self.parallel_chunks = parallel_chunks
+        self.related_batch = related_batch
+        self.cache = cache
+        self.store = store
+        self.incremental = incremental
+        self.post_workers = int(post_workers)
+        self._pool = None  # ProcessPoolExecutor, created on first use
+        self._post_futures = list()
+        self.checkpoint = checkpoint
+        self._manifests = dict()  # run -> Manifest
+        self._restored: dict = defaultdict(int)  # chunk -> bytes from checkpoints
+        self.fields = fields if fields is not None else dict()
+        self.exclude_fields = exclude_fields if exclude_fields is not None else dict()
+        self._projection = None  # mtype -> fields, see _prepare_projection
+        self.snapshot = snapshot
+        self.attachments = attachments
+        self.sinks = sinks if sinks is not None else [ZipSink()]
+        if incremental and store is None:
+            raise TypeError("Incremental mode needs a RecordStore")
         print(f"semaphore: {self._semaphore}")
         print(f"parallel_chunks: {self.parallel_chunks}")
+        if limiter is not None:
+            print(limiter.report())
 
     async def apack_all_chunks(
         self,
@@ -97,25 +309,43 @@ class Chunky:
 
         # no of results; chunks needed for results
         # target is always Object?
-        rno, cmax = await self._count_results(
-            session, qtype=qtype, target="Object", ID=ID
+        await self._prepare_projection(session)
+        manifest = self._open_manifest(job=job, run=f"{qtype}-{ID}")
+        rno, cmax, snapshot = await self._size_run(
+            session, qtype=qtype, target="Object", ID=ID, manifest=manifest
         )
         if not rno:
             print("Nothing to download!")
+            if manifest is not None:
+                manifest.finish()
             return
         print(f"{rno=} {cmax=}")
 
-        sem = asyncio.Semaphore(self._semaphore)  # zero-based?
+        sem = self.job_semaphore or asyncio.Semaphore(self._semaphore)  # zero-based?
 
-        chunk_tasks = deque()
-        for cno in range(1, cmax + 1):
-            # async with asyncio.TaskGroup() as tg:
-            coro = self.apack_per_chunk(
-                session, cno=cno, ID=ID, job=job, qtype=qtype, sem=sem
+        def make(cno: int, offset: int | None, limit: int | None):
+            return self.apack_per_chunk(
+                session,
+                cno=cno,
+                ID=ID,
+                job=job,
+                qtype=qtype,
+                sem=sem,
+                offset=offset,
+                limit=limit,
+                snapshot=snapshot,
             )
-            chunk_tasks.append(coro)
 
-        await self._parallel_chunks(tasks=chunk_tasks, sem=sem)
+        chunk_tasks = self._chunk_tasks(
+            rno=rno, cmax=cmax, manifest=manifest, make=make
+        )
+
+        try:
+            await self._parallel_chunks(tasks=chunk_tasks)
+        finally:
+            await self._finish_post_processing()
+        if manifest is not None:
+            manifest.finish()
 
     async def apack_per_chunk(
         self,
@@ -126,26 +356,73 @@ class Chunky:
         job: str,
         qtype: str,
         sem: asyncio.Semaphore,
+        offset: int | None = None,
+        limit: int | None = None,
+        snapshot: list | None = None,
     ) -> None:
+        """
+        Download and save one chunk. Without offset and limit, the chunk's boundaries
+        follow from cno and chunk_size. With snapshot (the IDs of all results), the
+        chunk's objects are fetched by their IDs.
+        """
         print(f"CHUNK {cno}")
-        chunk_fn, chunk_zip = self._chunk_path(
+        chunk_fn, _ = self._chunk_path(
             qtype=qtype, ID=ID, cno=cno, job=job, suffix=".xml"
         )
-        if chunk_zip.exists():
-            print(f"Chunk {chunk_zip} exists already")
+        if self._chunk_done(chunk_fn):
+            print(f"Chunk {chunk_fn.stem} exists already")
             return
+        self._set_chunk(chunk_fn=chunk_fn, run=f"{qtype}-{ID}")
 
         # 1: 0 * 1000 = 0
         # 2: 1 * 1000 = 1000
-        offset = int(cno - 1) * self.chunk_size
+        if offset is None:
+            offset = int(cno - 1) * self.chunk_size
+        limit = limit or self.chunk_size
         print(f"   getting {cno}-Objects by qtype '{qtype}' /w offset {offset}...")
-        async with sem:
-            chunk = await self.get_by_type(session, qtype=qtype, ID=ID, offset=offset)
+        fields = light_fields if self.incremental else None
+        start = time.perf_counter()
 
-        multi_chunk = await self._process_related(
-            session, chunk=chunk, cno=cno, sem=sem
-        )
-        self._save_chunk(chunk=multi_chunk, chunk_fn=chunk_fn)
+        async def fetch() -> Module:
+            async with sem:
+                return await self.get_by_type(
+                    session,
+                    qtype=qtype,
+                    ID=ID,
+                    offset=offset,
+                    limit=limit,
+                    fields=fields,
+                )
+
+        with self._stage("objects"):
+            chunk = await self._page(
+                session,
+                fetch=fetch,
+                target="Object",
+                fields=fields,
+                sem=sem,
+                IDs=None if snapshot is None else snapshot[offset : offset + limit],
+            )
+            if self.incremental:
+                itemsL = await self._incremental_items(
+                    session, mtype="Object", page=chunk, sem=sem
+                )
+                chunk = self._module_from_items(mtype="Object", items=itemsL)
+        self.records += len(chunk)
+        self._write(chunk_fn=chunk_fn, data=chunk)
+
+        with self._stage("related"):
+            multi_chunk = await self._process_related(
+                session, chunk=chunk, cno=cno, sem=sem, chunk_fn=chunk_fn
+            )
+        if self.attachments is not None:
+            with self._stage("attachments"):
+                await self.attachments.download(
+                    session, client=self.client, data=multi_chunk
+                )
+        self._observe(chunk_fn=chunk_fn, records=len(chunk), start=start)
+        with self._stage("save"):
+            await self._save_chunk(chunk=multi_chunk, chunk_fn=chunk_fn)
 
     async def get_by_type(
         self,
@@ -154,31 +431,24 @@ class Chunky:
         ID: int,
         qtype: str,
         offset: int = 0,
+        limit: int | None = None,
+        fields: list | None = None,
     ) -> Module:
         """
-        Gets one chunk of Objects. Limit is automatically set to chunk_size. Returns
-        a Module object.
+        Gets one chunk of Objects. Limit defaults to chunk_size. Returns
+        a Module object. If fields is given, only those fields are requested,
+        otherwise those of the job's projection.
         """
 
-        fields: dict = {  # TODO: untested
-            "approval": "ObjPublicationGrp.TypeVoc",
-            "exhibit": "ObjRegistrarRef.RegExhibitionRef.__id",
-            "group": "ObjObjectGroupsRef.__id",
-            "loc": "ObjCurrentLocationVoc",
-        }
-
-        q = Search(module="Object", limit=self.chunk_size, offset=offset)
-
-        q.addCriterion(
-            field=fields[qtype],
-            operator="equalsField",
-            value=str(ID),
+        xml = self._query_xml(
+            ID=ID,
+            qtype=qtype,
+            target="Object",
+            offset=offset,
+            limit=limit or self.chunk_size,
+            fields=fields,
         )
-        q.validate(mode="search")
-        # print(str(q))
-        # async with asyncio.timeout(TIMEOUT):
-        m = await self.client.search2(session, query=q)
-        return m
+        return await self.client.search2(session, query=xml, mtype="Object")
 
     async def get_related_items(
         self,
@@ -187,55 +457,51 @@ class Chunky:
         data: Module,
         sem: asyncio.Semaphore,
         target: str,
+        index: ReferenceIndex | None = None,
     ) -> Module:
         """
         Given some object data, query for related records. Related records are
         those linked to from inside the object data. Return a new module of target type.
-        """
-        dataET = data.toET()
+        Pass the data's ReferenceIndex if you have it already.
 
-        IDs: Any = dataET.xpath(
-            f"//m:moduleReference[@targetModule = '{target}']/m:moduleReferenceItem/@moduleItemId",
-            namespaces=NSMAP,
-        )
+        If related_batch is set, the IDs are split into batches of at most that many
+        IDs which are queried concurrently (each under the semaphore) and merged.
 
-        q = Search(module=target, limit=-1, offset=0)
-        relIDs = set(IDs)  # IDs are not necessarily unique, but we want unique
-        count = 1  # one-based out of tradition; counting unique IDs
-        for ID in sorted(relIDs):
-            # print(f"{target} {ID}")
-            if count == 1 and len(relIDs) > 1:
-                q.OR()
-            q.addCriterion(
-                operator="equalsField",
-                field="__id",
-                value=str(ID),
+        If there is a cache, only IDs that are not cached go over the wire. In
+        incremental mode, only records that are new or changed compared to the store
+        are downloaded.
+        """
+        if index is None:
+            index = ReferenceIndex(data)
+        relIDs = index.IDs.get(target, [])
+        if self.incremental:
+            itemsL = await self._incremental_items(
+                session, mtype=target, IDs=relIDs, sem=sem
             )
-            count += 1
-        if target == "Address":
-            # I wish I could exclude only the offending way to long field
-            q.addField(field="__id")
-            q.addField(field="__lastModifiedUser")
-            q.addField(field="__lastModified")
-            q.addField(field="__createdUser")
-            q.addField(field="__created")
-            q.addField(field="__orgUnit")
-            q.addField(field="AdrSortTxt")
-            q.addField(field="AdrCityTxt")
-            q.addField(field="AdrNotesClb")
-            q.addField(field="AdrOrganisationTxt")
-            q.addField(field="AdrPostcodeTxt")
-            q.addField(field="AdrStreetTxt")
-            q.addField(field="AdrCatEntryTxt")
-            q.addField(field="AdrCatNameTxt")
-            q.addField(field="AdrCatLocationTxt")
-            q.addField(field="AdrTypeVoc")
-            q.addField(field="AdrContactGrp")
-
-        q.validate(mode="search")
-        q.toFile(path=f"debug.related.{target}.xml")
-        async with sem:
-            relatedM = await self.client.search2(session, query=q)
+            return self._module_from_items(mtype=target, items=itemsL)
+
+        cachedL = list()
+        if self.cache is not None:
+            missing = list()
+            for ID in relIDs:
+                itemN = self.cache.get(mtype=target, ID=ID)
+                if itemN is None:
+                    missing.append(ID)
+                else:
+                    cachedL.append(itemN)
+            relIDs = missing
+        if not relIDs:
+            return self._module_from_items(mtype=target, items=cachedL)
+
+        relatedM = await self._fetch_by_ids(session, IDs=relIDs, sem=sem, target=target)
+        if self.cache is not None:
+            for itemN in relatedM.xpath(
+                "/m:application/m:modules/m:module/m:moduleItem"
+            ):
+                self.cache.put(mtype=target, ID=itemN.get("id"), item=itemN)
+            if cachedL:
+                cachedM = self._module_from_items(mtype=target, items=cachedL)
+                assemble_chunk(chunk=relatedM, related=[cachedM])
         return relatedM
 
     async def query_maker(
@@ -259,6 +525,20 @@ class Chunky:
         that we always start with objects and then add whatever else has been elected.
         """
 
+        criteria = self._criteria(ID=ID, qtype=qtype, target=target)
+        q = Search(module=target, offset=offset, limit=limit)
+        if len(criteria) > 1:
+            q.AND()
+        for operator, field, value in criteria:
+            q.addCriterion(operator=operator, field=field, value=value)
+        self._select(q, mtype=target)
+        return q
+
+    def _criteria(self, *, ID, qtype: str, target: str) -> list:
+        """
+        The criteria of query_maker's queries as (operator, field, value); they are
+        joined with and.
+        """
         if qtype not in allowed_query_types:
             raise ValueError(f"Query type not allowed: {qtype=}")
 
@@ -292,57 +572,83 @@ class Chunky:
             "Object": "ObjPublicationGrp.PublicationVoc",
             "Person": "PerObjectRef.ObjPublicationGrp.PublicationVoc",
         }
-        q = Search(module=target, offset=offset, limit=limit)
-        if qtype == "approval" or target == "Multimedia":
-            q.AND()
-        q.addCriterion(
-            field=fields[target][qtype],
-            operator="equalsField",
-            value=str(ID),
-        )
+        criteria = [("equalsField", fields[target][qtype], str(ID))]
         if qtype == "approval":
             # approval group needs two criteria
-            q.addCriterion(
-                field=str(pubVoc[target]),
-                operator="equalsField",
-                value="1810139",  # 1810139: yes
-            )
+            criteria.append(("equalsField", pubVoc[target], "1810139"))  # yes
         if target == "Multimedia":
             # CAUTION: filter for approved Multimedia records
-            q.addCriterion(
-                operator="equalsField",
-                field="MulApprovalGrp.TypeVoc",
-                value="1816002",  # SMB-Digital = 1816002
-            )
-            q.addCriterion(
-                field="MulApprovalGrp.ApprovalVoc",
-                operator="equalsField",
-                value="1810139",  # todo 1810139 is not right. CHECK!
-            )
-        return q
+            criteria += [
+                ("equalsField", "MulApprovalGrp.TypeVoc", "1816002"),  # SMB-Digital
+                # todo 1810139 is not right. CHECK!
+                ("equalsField", "MulApprovalGrp.ApprovalVoc", "1810139"),
+            ]
+        return criteria
+
+    def _query_xml(
+        self,
+        *,
+        ID,
+        qtype: str,
+        target: str,
+        offset: int = 0,
+        limit: int = -1,
+        fields: list | None = None,
+    ) -> str:
+        """
+        The search xml of query_maker's query, written directly (see MpApi.aio.query).
+        Requests fields or, if None, those of the job's projection.
+        """
+        if fields is None:
+            fields = self._fields_for(target)
+        return search_xml(
+            mtype=target,
+            criteria=self._criteria(ID=ID, qtype=qtype, target=target),
+            fields=fields,
+            limit=limit,
+            offset=offset,
+        )
 
     async def query_all_chunks(
         self, session: ClientSession, *, ID: int, job: str, target: str
     ) -> None:
-        rno, cmax = await self._count_results(
-            session, qtype="query", target=target, ID=ID
+        await self._prepare_projection(session)
+        manifest = self._open_manifest(job=job, run=f"query-{ID}")
+        rno, cmax, snapshot = await self._size_run(
+            session, qtype="query", target=target, ID=ID, manifest=manifest
         )
         if not rno:
             print("Nothing to download!")
+            if manifest is not None:
+                manifest.finish()
             return
         print(f"{rno=} {cmax=}")
 
-        sem = asyncio.Semaphore(self._semaphore)  # zero-based?
+        sem = self.job_semaphore or asyncio.Semaphore(self._semaphore)  # zero-based?
 
-        chunk_tasks = deque()
-        for cno in range(1, cmax + 1):
-            # async with asyncio.TaskGroup() as tg:
-            coro = self.query_per_chunk(
-                session, cno=cno, ID=ID, job=job, target=target, sem=sem
+        def make(cno: int, offset: int | None, limit: int | None):
+            return self.query_per_chunk(
+                session,
+                cno=cno,
+                ID=ID,
+                job=job,
+                target=target,
+                sem=sem,
+                offset=offset,
+                limit=limit,
+                snapshot=snapshot,
             )
-            chunk_tasks.append(coro)
 
-        await self._parallel_chunks(tasks=chunk_tasks, sem=sem)
+        chunk_tasks = self._chunk_tasks(
+            rno=rno, cmax=cmax, manifest=manifest, make=make
+        )
+
+        try:
+            await self._parallel_chunks(tasks=chunk_tasks)
+        finally:
+            await self._finish_post_processing()
+        if manifest is not None:
+            manifest.finish()
 
     async def query_per_chunk(
         self,
@@ -353,37 +659,78 @@ class Chunky:
         job: str,
         target: str,
         sem: asyncio.Semaphore,
+        offset: int | None = None,
+        limit: int | None = None,
+        snapshot: list | None = None,
     ) -> None:
-        chunk_fn, chunk_zip = self._chunk_path(
+        chunk_fn, _ = self._chunk_path(
             qtype="query", ID=ID, cno=cno, job=job, suffix=".xml"
         )
-        if chunk_zip.exists():
-            print(f"Chunk {chunk_zip} exists already")
+        if self._chunk_done(chunk_fn):
+            print(f"Chunk {chunk_fn.stem} exists already")
             return
-        offset = int(cno - 1) * self.chunk_size
+        self._set_chunk(chunk_fn=chunk_fn, run=f"query-{ID}")
+        if offset is None:
+            offset = int(cno - 1) * self.chunk_size
+        limit = limit or self.chunk_size
         print(f"   getting {cno}-{target} by query /w offset {offset}...")
-        async with sem:
-            chunk = await self.client.run_saved_query2(
-                session, mtype=target, ID=ID, offset=offset
+        fields = light_fields if self.incremental else None
+        start = time.perf_counter()
+
+        async def fetch() -> Module:
+            async with sem:
+                return await self.client.run_saved_query2(
+                    session,
+                    mtype=target,
+                    ID=ID,
+                    offset=offset,
+                    limit=limit,
+                    fields=fields or self._fields_for(target),
+                )
+
+        with self._stage("objects"):
+            chunk = await self._page(
+                session,
+                fetch=fetch,
+                target=target,
+                fields=fields,
+                sem=sem,
+                IDs=None if snapshot is None else snapshot[offset : offset + limit],
             )
+            if self.incremental:
+                itemsL = await self._incremental_items(
+                    session, mtype=target, page=chunk, sem=sem
+                )
+                chunk = self._module_from_items(mtype=target, items=itemsL)
+        self.records += len(chunk)
+        self._write(chunk_fn=chunk_fn, data=chunk)
 
-        multi_chunk = await self._process_related(
-            session, chunk=chunk, cno=cno, sem=sem
-        )
-        self._save_chunk(chunk=multi_chunk, chunk_fn=chunk_fn)
+        with self._stage("related"):
+            multi_chunk = await self._process_related(
+                session, chunk=chunk, cno=cno, sem=sem, chunk_fn=chunk_fn
+            )
+        if self.attachments is not None:
+            with self._stage("attachments"):
+                await self.attachments.download(
+                    session, client=self.client, data=multi_chunk
+                )
+        self._observe(chunk_fn=chunk_fn, records=len(chunk), start=start)
+        with self._stage("save"):
+            await self._save_chunk(chunk=multi_chunk, chunk_fn=chunk_fn)
 
     #
     # helper
     #
 
-    async def _analyze_related(self, *, data: Module) -> set:
+    async def _analyze_related(
+        self, *, data: Module, index: ReferenceIndex | None = None
+    ) -> set:
         """
         Return a set of targetModules in the provided data.
         """
-        targetL = data.xpath(
-            "/m:application/m:modules/m:module/m:moduleItem/m:moduleReference/@targetModule"
-        )
-        return {target for target in targetL}
+        if index is None:
+            index = ReferenceIndex(data)
+        return index.targets
 
     def _chunk_path(
         self, *, qtype: str, ID: int, cno: int, job: str, suffix: str = ".xml"
@@ -394,10 +741,17 @@ class Chunky:
 
         Note: I was thinking of moving this to chunky, but I dont have Path there and
         self.job.
+
+        With checkpointing, the date comes from the run's manifest, so a run that
+        crosses midnight or is resumed later keeps its project dir.
         """
         if job is None:
             raise TypeError("ERROR: No job name. Can't create project dir!")
-        date: str = datetime.datetime.today().strftime("%Y%m%d")
+        manifest = self._manifests.get(f"{qtype}-{ID}")
+        if manifest is not None:
+            date = manifest.date
+        else:
+            date: str = datetime.datetime.today().strftime("%Y%m%d")
         project_dir: Path = Path(job) / date
         if not project_dir.is_dir():
             Path.mkdir(project_dir, parents=True)
@@ -406,6 +760,59 @@ class Chunky:
 
         return chunk_fn, chunk_zip
 
+    def _chunk_done(self, chunk_fn: Path) -> bool:
+        return all(sink.done(chunk_fn) for sink in self.sinks)
+
+    def _chunk_tasks(self, *, rno: int, cmax: int, manifest, make):
+        """
+        Return the coros for all chunks of a run, make(cno, offset, limit) makes one.
+        With a fixed chunk size that's a deque; with chunk_target it's a generator
+        that sizes every chunk only when it's its turn (see _adaptive_chunks).
+        """
+        if self.chunk_target is None:
+            return deque(make(cno, None, None) for cno in range(1, cmax + 1))
+        if manifest is None:
+            raise TypeError("Adaptive chunk size needs checkpoint for its boundaries")
+        target, unit = self.chunk_target
+        self.sizer = ChunkSizer(target=target, unit=unit, initial=self.chunk_size)
+        return self._adaptive_chunks(rno=rno, manifest=manifest, make=make)
+
+    def _adaptive_chunks(self, *, rno: int, manifest: Manifest, make) -> Iterator:
+        """
+        Yield the chunk coros; boundaries that the manifest knows from an interrupted
+        run are kept, new ones come from the sizer and are recorded before the chunk
+        starts.
+        """
+        cno, offset = 1, 0
+        while offset < rno:
+            if cno <= len(manifest.boundaries):
+                offset, limit = manifest.boundaries[cno - 1]
+            else:
+                limit = self.sizer.next_size()
+                manifest.add_boundary(offset=offset, limit=limit)
+                print(f"   chunk {cno}: {limit} objects from offset {offset}")
+            yield make(cno, offset, limit)
+            offset += limit
+            cno += 1
+
+    async def _checkpointed(self, *, key: str, fetch) -> Module:
+        """
+        Run a sub-request of the current chunk (fetch returns a coro) unless the
+        manifest says it completed before; then return the earlier result from disk.
+        """
+        checkpoint = _checkpoint.get()
+        if checkpoint is None:
+            return await fetch()
+        manifest, chunk = checkpoint
+        m = manifest.get(chunk=chunk, key=key)
+        if m is not None:
+            print(f"   {chunk}: {key} from checkpoint")
+            self._restored[chunk] += manifest.size(chunk=chunk, key=key)
+            return m
+        m = await fetch()
+        manifest.put(chunk=chunk, key=key, data=m)
+        return m
+
     async def _count_results(
         self, session: ClientSession, *, qtype: str, target: str, ID: int
     ) -> int:
@@ -419,36 +826,348 @@ class Chunky:
                 session, ID=ID, mtype=target, limit=1
             )
         else:
-            q = await self.query_maker(
-                qtype=qtype, target=target, ID=ID, offset=0, limit=1
+            xml = self._query_xml(
+                ID=ID,
+                qtype=qtype,
+                target=target,
+                limit=1,
+                fields=self._fields_for(target) or ["__id"],
             )
-            # print(f"{str(q)}")
-            q.addField(field="__id")
-            q.validate(mode="search")
-            m = await self.client.search2(session, query=q)
+            m = await self.client.search2(session, query=xml, mtype=target)
         rno = m.totalSize(module=target)
         chnk_no = int(rno / self.chunk_size) + 1  # no of chunks
         return rno, chnk_no
 
-    # why do I have to roll my own semaphore mechanism?
-    # I want fifo and taskGroup gives different order
-    # I cant get the semaphore to work the way
-    # if one chunk is already on disk, the second slot does nothing for a long time
-    async def _parallel_chunks(self, *, tasks, sem: asyncio.Semaphore):
-        while tasks:
-            if len(tasks) > self.parallel_chunks:
-                new = deque(itertools.islice(tasks, self.parallel_chunks))
-            else:
-                new = deque(itertools.islice(tasks, len(tasks)))
+    async def _fetch_by_ids(
+        self,
+        session: ClientSession,
+        *,
+        IDs: list,
+        sem: asyncio.Semaphore,
+        target: str,
+        fields: list | None = None,
+        kind: str = "related",
+    ) -> Module:
+        """
+        Get the target records with the given IDs, split into batches of
+        related_batch IDs that are queried concurrently (see Client.get_items), and
+        merge them into one Module.
+
+        kind: related or page (the main records in snapshot mode); part of the
+              batches' checkpoint keys
+        """
+        if self.related_batch and len(IDs) > self.related_batch:
+            batches = -(-len(IDs) // self.related_batch)
+            print(f"   splitting {len(IDs)} {target} IDs into {batches} batches")
+
+        def fetch_batch(mtype: str, IDs: list):
+            return self._get_related_batch(
+                session, IDs=IDs, sem=sem, target=mtype, fields=fields, kind=kind
+            )
+
+        return await self.client.get_items(
+            session,
+            items=[(target, ID) for ID in IDs],
+            batch_size=self.related_batch,
+            fetch_batch=fetch_batch,
+        )
+
+    async def _get_related_batch(
+        self,
+        session: ClientSession,
+        *,
+        IDs: list,
+        sem: asyncio.Semaphore,
+        target: str,
+        fields: list | None = None,
+        kind: str = "related",
+    ) -> Module:
+        """
+        Get the target records with the given IDs with one request. If fields is
+        given, only those fields are requested, otherwise those of the job's
+        projection. kind: see _fetch_by_ids.
+        """
+
+        if fields is None:
+            fields = self._fields_for(target)
+
+        async def fetch() -> Module:
             async with sem:
-                await asyncio.gather(*new)
-            for _ in range(len(new)):
-                tasks.popleft()
+                return await self.client.get_batch(
+                    session, mtype=target, IDs=IDs, fields=fields
+                )
+
+        # the batch's IDs identify it, no matter what the cache held at the time
+        key = f"{kind}-{_batch_key(target=target, IDs=IDs, fields=fields)}"
+        return await self._checkpointed(key=key, fetch=fetch)
+
+    def _observe(self, *, chunk_fn: Path, records: int, start: float) -> None:
+        """
+        Tell the sizer what the chunk cost, if the chunk size is adaptive. Results
+        restored from the checkpoint count with their size on disk, since they
+        didn't go through the Transfer.
+        """
+        restored = self._restored.pop(chunk_fn.stem, 0)
+        if self.sizer is None:
+            return
+        body = self.client.transfer.per_chunk["body"][chunk_fn.stem] + restored
+        seconds = time.perf_counter() - start
+        self.sizer.observe(records=records, body=body, seconds=seconds)
+        print(f"   {self.sizer.report()}")
+
+    def _open_manifest(self, *, job: str, run: str) -> Manifest | None:
+        if not self.checkpoint:
+            return None
+        manifest = Manifest.open(job=job, run=run)
+        self._manifests[run] = manifest
+        return manifest
+
+    async def _page(
+        self,
+        session: ClientSession,
+        *,
+        fetch,
+        target: str,
+        fields: list | None,
+        sem: asyncio.Semaphore,
+        IDs: list | None = None,
+    ) -> Module:
+        """
+        Get the main records of the current chunk: by query (fetch returns a coro)
+        or, in snapshot mode, by their IDs.
+        """
+        if IDs is None:
+            return await self._checkpointed(key=self._page_key(fields), fetch=fetch)
+        return await self._fetch_by_ids(
+            session, IDs=IDs, sem=sem, target=target, fields=fields, kind="page"
+        )
+
+    def _page_key(self, fields: list | None) -> str:
+        return "objects" if fields is None else "objects-light"
+
+    async def _parallel_chunks(self, *, tasks: deque | Iterator) -> None:
+        """
+        Sliding window over the chunks: parallel_chunks workers take the next chunk
+        from the (FIFO) deque as soon as they are done with their previous one, so a
+        slow chunk doesn't hold up the others and chunks that exist already don't
+        block a slot. Reports per-worker utilisation at the end.
+
+        tasks can also be a generator, which is asked for the next chunk only when a
+        worker is free (see _adaptive_chunks).
+        """
+        if isinstance(tasks, deque):
+            workers = min(self.parallel_chunks, len(tasks))
+        else:
+            workers = self.parallel_chunks
+        busy = [0.0] * workers
+        done = [0] * workers
+
+        def next_task():
+            if isinstance(tasks, deque):
+                return tasks.popleft() if tasks else None
+            return next(tasks, None)
+
+        async def worker(no: int) -> None:
+            while (coro := next_task()) is not None:
+                start = time.perf_counter()
+                await coro
+                busy[no] += time.perf_counter() - start
+                done[no] += 1
+
+        start = time.perf_counter()
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for no in range(workers):
+                    tg.create_task(worker(no))
+        finally:
+            if isinstance(tasks, deque):
+                while tasks:  # avoid "never awaited" warnings after an error
+                    tasks.popleft().close()
+            else:
+                tasks.close()
+        wall = time.perf_counter() - start
+        for no in range(workers):
+            usage = busy[no] / wall * 100 if wall else 0
+            print(
+                f"worker {no + 1}: {done[no]} chunks, busy {busy[no]:.1f}s, "
+                f"idle {wall - busy[no]:.1f}s ({usage:.0f}% utilisation)"
+            )
+
+    def _fields_for(self, mtype: str) -> list | None:
+        """
+        Fields to request for mtype: the job's projection, the default or None for
+        all fields.
+        """
+        if self._projection is not None and mtype in self._projection:
+            return self._projection[mtype]
+        return default_fields.get(mtype)
+
+    async def _incremental_items(
+        self,
+        session: ClientSession,
+        *,
+        mtype: str,
+        sem: asyncio.Semaphore,
+        IDs: list | None = None,
+        page: Module | None = None,
+    ) -> list:
+        """
+        Update the store for the given records and return them from the store (as
+        moduleItems in the given order).
+
+        page is a response with (at least) __id and __lastModified of the records; if
+        only IDs are given, we first ask the server for that. Only records that are
+        new or changed compared to the store are downloaded in full.
+        """
+        if page is None:
+            page = await self._fetch_by_ids(
+                session, IDs=IDs, sem=sem, target=mtype, fields=light_fields
+            )
+        meta = [
+            item_meta(itemN)
+            for itemN in page.xpath("/m:application/m:modules/m:module/m:moduleItem")
+        ]
+        changedL = self.store.changed(mtype=mtype, meta=meta)
+        print(f"   {len(changedL)} of {len(meta)} {mtype} new or changed")
+        if changedL:
+            fullM = await self._fetch_by_ids(
+                session, IDs=changedL, sem=sem, target=mtype
+            )
+            self.store.put_module(fullM)
+        return self.store.get_many(mtype=mtype, IDs=[ID for ID, _ in meta])
+
+    def _module_from_items(self, *, mtype: str, items: list) -> Module:
+        """
+        Wrap a list of moduleItems into a new Module document of the given type.
+        """
+        root = etree.Element(f"{{{NSMAP['m']}}}application", nsmap={None: NSMAP["m"]})
+        modules = etree.SubElement(root, f"{{{NSMAP['m']}}}modules")
+        module = etree.SubElement(
+            modules,
+            f"{{{NSMAP['m']}}}module",
+            name=mtype,
+            totalSize=str(len(items)),
+        )
+        module.extend(items)
+        return Module(tree=root.getroottree())
+
+    async def _prepare_projection(self, session: ClientSession) -> None:
+        """
+        Turn fields and exclude_fields into one list of fields per module, validated
+        against the module definitions. Raises ValueError for unknown fields.
+        """
+        if self._projection is not None:
+            return
+        projection = dict()
+        for mtype in sorted(set(self.fields) | set(self.exclude_fields)):
+            definition = await self.client.get_definition2(session, mtype=mtype)
+            known = field_names(definition, mtype=mtype)
+            requested = self.fields.get(mtype, []) + self.exclude_fields.get(mtype, [])
+            # repeatable groups and references can be given with a path, e.g.
+            # ObjObjectGroupsRef.__id
+            unknown = [f for f in requested if f.split(".")[0] not in known]
+            if unknown:
+                raise ValueError(f"Unknown fields for {mtype}: {unknown}")
+            if mtype in self.fields:
+                selected = [f for f in light_fields if f not in self.fields[mtype]]
+                selected += self.fields[mtype]
+            else:
+                selected = known
+            excluded = self.exclude_fields.get(mtype, [])
+            projection[mtype] = [f for f in selected if f not in excluded]
+            print(f"{mtype}: requesting {len(projection[mtype])} fields")
+        self._projection = projection
+
+    def _select(self, q: Search, *, mtype: str, fields: list | None = None) -> None:
+        """
+        Restrict the fields q asks for to fields or, if None, to _fields_for(mtype).
+        """
+        if fields is None:
+            fields = self._fields_for(mtype)
+        for field in fields or []:
+            q.addField(field=field)
+
+    @contextlib.contextmanager
+    def _stage(self, stage: str):
+        """
+        Record how long a stage of the current chunk takes, per stage and per chunk.
+        """
+        if not self.metrics.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.metrics.observe("mpapi_stage_seconds", duration, stage=stage)
+            self.metrics.set(
+                "mpapi_chunk_stage_seconds",
+                duration,
+                chunk=current_chunk.get(),
+                stage=stage,
+            )
+
+    async def _size_run(
+        self,
+        session: ClientSession,
+        *,
+        qtype: str,
+        target: str,
+        ID: int,
+        manifest: Manifest | None,
+    ) -> tuple:
+        """
+        Return number of results, number of chunks and, in snapshot mode, the IDs of
+        all results (otherwise None).
+        """
+        if not self.snapshot:
+            rno, cmax = await self._count_results(
+                session, qtype=qtype, target=target, ID=ID
+            )
+            return rno, cmax, None
+        IDs = manifest.get_snapshot() if manifest is not None else None
+        if IDs is not None:
+            print(f"{len(IDs)} {target} IDs from snapshot")
+        else:
+            if qtype == "query":
+                m = await self.client.run_saved_query2(
+                    session, ID=ID, mtype=target, limit=-1, fields=["__id"]
+                )
+            else:
+                m = await self.get_by_type(
+                    session, qtype=qtype, ID=ID, limit=-1, fields=["__id"]
+                )
+            IDs = [
+                int(ID)
+                for ID in m.xpath(
+                    "/m:application/m:modules/m:module/m:moduleItem/@id"
+                )
+            ]
+            if manifest is not None:
+                manifest.put_snapshot(IDs)
+        return len(IDs), -(-len(IDs) // self.chunk_size), IDs
+
+    def _set_chunk(self, *, chunk_fn: Path, run: str) -> None:
+        """
+        Label the current task with its chunk (for retries, checkpoints etc.).
+        """
+        current_chunk.set(chunk_fn.stem)
+        manifest = self._manifests.get(run)
+        if manifest is not None:
+            _checkpoint.set((manifest, chunk_fn.stem))
 
     async def _process_related(
-        self, session, *, chunk: Module, cno: int, sem: asyncio.Semaphore
+        self,
+        session,
+        *,
+        chunk: Module,
+        cno: int,
+        sem: asyncio.Semaphore,
+        chunk_fn: Path,
     ):
-        rel_targets = await self._analyze_related(data=chunk)
+        index = ReferenceIndex(chunk)  # one pass for all targets
+        rel_targets = await self._analyze_related(data=chunk, index=index)
         rel_tasks = list()
         for target in sorted(rel_targets):
             if target in self.exclude_modules:
@@ -456,29 +1175,100 @@ class Chunky:
                 continue
 
             print(f"   getting {cno}-{target} (related)")
-            coro = self.get_related_items(session, data=chunk, sem=sem, target=target)
+            coro = self.get_related_items(
+                session, data=chunk, sem=sem, target=target, index=index
+            )
             rel_tasks.append(asyncio.create_task(coro))
             # if target == "exhibit", we could also add single exhibit record
         try:
             async with sem:
                 results = await asyncio.gather(*rel_tasks)
         except* Exception as e:
+            # the session belongs to the caller (maybe shared by several commands);
+            # only stop this chunk's other lookups and leave closing to the owner
             print("... Chunky: gentle closure")
-            await session.close()
+            for task in rel_tasks:
+                task.cancel()
             raise e
 
         for resultM in results:
             target = resultM.extract_mtype()
             print(f"   adding related {cno}-{target} {len(resultM)} items... ")
-            chunk += resultM
-        return chunk
+            self._write(chunk_fn=chunk_fn, data=resultM)
+        return assemble_chunk(chunk=chunk, related=results)
 
-    def _save_chunk(self, *, chunk, chunk_fn) -> None:
-        chunk_zip = chunk_fn.with_suffix(".zip")
-        print(f"zipping multi chunk {chunk_zip}...")
-        chunk.clean()
-        chunk.toZip(path=chunk_fn)  # write zip file to disk
+    def _write(self, *, chunk_fn: Path, data: Module) -> None:
+        """
+        Hand records of the current chunk to the sinks as soon as we have them.
+        """
+        for sink in self.sinks:
+            sink.write(chunk_fn, data)
 
-        print("validating multi chunk...", end="")
-        chunk.validate()
-        print("done")
+    async def _save_chunk(self, *, chunk, chunk_fn) -> None:
+        """
+        Finish the chunk in all sinks. For a sink that needs the whole chunk (the
+        ZipSink), clean, zip and validate it. With post_workers, this happens in a
+        process pool while we go on downloading; call _finish_post_processing at
+        the end to wait for the remaining chunks.
+        """
+        if self.client.retry is not None:
+            retries = self.client.retry.per_chunk[chunk_fn.stem]
+            print(f"   {retries} retries for {chunk_fn.stem}")
+        if self.client.limiter is not None:
+            print(f"   {self.client.limiter.report()}")
+        print(f"   {self.client.transfer.report(chunk=chunk_fn.stem)}")
+        if self.store is not None:
+            self.store.put_module(chunk)
+        checkpoint = _checkpoint.get()
+        for sink in self.sinks:
+            sink.finish(chunk_fn)
+        if not any(sink.whole_chunk for sink in self.sinks):
+            self._finish_chunk(checkpoint)
+            return
+        if not self.post_workers:
+            post_process_chunk(chunk=chunk, chunk_fn=chunk_fn)
+            self._finish_chunk(checkpoint)
+            return
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.post_workers)
+        # don't queue up more finished chunks in memory than the pool can handle;
+        # with parallel_chunks, several chunks wait here and wake up for the same
+        # finished future, but only one of them takes it off the list
+        while len(self._post_futures) >= 2 * self.post_workers:
+            done, _ = await asyncio.wait(
+                self._post_futures, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                if future in self._post_futures:
+                    self._post_futures.remove(future)
+                    future.result()  # raise errors from the pool early
+        xml = etree.tostring(chunk.toET())
+        task = asyncio.create_task(
+            self._post_process(xml=xml, chunk_fn=chunk_fn, checkpoint=checkpoint)
+        )
+        self._post_futures.append(task)
+        print(f"   {chunk_fn.stem} handed over to post-processing")
+
+    async def _post_process(self, *, xml: bytes, chunk_fn: Path, checkpoint) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._pool, post_process_xml, xml, str(chunk_fn))
+        self._finish_chunk(checkpoint)
+
+    def _finish_chunk(self, checkpoint) -> None:
+        """
+        The chunk's zip exists, so its partial results are no longer needed.
+        """
+        if checkpoint is not None:
+            manifest, chunk = checkpoint
+            manifest.finish_chunk(chunk=chunk)
+
+    async def _finish_post_processing(self) -> None:
+        if self._pool is None:
+            return
+        try:
+            await asyncio.gather(*self._post_futures)
+        finally:
+            self._post_futures = list()
+            self._pool.shutdown()
+            self._pool = None
@@ -18,6 +18,31 @@ MpApi.Aio - Unofficial Asynchronous Open Source Client for MuseumPlus MpRIA
         txt = await c.search(session, xml=xml)
         m = await c.search2(session,query)
 
+        # records by ID, from any modules, in concurrent batches of up to 500 IDs
+        m = await c.get_items(session, items=[("Object", 1), ("Person", 2)])
+
+        # a Multimedia record's attachment, streamed to disk; resumes path.part
+        size, sha256 = await c.get_attachment(session, ID=ID, path=Path("1234.jpg"))
+
+        # definitions from disk while they are fresh, see MpApi.aio.definition
+        c = Client(baseURL=baseURL, definitions=DefinitionCache(path="defs"))
+
+        # streaming: parse while the body arrives, no intermediary str
+        c = Client(baseURL=baseURL, stream=True)
+        m = await c.search2(session, query=query)
+        async for itemN in c.search_items(session, query=query):
+            print(itemN.get("id"))
+
+        # all results page by page, with 2 pages requested ahead of the consumer
+        async for m in c.iter_search(session, query=query, page_size=500, prefetch=2):
+            ...
+        async for itemN in c.iter_saved_query(session, ID=ID, mtype=mtype, items=True):
+            ...
+
+        # bytes on the wire vs. decompressed, per endpoint and chunk; needs a
+        # Session(..., compress=True) to see the compressed bodies
+        print(c.transfer.report())
+
 SEE ALSO
     https://github.com/mokko/MpApi
     http://docs.zetcom.com/ws
@@ -26,14 +51,26 @@ SEE ALSO
 import asyncio
 import aiohttp
 from aiohttp import ClientSession
+from collections import defaultdict, deque
+import contextlib
+import contextvars
+import hashlib
 import logging
 import sys
+import zlib
 from lxml import etree  # type: ignore
+from mpapi.constants import NSMAP
 from mpapi.search import Search
 from mpapi.module import Module
+from MpApi.aio.assemble import assemble_chunk
+from MpApi.aio.definition import DefinitionCache
+from MpApi.aio.limiter import AdaptiveLimiter
+from MpApi.aio.metrics import Metrics, NO_METRICS
+from MpApi.aio.query import ids_xml, search_xml, validate_xml
+from MpApi.aio.retry import RetryPolicy
 from MpApi.aio.session import Session
-from types import TracebackType
-from typing import Any, Optional, Type, Union
+from MpApi.aio.trace import TracedRequest, Tracer
+from typing import Any, AsyncIterator, Union
 from yarl import URL
 from pathlib import Path
 
@@ -44,54 +81,197 @@ ETparser = etree.XMLParser(remove_blank_text=True)
 aiohttp seems to accept baseURL only a host. Path parts after the host get ignored or overwritten
 """
 
-DEBUG = True
-
-
-class Counter:
-    def __init__(self):
-        self._count = 0
-
-    async def __aenter__(self) -> None:  # params from init? ,
-        self._count += 1
-        if DEBUG:
-            print(f"DEBUG-client: {self._count} connections")
-
-    async def __aexit__(
+# label of the chunk the current task works on, e.g. "group-1234-chunk3"; set by
+# Chunky, used to report retries etc. per chunk
+current_chunk: contextvars.ContextVar = contextvars.ContextVar(
+    "current_chunk", default=None
+)
+
+
+class Transfer:
+    """
+    Bytes that travelled over the wire (compressed) and their decompressed size, per
+    job, endpoint and chunk.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.wire = 0
+        self.body = 0
+        self.per_chunk: dict = {"wire": defaultdict(int), "body": defaultdict(int)}
+        self.per_endpoint: dict = {"wire": defaultdict(int), "body": defaultdict(int)}
+
+    def add(self, *, endpoint: str, chunk, wire: int, body: int) -> None:
+        self.requests += 1
+        self.wire += wire
+        self.body += body
+        self.per_chunk["wire"][chunk] += wire
+        self.per_chunk["body"][chunk] += body
+        self.per_endpoint["wire"][endpoint] += wire
+        self.per_endpoint["body"][endpoint] += body
+
+    def report(self, *, chunk=None) -> str:
+        if chunk is not None:
+            wire, body = self.per_chunk["wire"][chunk], self.per_chunk["body"][chunk]
+            return f"transfer {chunk}: {_ratio(wire, body)}"
+        return f"transfer: {self.requests} responses, {_ratio(self.wire, self.body)}"
+
+
+def _ratio(wire: int, body: int) -> str:
+    saved = (1 - wire / body) * 100 if body else 0
+    return (
+        f"{wire / 2**20:.2f} MB on the wire, {body / 2**20:.2f} MB decompressed "
+        f"({saved:.0f}% saved)"
+    )
+
+
+class _Body:
+    """
+    The body of a response, decompressed if the session didn't do that already (see
+    Session's compress), with the bytes before and after decompression counted.
+    """
+
+    def __init__(
         self,
-        exc_type: Optional[Type[BaseException]],
-        exc: Optional[BaseException],
-        tb: Optional[TracebackType],
-    ):
-        self._count -= 1
-        if DEBUG:
-            print(f"DEBUG-client: {self._count} connections")
+        response,
+        *,
+        decompressed: bool,
+        read_size: int,
+        done,
+        trace: TracedRequest | None = None,
+    ) -> None:
+        self.response = response
+        self.status = response.status
+        self.headers = response.headers
+        self.decompressed = decompressed
+        self.read_size = read_size
+        self.done = done  # called with wire and body bytes at the end
+        self.trace = trace
+
+    async def iter_chunked(self) -> AsyncIterator[bytes]:
+        encoding = self.headers.get("Content-Encoding", "identity").lower()
+        decoder = None if self.decompressed else _decoder(encoding)
+        wire = body = 0
+        if self.trace is not None:
+            self.trace.begin("transfer")
+        async for data in self.response.content.iter_chunked(self.read_size):
+            wire += len(data)
+            if decoder is not None:
+                data = decoder.decompress(data)
+            body += len(data)
+            yield data
+        if decoder is not None:
+            data = decoder.flush()
+            body += len(data)
+            if data:
+                yield data
+        if self.decompressed:
+            # we only know the size on the wire if the server tells us
+            wire = int(self.headers.get("Content-Length", body))
+        self.done(wire=wire, body=body)
+        if self.trace is not None:
+            self.trace.end("transfer", wire=wire, body=body)
+
+    async def read(self) -> bytes:
+        return b"".join([data async for data in self.iter_chunked()])
+
+    async def text(self) -> str:
+        return (await self.read()).decode(self.response.charset or "UTF-8")
+
+
+def _decoder(encoding: str):
+    """
+    Return a decompressor with decompress and flush for the Content-Encoding or None
+    for identity.
+    """
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        return zlib.decompressobj(zlib.MAX_WBITS)
+    elif encoding == "br":
+        return _Brotli()
+    elif encoding == "identity":
+        return None
+    raise TypeError(f"Unsupported Content-Encoding: {encoding}")
+
+
+class _Brotli:
+    def __init__(self) -> None:
+        import brotli  # type: ignore # Session only asks for br if it's installed
+
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.process(data)
+
+    def flush(self) -> bytes:
+        return b""
 
 
 class Client:
-    def __init__(self, *, baseURL: str) -> None:
+    def __init__(
+        self,
+        *,
+        baseURL: str,
+        stream: bool = False,
+        read_size: int = 2**16,
+        limiter: AdaptiveLimiter | None = None,
+        retry: RetryPolicy | None = None,
+        definitions: DefinitionCache | None = None,
+        transfer: Transfer | None = None,
+        metrics: Metrics = NO_METRICS,
+        tracer: Tracer | None = None,
+        validate: bool = True,
+    ) -> None:
+        """
+        baseURL:   does not include "ria-ws/application"
+        stream:    if True, the *2 methods feed the response body into an incremental
+                   parser as it arrives instead of reading it into a str first
+        read_size: max bytes per read from the response body in streaming mode
+        limiter:   optional AdaptiveLimiter every request has to get a slot from
+        retry:     optional RetryPolicy for transient failures, None = no retries
+        definitions: optional DefinitionCache for get_definition and get_definition2
+        transfer:  Transfer that counts the bytes; pass one to share it per job
+        metrics:   Metrics registry for requests, latency, bytes, errors etc.
+        tracer:    Tracer for a request timeline; the session needs its trace_config
+        validate:  validate every search against the search schema before it is
+                   sent (see MpApi.aio.query); False saves the time in production
+        """
         self.baseURL = baseURL
         self.appURL = URL(baseURL) / "ria-ws/application"
-        self.count = Counter()
+        self.stream = stream
+        self.read_size = read_size
+        self.limiter = limiter
+        self.retry = retry
+        self.definitions = definitions
+        self.transfer = transfer if transfer is not None else Transfer()
+        self.metrics = metrics
+        self.tracer = tracer
+        self.validate = validate
 
     async def get_definition(self, session: ClientSession, *, mtype: str = None) -> str:
-        if mtype is None:
-            url = self.appURL / "module/definition"
-        else:
-            url = self.appURL / f"module/{mtype}/definition"
-
-        async with self.count:
-            response = await session.get(url)
-            # Seemingly, I have to use await here otherwise I get errors.
-            # I dont understand why I cant return a coro here and await it later.
-            # Perhaps, because the session is closed then.
-            txt = await response.text()
-        return txt
+        if self.definitions is not None:
+            return await self._cached_definition(session, mtype=mtype)
+        url = self._definition_url(mtype)
+        # Seemingly, I have to await the text inside, otherwise I get errors.
+        # I dont understand why I cant return a coro here and await it later.
+        # Perhaps, because the session is closed then.
+        return await self._fetch(
+            session, "GET", url, endpoint="definition", read=self._text
+        )
 
     async def get_definition2(
         self, session: ClientSession, *, mtype: str = None
     ) -> Module:
+        if self.stream and self.definitions is None:
+            url = self._definition_url(mtype)
+            tree = await self._fetch(
+                session, "GET", url, endpoint="definition", read=self._parse
+            )
+            return Module(tree=tree)
         txt = await self.get_definition(session, mtype=mtype)
-        return Module(xml=txt)
+        with self._span("parse", target=mtype):
+            return Module(xml=txt)
 
     async def run_saved_query(
         self, session: ClientSession, *, ID: int, mtype: str, xml: str
@@ -115,11 +295,9 @@ class Client:
         </application>
         """
         url = self.appURL / f"module/{mtype}/search/savedQuery/{ID}"
-
-        async with self.count:
-            response = await session.post(url, data=xml)
-            txt = await response.text()
-        return txt
+        return await self._fetch(
+            session, "POST", url, data=xml, endpoint="savedQuery", read=self._text
+        )
 
     async def run_saved_query2(
         self,
@@ -129,33 +307,574 @@ class Client:
         mtype: str,
         limit: int = -1,
         offset: int = 0,
+        fields: list | None = None,
     ) -> Module:
         """
         Like run_saved_query just with
         - limit and offset as parameters
+        - optional list of fields to restrict the response to
         - query validation
         - returns results in Module
         """
-
-        xml = f"""
-                <application 
-                    xmlns="http://www.zetcom.com/ria/ws/module/search" 
-                    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
-                    xsi:schemaLocation="http://www.zetcom.com/ria/ws/module/search 
-                    http://www.zetcom.com/ria/ws/module/search/search_1_6.xsd">
-                    <modules>
-                      <module name="{mtype}">
-                        <search limit="{limit}" offset="{offset}" />
-                      </module>
-                    </modules>
-                </application>
-            """
-        q = Search(fromString=xml)
-        q.validate(mode="search")
+        xml = self._saved_query_xml(
+            mtype=mtype, limit=limit, offset=offset, fields=fields
+        )
+        if self.stream:
+            url = self.appURL / f"module/{mtype}/search/savedQuery/{ID}"
+            tree = await self._fetch(
+                session, "POST", url, data=xml, endpoint="savedQuery", read=self._parse
+            )
+            return Module(tree=tree)
         txt = await self.run_saved_query(session, ID=ID, mtype=mtype, xml=xml)
-        return Module(xml=txt)
+        with self._span("parse", target=mtype):
+            return Module(xml=txt)
+
+    async def saved_query_items(
+        self,
+        session: ClientSession,
+        *,
+        ID: int,
+        mtype: str,
+        limit: int = -1,
+        offset: int = 0,
+    ) -> AsyncIterator[etree._Element]:
+        """
+        Like run_saved_query2, but yields moduleItems as soon as they are parsed, see
+        search_items.
+        """
+        xml = self._saved_query_xml(mtype=mtype, limit=limit, offset=offset)
+        url = self.appURL / f"module/{mtype}/search/savedQuery/{ID}"
+        async with self._response(
+            session, "POST", url, data=xml, endpoint="savedQuery"
+        ) as body:
+            async for itemN in self._iter_items(body):
+                yield itemN
+
+    async def get_attachment(
+        self,
+        session: ClientSession,
+        *,
+        ID: int,
+        path: Path,
+        mtype: str = "Multimedia",
+    ) -> tuple:
+        """
+        Stream the attachment of a record to path and return its size and sha256.
+        The body goes to path.part first; a .part from an earlier attempt is resumed
+        with a range request, also when a transfer breaks off and is retried.
+
+        The response's ETag (or Last-Modified) is kept next to the .part file and
+        sent as If-Range, so a server whose file changed sends it whole again. A
+        .part without one, or one that doesn't fit the server's file, is started
+        over.
+        """
+        url = self.appURL / f"module/{mtype}/{ID}/attachment"
+        part = path.with_name(f"{path.name}.part")
+        validator = path.with_name(f"{path.name}.part.validator")
+        attempt = 1
+        while True:
+            offset = part.stat().st_size if part.exists() else 0
+            headers = {
+                "Accept": "application/octet-stream",
+                "Accept-Encoding": "identity",  # ranges of the bytes as stored
+            }
+            if offset and validator.exists():
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator.read_text()
+            streaming = False
+            try:
+                async with self._response(
+                    session, "GET", url, endpoint="attachment", headers=headers
+                ) as body:
+                    streaming = True
+                    resume = body.status == 206
+                    if resume and _range_start(body.headers) != offset:
+                        _unlink(part, validator)
+                        continue
+                    if not resume:
+                        _unlink(validator)
+                        tag = body.headers.get("ETag") or body.headers.get(
+                            "Last-Modified"
+                        )
+                        if tag:
+                            validator.write_text(tag)
+                    sha256 = file_sha256(part) if resume else hashlib.sha256()
+                    with open(part, mode="ab" if resume else "wb") as f:
+                        async for data in body.iter_chunked():
+                            f.write(data)
+                            sha256.update(data)
+                break
+            except aiohttp.ClientResponseError as exc:
+                if exc.status != 416:
+                    raise
+                # range not satisfiable: the part is complete if it has the size of
+                # the server's file, otherwise we start over
+                if _complete_length(exc.headers) == offset:
+                    sha256 = file_sha256(part)
+                    break
+                _unlink(part, validator)
+            except Exception as exc:
+                if not streaming:
+                    raise  # _response has retried already
+                self._count_error(exc, endpoint="attachment")
+                await self._retry_or_raise(exc, endpoint="attachment", attempt=attempt)
+            attempt += 1
+        part.replace(path)
+        _unlink(validator)
+        return path.stat().st_size, sha256.hexdigest()
+
+    async def get_batch(
+        self,
+        session: ClientSession,
+        *,
+        mtype: str,
+        IDs: list,
+        fields: list | None = None,
+    ) -> Module:
+        """
+        Get the records of one module with the given IDs with one search request. If
+        fields is given, only those fields are requested.
+        """
+        xml = self._check(ids_xml(mtype=mtype, IDs=IDs, fields=fields))
+        return await self._search_module(session, xml=xml, mtype=mtype)
+
+    async def get_items(
+        self,
+        session: ClientSession,
+        *,
+        items: list,
+        batch_size: int | None = 500,
+        fields: dict | None = None,
+        sem: asyncio.Semaphore | None = None,
+        fetch_batch=None,
+    ) -> Module:
+        """
+        Get the records for a list of (mtype, ID) pairs in one Module: the IDs are
+        grouped by module and split into batches that are requested concurrently.
+        Every ID is requested only once.
+
+        batch_size:  max number of IDs per request, None for one request per module
+        fields:      per module, the only fields to request, e.g. {"Person": [...]}
+        sem:         semaphore to limit the number of batches in flight
+        fetch_batch: fetch_batch(mtype, IDs) returns the coro that gets one batch;
+                     defaults to get_batch
+        """
+        if fetch_batch is None:
+
+            def fetch_batch(mtype: str, IDs: list):
+                return self.get_batch(
+                    session, mtype=mtype, IDs=IDs, fields=(fields or {}).get(mtype)
+                )
+
+        async def get(mtype: str, IDs: list) -> Module:
+            async with sem or contextlib.nullcontext():
+                return await fetch_batch(mtype, IDs)
+
+        results = await asyncio.gather(
+            *[get(mtype, IDs) for mtype, IDs in _batches(items, size=batch_size)]
+        )
+        if not results:
+            return Module()
+        return assemble_chunk(chunk=results[0], related=results[1:])
+
+    async def iter_saved_query(
+        self,
+        session: ClientSession,
+        *,
+        ID: int,
+        mtype: str,
+        page_size: int = 1000,
+        prefetch: int = 1,
+        fields: list | None = None,
+        items: bool = False,
+    ) -> AsyncIterator:
+        """
+        Like iter_search, but for a saved query.
+        """
+
+        def fetch(offset: int, limit: int):
+            return self.run_saved_query2(
+                session, ID=ID, mtype=mtype, limit=limit, offset=offset, fields=fields
+            )
+
+        async for page in self._pages(
+            fetch, mtype=mtype, page_size=page_size, prefetch=prefetch, items=items
+        ):
+            yield page
 
-    async def search(self, session: ClientSession, *, xml: str) -> str:
+    async def iter_search(
+        self,
+        session: ClientSession,
+        *,
+        query: Search,
+        page_size: int = 1000,
+        prefetch: int = 1,
+        items: bool = False,
+    ) -> AsyncIterator:
+        """
+        Yield all results of query page by page (as Module) or, with items, one
+        moduleItem after the other. The query's own limit and offset are replaced.
+
+        page_size: results per request
+        prefetch:  number of pages requested ahead of the consumer; at most
+                   prefetch + 1 pages are in memory, 0 requests every page on demand
+        """
+        xml = self._check(query.toString())
+        mtype = self._search_mtype(xml)
+
+        def fetch(offset: int, limit: int):
+            return self._search_module(
+                session, xml=_paged_xml(xml, offset=offset, limit=limit), mtype=mtype
+            )
+
+        async for page in self._pages(
+            fetch, mtype=mtype, page_size=page_size, prefetch=prefetch, items=items
+        ):
+            yield page
+
+    async def search(
+        self, session: ClientSession, *, xml: str, mtype: str | None = None
+    ) -> str:
+        url = self._search_url(xml, mtype=mtype)
+        return await self._fetch(
+            session, "POST", url, data=xml, endpoint="search", read=self._text
+        )
+
+    async def search2(
+        self,
+        session: ClientSession,
+        *,
+        query: Search | str,
+        mtype: str | None = None,
+    ) -> Module:
+        """
+        query is a Search or its xml, e.g. from MpApi.aio.query.search_xml; pass
+        mtype if you know it, then the xml isn't parsed for the module.
+        """
+        xml = query if isinstance(query, str) else query.toString()
+        return await self._search_module(session, xml=self._check(xml), mtype=mtype)
+
+    async def _search_module(
+        self, session: ClientSession, *, xml: str, mtype: str | None = None
+    ) -> Module:
+        if self.stream:
+            url = self._search_url(xml, mtype=mtype)
+            tree = await self._fetch(
+                session, "POST", url, data=xml, endpoint="search", read=self._parse
+            )
+            return Module(tree=tree)
+        txt = await self.search(session, xml=xml, mtype=mtype)
+        with self._span("parse"):
+            return Module(xml=txt)  # txt.encode()
+
+    async def search_items(
+        self, session: ClientSession, *, query: Search
+    ) -> AsyncIterator[etree._Element]:
+        """
+        Run a search and yield moduleItems as they arrive. Each item is detached from
+        the response document before it is yielded, so only the items the consumer
+        keeps stay in memory.
+        """
+        xml = self._check(query.toString())
+        url = self._search_url(xml)
+        async with self._response(
+            session, "POST", url, data=xml, endpoint="search"
+        ) as body:
+            async for itemN in self._iter_items(body):
+                yield itemN
+
+    #
+    # helpers
+    #
+
+    async def _cached_definition(
+        self, session: ClientSession, *, mtype: str = None
+    ) -> str:
+        """
+        Return the definition from self.definitions if it's fresh; otherwise ask the
+        server whether it changed (If-None-Match) and update the cache.
+        """
+        xml, etag, fresh = self.definitions.get(mtype)
+        if xml is not None and fresh:
+            return xml
+        headers = {"If-None-Match": etag} if xml is not None and etag else None
+
+        async def read(body: _Body) -> tuple:
+            if body.status == 304:
+                return None, body.headers.get("ETag", etag)
+            return await body.text(), body.headers.get("ETag")
+
+        url = self._definition_url(mtype)
+        new_xml, new_etag = await self._fetch(
+            session, "GET", url, endpoint="definition", read=read, headers=headers
+        )
+        if new_xml is None:
+            self.definitions.touch(mtype, etag=new_etag)
+            return xml
+        self.definitions.put(mtype, xml=new_xml, etag=new_etag)
+        return new_xml
+
+    async def _fetch(
+        self,
+        session: ClientSession,
+        method: str,
+        url: URL,
+        *,
+        endpoint: str,
+        read,
+        data: str = None,
+        headers: dict = None,
+    ) -> Any:
+        """
+        Make a request and return what read (a coro that gets the response's _Body)
+        returns. Transient failures while requesting or reading are retried per
+        self.retry.
+        """
+        attempt = 1
+        while True:
+            try:
+                with self._traced(endpoint=endpoint, url=url) as trace:
+                    async with self._slot(endpoint=endpoint, data=data) as slot:
+                        async with session.request(
+                            method,
+                            url,
+                            data=data,
+                            headers=headers,
+                            trace_request_ctx=trace,
+                        ) as response:
+                            _responded(slot)
+                            body = self._body(session, response, endpoint, trace)
+                            return await read(body)
+            except Exception as exc:
+                self._count_error(exc, endpoint=endpoint)
+                await self._retry_or_raise(exc, endpoint=endpoint, attempt=attempt)
+            attempt += 1
+
+    @contextlib.asynccontextmanager
+    async def _response(
+        self,
+        session: ClientSession,
+        method: str,
+        url: URL,
+        *,
+        endpoint: str,
+        data: str = None,
+        headers: dict = None,
+    ):
+        """
+        Like _fetch, but gives the open response's _Body to the caller, e.g. for
+        streaming. Only failures before the response is handed over are retried.
+        """
+        attempt = 1
+        while True:
+            stack = contextlib.AsyncExitStack()
+            try:
+                trace = stack.enter_context(self._traced(endpoint=endpoint, url=url))
+                slot = await stack.enter_async_context(
+                    self._slot(endpoint=endpoint, data=data)
+                )
+                response = await stack.enter_async_context(
+                    session.request(
+                        method,
+                        url,
+                        data=data,
+                        headers=headers,
+                        trace_request_ctx=trace,
+                    )
+                )
+                _responded(slot)
+            except Exception as exc:
+                self._count_error(exc, endpoint=endpoint)
+                await stack.__aexit__(type(exc), exc, exc.__traceback__)
+                await self._retry_or_raise(exc, endpoint=endpoint, attempt=attempt)
+                attempt += 1
+                continue
+            async with stack:
+                yield self._body(session, response, endpoint, trace)
+            return
+
+    def _body(
+        self,
+        session: ClientSession,
+        response,
+        endpoint: str,
+        trace: TracedRequest | None = None,
+    ) -> _Body:
+        chunk = current_chunk.get()
+
+        def done(*, wire: int, body: int) -> None:
+            self.transfer.add(endpoint=endpoint, chunk=chunk, wire=wire, body=body)
+            self.metrics.inc("mpapi_received_bytes_total", wire, endpoint=endpoint)
+            self.metrics.inc("mpapi_decompressed_bytes_total", body, endpoint=endpoint)
+
+        return _Body(
+            response,
+            decompressed=session.auto_decompress,
+            read_size=self.read_size,
+            done=done,
+            trace=trace,
+        )
+
+    async def _retry_or_raise(
+        self, exc: Exception, *, endpoint: str, attempt: int
+    ) -> None:
+        """
+        Either wait for the next attempt or re-raise exc.
+        """
+        chunk = current_chunk.get()
+        if self.retry is None or not self.retry.spend(
+            endpoint=endpoint, attempt=attempt, exc=exc, chunk=chunk
+        ):
+            raise exc
+        delay = self.retry.delay(exc, attempt=attempt)
+        self.metrics.inc("mpapi_retries_total", endpoint=endpoint)
+        print(
+            f"   {chunk or ''} {endpoint}: {type(exc).__name__} {getattr(exc, 'status', '')}"
+            f" - retry {attempt} in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+    def _span(self, name: str, **args):
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, chunk=current_chunk.get(), **args)
+
+    @contextlib.contextmanager
+    def _traced(self, *, endpoint: str, url: URL):
+        """
+        Trace one attempt of a request if there is a tracer; yields the TracedRequest
+        (or None) the session's trace hooks report into.
+        """
+        if self.tracer is None:
+            yield None
+            return
+        chunk = current_chunk.get()
+        trace = self.tracer.request(endpoint=endpoint, url=url, chunk=chunk)
+        try:
+            yield trace
+        except BaseException as exc:
+            trace.close(error=getattr(exc, "status", None) or type(exc).__name__)
+            raise
+        else:
+            trace.close()
+
+    def _count_error(self, exc: Exception, *, endpoint: str) -> None:
+        error = getattr(exc, "status", None) or type(exc).__name__
+        self.metrics.inc("mpapi_errors_total", endpoint=endpoint, error=error)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, *, endpoint: str, data: str = None):
+        """
+        Every request runs in a slot: measured and, if there is one, limited by the
+        adaptive limiter. Yields the limiter's slot (or None), to report the
+        response's headers with _responded.
+        """
+        if self.limiter is None:
+            async with self._measure(endpoint=endpoint, data=data):
+                yield None
+        else:
+            async with self.limiter.slot(endpoint=endpoint) as slot:
+                async with self._measure(endpoint=endpoint, data=data):
+                    yield slot
+
+    @contextlib.asynccontextmanager
+    async def _measure(self, *, endpoint: str, data: str = None):
+        metrics = self.metrics
+        if not metrics.enabled:
+            yield
+            return
+        metrics.inc("mpapi_requests_total", endpoint=endpoint)
+        if data is not None:
+            metrics.inc("mpapi_sent_bytes_total", len(data), endpoint=endpoint)
+        metrics.add("mpapi_requests_in_flight", 1, endpoint=endpoint)
+        try:
+            with metrics.timer("mpapi_request_seconds", endpoint=endpoint):
+                yield
+        finally:
+            metrics.add("mpapi_requests_in_flight", -1, endpoint=endpoint)
+
+    def _definition_url(self, mtype: str = None) -> URL:
+        if mtype is None:
+            return self.appURL / "module/definition"
+        return self.appURL / f"module/{mtype}/definition"
+
+    async def _iter_items(self, body: _Body) -> AsyncIterator[etree._Element]:
+        parser = etree.XMLPullParser(
+            events=("end",),
+            tag=f"{{{NSMAP['m']}}}moduleItem",
+            remove_blank_text=True,
+        )
+        async for data in body.iter_chunked():
+            parser.feed(data)
+            for _, itemN in parser.read_events():
+                itemN.getparent().remove(itemN)
+                yield itemN
+        parser.close()
+
+    async def _pages(
+        self, fetch, *, mtype: str, page_size: int, prefetch: int, items: bool
+    ) -> AsyncIterator:
+        """
+        Yield the pages of a paged request in order; fetch(offset, limit) returns the
+        coro for one page. The first page tells us the total, the others are
+        requested up to prefetch pages ahead of the consumer.
+        """
+        first = await fetch(0, page_size)
+        offsets = iter(range(page_size, first.totalSize(module=mtype), page_size))
+        pending: deque = deque()
+
+        def ahead(n: int) -> None:
+            while len(pending) < n and (offset := next(offsets, None)) is not None:
+                pending.append(asyncio.ensure_future(fetch(offset, page_size)))
+
+        try:
+            ahead(prefetch)
+            page = first
+            while page is not None:
+                if items:
+                    for itemN in page.xpath(
+                        "/m:application/m:modules/m:module/m:moduleItem"
+                    ):
+                        yield itemN
+                else:
+                    yield page
+                ahead(max(prefetch, 1))
+                page = await pending.popleft() if pending else None
+                ahead(prefetch)
+        finally:
+            # consumer stopped early or a page failed
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _parse(self, body: _Body) -> etree._ElementTree:
+        """
+        Feed the response body into an incremental parser as it arrives.
+        """
+        parser = etree.XMLParser(remove_blank_text=True)
+        async for data in body.iter_chunked():
+            parser.feed(data)
+        return parser.close().getroottree()
+
+    async def _text(self, body: _Body) -> str:
+        return await body.text()
+
+    def _saved_query_xml(
+        self, *, mtype: str, limit: int, offset: int, fields: list | None = None
+    ) -> str:
+        return self._check(
+            search_xml(mtype=mtype, fields=fields, limit=limit, offset=offset)
+        )
+
+    def _check(self, xml: str) -> str:
+        """
+        Validate search xml unless validation is off; returns xml.
+        """
+        if self.validate:
+            validate_xml(xml)
+        return xml
+
+    def _search_mtype(self, xml: str) -> str:
         ET = etree.fromstring(bytes(xml, "UTF-8"))
         mtype = ET.xpath(
             "/s:application/s:modules/s:module/@name",
@@ -163,21 +882,89 @@ class Client:
         )[0]
         if not mtype:
             raise TypeError("Unknown module")
+        return mtype
 
-        url = self.appURL / f"module/{mtype}/search"
-
-        # print(f"{mtype=} {url=}")
-
-        async with self.count:
-            response = await session.post(url, data=xml)
-            txt = await response.text()
-            # print(f"{response.request_info=}")
-        return txt
-
-    async def search2(self, session: ClientSession, *, query: Search) -> Module:
-        query.validate(mode="search")
-        txt = await self.search(session, xml=query.toString())
-        return Module(xml=txt)  # txt.encode()
+    def _search_url(self, xml: str, *, mtype: str | None = None) -> URL:
+        """
+        mtype saves parsing the xml for the module, if the caller knows it.
+        """
+        return self.appURL / f"module/{mtype or self._search_mtype(xml)}/search"
+
+
+def _responded(slot) -> None:
+    """
+    Tell the limiter's slot (if any) that the response headers are here.
+    """
+    if slot is not None:
+        slot.responded()
+
+
+def _batches(items: list, *, size: int | None) -> list:
+    """
+    Group (mtype, ID) pairs by module, without duplicates, and split them into
+    batches of at most size IDs; returns a list of (mtype, IDs).
+    """
+    per_module: dict = dict()
+    for mtype, ID in items:
+        per_module.setdefault(mtype, dict())[ID] = None  # ordered set
+    batches = list()
+    for mtype, IDs in per_module.items():
+        IDs = list(IDs)
+        step = size or len(IDs)
+        batches += [(mtype, IDs[i : i + step]) for i in range(0, len(IDs), step)]
+    return batches
+
+
+def _range_start(headers) -> int | None:
+    """
+    First byte of a partial response, from Content-Range: bytes 100-199/200.
+    """
+    value = (headers or {}).get("Content-Range", "")
+    try:
+        return int(value.split()[1].split("-")[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _complete_length(headers) -> int | None:
+    """
+    Size of the whole file, from Content-Range: bytes */200 (or bytes 0-99/200).
+    """
+    value = (headers or {}).get("Content-Range", "")
+    try:
+        return int(value.rsplit("/", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _unlink(*paths: Path) -> None:
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+def file_sha256(path: Path):
+    """
+    Return a sha256 object fed with the file's content.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, mode="rb") as f:
+        while data := f.read(2**20):
+            sha256.update(data)
+    return sha256
+
+
+def _paged_xml(xml: str, *, offset: int, limit: int) -> str:
+    """
+    Return the search xml with the given offset and limit.
+    """
+    root = etree.fromstring(bytes(xml, "UTF-8"))
+    for searchN in root.xpath(
+        "/s:application/s:modules/s:module/s:search",
+        namespaces={"s": "http://www.zetcom.com/ria/ws/module/search"},
+    ):
+        searchN.set("offset", str(offset))
+        searchN.set("limit", str(limit))
+    return etree.tostring(root, encoding="unicode")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+"""
+Disk cache for module definitions. Definitions hardly ever change, but they are big;
+Client only downloads them again when the cached copy is older than ttl and even then
+asks the server with If-None-Match first, so an unchanged definition costs a 304.
+
+Chunky uses the definitions to validate the fields configured for a job (see
+'fields' and 'exclude_fields' in jobs.dsl) before it restricts its searches to them.
+
+USAGE
+    from MpApi.aio.definition import DefinitionCache, field_names
+
+    definitions = DefinitionCache(path="myjob/definitions", ttl=86400)
+    c = Client(baseURL=baseURL, definitions=definitions)
+    m = await c.get_definition2(session, mtype="Object")  # from disk while fresh
+    namesL = field_names(m, mtype="Object")
+"""
+
+import json
+from mpapi.module import Module
+from pathlib import Path
+import time
+
+
+def field_names(definition: Module, *, mtype: str) -> list:
+    """
+    Return the names of the top-level fields (system fields, data fields, repeatable
+    groups, references etc.) of mtype in a module definition.
+    """
+    return definition.xpath(
+        f"/m:application/m:modules/m:module[@name = '{mtype}']/*/@name"
+    )
+
+
+class DefinitionCache:
+    def __init__(self, *, path: str | Path, ttl: float = 86400) -> None:
+        """
+        path: directory for the cached definitions, created on first write
+        ttl:  seconds a cached definition is used without asking the server
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+
+    def get(self, mtype: str | None) -> tuple:
+        """
+        Return (xml, etag, fresh) for the cached definition of mtype (None for all
+        modules); xml is None if there is nothing cached.
+        """
+        xml_fn, meta_fn = self._paths(mtype)
+        if not xml_fn.exists() or not meta_fn.exists():
+            return None, None, False
+        with open(meta_fn, mode="r") as f:
+            meta = json.load(f)
+        fresh = time.time() - meta["fetched"] < self.ttl
+        return xml_fn.read_text(encoding="UTF-8"), meta["etag"], fresh
+
+    def put(self, mtype: str | None, *, xml: str, etag: str | None) -> None:
+        xml_fn, _ = self._paths(mtype)
+        self.path.mkdir(parents=True, exist_ok=True)
+        xml_fn.write_text(xml, encoding="UTF-8")
+        self._write_meta(mtype, etag=etag)
+
+    def touch(self, mtype: str | None, *, etag: str | None) -> None:
+        """
+        The server confirmed that the cached definition is still current.
+        """
+        self._write_meta(mtype, etag=etag)
+
+    #
+    # helpers
+    #
+
+    def _paths(self, mtype: str | None) -> tuple:
+        name = mtype if mtype is not None else "_all"
+        return self.path / f"{name}.xml", self.path / f"{name}.json"
+
+    def _write_meta(self, mtype: str | None, *, etag: str | None) -> None:
+        _, meta_fn = self._paths(mtype)
+        tmp = meta_fn.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump({"etag": etag, "fetched": time.time()}, f)
+        tmp.replace(meta_fn)
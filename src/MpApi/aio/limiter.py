@@ -0,0 +1,181 @@
+"""
+Adaptive concurrency limiter (AIMD) as an alternative to a fixed semaphore.
+
+MuseumPlus starts answering with 503 Service Unavailable somewhere between 100 and
+200 simultaneous requests (see test/learn_client_limit.py), but where exactly depends
+on the server's load. The limiter starts low, grows the number of requests in flight
+additively while the observed latency stays close to the best latency seen so far and
+cuts it multiplicatively on 503 (or 429) responses and timeouts.
+
+Latency is the time until the response headers arrive (if the request reports them,
+see _Slot.responded), so reading a large body doesn't count as the server being
+slow. Average and best latency are kept per endpoint, so a slow endpoint (e.g. saved
+queries) isn't compared with the best latency of a fast one (e.g. definitions).
+
+USAGE
+    from MpApi.aio.limiter import AdaptiveLimiter
+
+    limiter = AdaptiveLimiter(initial=10, minimum=2, maximum=150)
+    async with limiter.slot(endpoint="search") as slot:
+        async with session.post(url, data=xml) as response:
+            slot.responded()  # headers are here
+            xml = await response.text()
+    print(limiter.limit, limiter.latency)
+
+    c = Client(baseURL=baseURL, limiter=limiter)  # every request in a slot
+"""
+
+import asyncio
+from aiohttp.client_exceptions import ClientResponseError
+import time
+from types import TracebackType
+from typing import Optional, Type
+
+backoff_status = (429, 503)
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        *,
+        initial: int = 10,
+        minimum: int = 1,
+        maximum: int = 150,
+        decrease: float = 0.5,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+    ) -> None:
+        """
+        initial:   number of requests allowed in flight at the start
+        minimum:   never allow fewer requests in flight
+        maximum:   never allow more requests in flight
+        decrease:  factor the limit is multiplied with on 503/timeout
+        tolerance: grow only while latency < tolerance * best latency so far (per
+                   endpoint)
+        smoothing: weight of the newest observation in the latency average
+        """
+        if not minimum <= initial <= maximum:
+            raise ValueError(f"Expected {minimum=} <= {initial=} <= {maximum=}")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.in_flight = 0
+        self.latency: float | None = None  # moving average in seconds, all endpoints
+        self.latencies: dict = dict()  # endpoint -> [moving average, best]
+        self.increases = 0
+        self.decreases = 0
+        self._limit = float(initial)
+        self._last_decrease = 0.0
+        self._cond = None
+        self._loop = None
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def slot(self, *, endpoint: str | None = None) -> "_Slot":
+        """
+        Return an async context manager that waits for a free slot and reports the
+        outcome of the request made inside it back to the limiter.
+        """
+        return _Slot(self, endpoint=endpoint)
+
+    def report(self) -> str:
+        latency = f"{self.latency:.3f}s" if self.latency is not None else "n/a"
+        return (
+            f"adaptive limit {self.limit} (min {self.minimum}, max {self.maximum}), "
+            f"latency {latency}, {self.increases} increases, {self.decreases} decreases"
+        )
+
+    #
+    # helpers
+    #
+
+    async def _acquire(self) -> None:
+        # monk runs every command in its own event loop, but we want to keep what
+        # we learned about the server
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._cond = asyncio.Condition()
+            self._loop = loop
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def _release(
+        self, *, duration: float, exc: BaseException | None, endpoint: str | None
+    ) -> None:
+        # bookkeeping first, so that a cancellation while waiting for the lock
+        # doesn't leak a slot
+        self.in_flight -= 1
+        if exc is None:
+            self._on_success(duration, endpoint=endpoint)
+        elif self._is_overload(exc):
+            self._on_overload()
+        async with self._cond:
+            self._cond.notify_all()
+
+    def _is_overload(self, exc: BaseException) -> bool:
+        if isinstance(exc, ClientResponseError):
+            return exc.status in backoff_status
+        return isinstance(exc, asyncio.TimeoutError)
+
+    def _on_overload(self) -> None:
+        # many requests of the same window fail together; decrease once per window
+        now = time.monotonic()
+        if now - self._last_decrease < (self.latency or 0):
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.minimum), self._limit * self.decrease)
+        self.decreases += 1
+
+    def _on_success(self, duration: float, *, endpoint: str | None = None) -> None:
+        self.latency = self._average(self.latency, duration)
+        stats = self.latencies.setdefault(endpoint, [None, None])
+        stats[0] = latency = self._average(stats[0], duration)
+        if stats[1] is None or latency < stats[1]:
+            stats[1] = latency
+        if latency <= stats[1] * self.tolerance:
+            # +1 per round trip, i.e. +1/limit per successful request
+            before = self.limit
+            self._limit = min(float(self.maximum), self._limit + 1 / self._limit)
+            if self.limit > before:
+                self.increases += 1
+
+    def _average(self, average: float | None, duration: float) -> float:
+        if average is None:
+            return duration
+        return average + self.smoothing * (duration - average)
+
+
+class _Slot:
+    def __init__(self, limiter: AdaptiveLimiter, *, endpoint: str | None) -> None:
+        self.limiter = limiter
+        self.endpoint = endpoint
+        self.headers_at: float | None = None
+
+    async def __aenter__(self) -> "_Slot":
+        await self.limiter._acquire()
+        self.start = time.monotonic()
+        return self
+
+    def responded(self) -> None:
+        """
+        The response headers have arrived; latency ends here, not when the body has
+        been read.
+        """
+        if self.headers_at is None:
+            self.headers_at = time.monotonic()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ):
+        end = self.headers_at if self.headers_at is not None else time.monotonic()
+        await self.limiter._release(
+            duration=end - self.start, exc=exc, endpoint=self.endpoint
+        )
@@ -0,0 +1,154 @@
+"""
+Checkpoint manifest for one run of a command (e.g. apack group 1234), so that an
+interrupted run continues exactly where it stopped instead of re-downloading
+unfinished chunks.
+
+The manifest lives at jobname/{qtype}-{ID}.manifest.json and records
+- the run's date, which names the project dir (jobname/YYYYMMDD), so a run that
+  crosses midnight or is resumed a day later still writes to the same dir
+- for every unfinished chunk the sub-requests that completed (object page, each
+  related batch), whose responses are kept in jobname/YYYYMMDD/.partial/{chunk}/
+- the boundaries (offset, limit) of the chunks, if the chunk size is adaptive
+- in snapshot mode, the IDs of all results (in jobname/{qtype}-{ID}.snapshot.json)
+- whether the run is complete; the next run after a complete one starts afresh
+
+The manifest is rewritten atomically after every sub-request.
+
+USAGE
+    from MpApi.aio.manifest import Manifest
+
+    manifest = Manifest.open(job="myjob", run="group-1234")
+    m = manifest.get(chunk="group-1234-chunk3", key="objects")  # None if not done
+    manifest.put(chunk="group-1234-chunk3", key="objects", data=m)
+    manifest.finish_chunk(chunk="group-1234-chunk3")  # zip is written
+    manifest.finish()  # all chunks done
+"""
+
+import datetime
+import json
+from mpapi.module import Module
+from pathlib import Path
+import shutil
+
+
+class Manifest:
+    def __init__(
+        self,
+        *,
+        path: Path,
+        date: str,
+        chunks: dict = None,
+        boundaries: list = None,
+    ) -> None:
+        self.path = Path(path)
+        self.date = date
+        self.complete = False
+        self.chunks = chunks if chunks is not None else dict()
+        self.boundaries = boundaries if boundaries is not None else list()
+
+    @classmethod
+    def open(cls, *, job: str, run: str) -> "Manifest":
+        """
+        Resume the incomplete run with this identity or start a new one (today).
+        """
+        path = Path(job) / f"{run}.manifest.json"
+        if path.exists():
+            with open(path, mode="r") as f:
+                data = json.load(f)
+            if not data["complete"]:
+                print(f"resuming {run} from {data['date']}")
+                return cls(
+                    path=path,
+                    date=data["date"],
+                    chunks=data["chunks"],
+                    boundaries=data.get("boundaries"),
+                )
+        date = datetime.datetime.today().strftime("%Y%m%d")
+        manifest = cls(path=path, date=date)
+        manifest.save()
+        return manifest
+
+    @property
+    def project_dir(self) -> Path:
+        return self.path.parent / self.date
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.path.with_name(
+            self.path.name.replace(".manifest.json", ".snapshot.json")
+        )
+
+    def add_boundary(self, *, offset: int, limit: int) -> None:
+        self.boundaries.append([offset, limit])
+        self.save()
+
+    def finish(self) -> None:
+        self.complete = True
+        self.save()
+        self.snapshot_path.unlink(missing_ok=True)
+
+    def finish_chunk(self, *, chunk: str) -> None:
+        """
+        The chunk's zip is written; we don't need its partial results anymore.
+        """
+        self.chunks.pop(chunk, None)
+        self.save()
+        shutil.rmtree(self._partial_dir(chunk), ignore_errors=True)
+
+    def get(self, *, chunk: str, key: str) -> Module | None:
+        fn = self.chunks.get(chunk, {}).get(key)
+        if fn is None or not (self.project_dir / fn).exists():
+            return None
+        return Module(file=self.project_dir / fn)
+
+    def size(self, *, chunk: str, key: str) -> int:
+        """
+        Bytes of a sub-request's result on disk, 0 if there is none.
+        """
+        fn = self.chunks.get(chunk, {}).get(key)
+        if fn is None or not (self.project_dir / fn).exists():
+            return 0
+        return (self.project_dir / fn).stat().st_size
+
+    def get_snapshot(self) -> list | None:
+        if not self.snapshot_path.exists():
+            return None
+        with open(self.snapshot_path, mode="r") as f:
+            return json.load(f)
+
+    def put_snapshot(self, IDs: list) -> None:
+        """
+        Keep the IDs of the run's results; written once, so not part of the manifest.
+        """
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(IDs, f)
+        tmp.replace(self.snapshot_path)
+
+    def put(self, *, chunk: str, key: str, data: Module) -> None:
+        partial_dir = self._partial_dir(chunk)
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        fn = partial_dir / f"{key}.xml"
+        data.toFile(path=fn)
+        self.chunks.setdefault(chunk, {})[key] = str(fn.relative_to(self.project_dir))
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "date": self.date,
+            "complete": self.complete,
+            "chunks": self.chunks,
+            "boundaries": self.boundaries,
+        }
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, mode="w") as f:
+            json.dump(data, f, indent=1)
+        tmp.replace(self.path)
+
+    #
+    # helpers
+    #
+
+    def _partial_dir(self, chunk: str) -> Path:
+        return self.project_dir / ".partial" / chunk
@@ -0,0 +1,181 @@
+"""
+Metrics registry: counters, gauges and histograms with labels, exported as a
+Prometheus text file and a JSON summary at the end of a job.
+
+Client records per endpoint the number of requests, their latency, requests in
+flight, bytes sent and received, errors and retries; Chunky records how long each
+stage of a chunk (objects, related, save) took.
+
+A disabled registry (the default, see NO_METRICS) does nothing, so the calls can stay
+in hot paths.
+
+USAGE
+    from MpApi.aio.metrics import Metrics
+
+    metrics = Metrics()
+    metrics.inc("mpapi_requests_total", endpoint="search")
+    metrics.add("mpapi_requests_in_flight", 1, endpoint="search")
+    metrics.observe("mpapi_request_seconds", 0.35, endpoint="search")
+    with metrics.timer("mpapi_stage_seconds", stage="related"):
+        ...
+    metrics.write(prometheus="job/metrics.prom", json="job/metrics.json")
+"""
+
+import contextlib
+import json as jsonlib
+from pathlib import Path
+import time
+
+# upper bounds in seconds
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class Metrics:
+    def __init__(self, *, enabled: bool = True, buckets: tuple = BUCKETS) -> None:
+        self.enabled = enabled
+        self.buckets = buckets
+        self.counters: dict = dict()  # name -> {labels: value}
+        self.gauges: dict = dict()  # name -> {labels: [value, max]}
+        self.histograms: dict = dict()  # name -> {labels: [counts, sum, max]}
+
+    def add(self, name: str, value: float, **labels) -> None:
+        """
+        Change a gauge by value, e.g. +1/-1 for requests in flight.
+        """
+        if not self.enabled:
+            return
+        gauge = self.gauges.setdefault(name, {}).setdefault(_key(labels), [0, 0])
+        gauge[0] += value
+        gauge[1] = max(gauge[1], gauge[0])
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        counter = self.counters.setdefault(name, {})
+        key = _key(labels)
+        counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        histogram = self.histograms.setdefault(name, {})
+        key = _key(labels)
+        if key not in histogram:
+            histogram[key] = [[0] * len(self.buckets), 0.0, 0.0]
+        counts, _, _ = entry = histogram[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        entry[1] += value
+        entry[2] = max(entry[2], value)
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        gauge = self.gauges.setdefault(name, {}).setdefault(_key(labels), [0, 0])
+        gauge[0] = value
+        gauge[1] = max(gauge[1], value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observe the duration of the with block in histogram name.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_json(self) -> dict:
+        summary: dict = {"counters": {}, "gauges": {}, "histograms": {}}
+        for name, values in sorted(self.counters.items()):
+            summary["counters"][name] = [
+                {**dict(key), "value": value} for key, value in values.items()
+            ]
+        for name, values in sorted(self.gauges.items()):
+            summary["gauges"][name] = [
+                {**dict(key), "value": value, "max": peak}
+                for key, (value, peak) in values.items()
+            ]
+        for name, values in sorted(self.histograms.items()):
+            summary["histograms"][name] = [
+                {
+                    **dict(key),
+                    "count": sum(counts),
+                    "sum": total,
+                    "mean": total / sum(counts),
+                    "max": peak,
+                    "p50": self._quantile(counts, 0.5, peak),
+                    "p95": self._quantile(counts, 0.95, peak),
+                }
+                for key, (counts, total, peak) in values.items()
+            ]
+        return summary
+
+    def to_prometheus(self) -> str:
+        lines = list()
+        for name, values in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in values.items():
+                lines.append(f"{name}{_labels(key)} {value}")
+        for name, values in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, (value, _) in values.items():
+                lines.append(f"{name}{_labels(key)} {value}")
+        for name, values in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, (counts, total, _) in values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(
+                        f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels(key)} {total}")
+                lines.append(f"{name}_count{_labels(key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, *, prometheus: str | Path = None, json: str | Path = None) -> None:
+        if not self.enabled:
+            return
+        if prometheus is not None:
+            Path(prometheus).write_text(self.to_prometheus(), encoding="UTF-8")
+        if json is not None:
+            with open(json, mode="w") as f:
+                jsonlib.dump(self.to_json(), f, indent=1)
+
+    #
+    # helpers
+    #
+
+    def _quantile(self, counts: list, q: float, peak: float) -> float:
+        """
+        Upper bound of the bucket that holds quantile q (at most the max seen).
+        """
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, peak)
+        return peak
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in key) + "}"
+
+
+# default for everything that takes metrics
+NO_METRICS = Metrics(enabled=False)
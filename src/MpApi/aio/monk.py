@@ -4,10 +4,13 @@ monk - a cli frontend to MpApi.aio and asynchronous replacement for mink to down
 
 CLI USAGE
     monk -j jobname # expect jobs.dsl in pwd
+    monk -j jobname --plan # only count results and chunks per command
+    monk -j jobname --trace out.json # request timeline for chrome://tracing
 
 DSL format
     .oonf: # optional
         chunkSize 1000 # optional, defaults to 1000
+        chunkSize auto 20MB 500 # optional, aim for 20MB (or 30s) per chunk, first 500
         modules Artist, Multimedia Object # optional, defaults to Artist, Multimedia and Object
         
     test:
@@ -42,11 +45,24 @@ import datetime  # still import
 from mpapi.constants import get_credentials
 
 # import MpApi.aio.client as client
+from MpApi.aio.attachments import Attachments
+from MpApi.aio.cache import RelatedCache
 from MpApi.aio.chunky import Chunky
+from MpApi.aio.client import Transfer
+from MpApi.aio.definition import DefinitionCache
+from MpApi.aio.limiter import AdaptiveLimiter
+from MpApi.aio.metrics import Metrics
+from MpApi.aio.plan import Command, History, JobPlan
+from MpApi.aio.retry import RetryPolicy
 from MpApi.aio.session import Session
+from MpApi.aio.sink import make_sinks, sink_types
+from MpApi.aio.sizer import parse_target
+from MpApi.aio.store import RecordStore
+from MpApi.aio.trace import Tracer
 from pathlib import Path
 import signal
 import sys
+import time
 
 
 class ConfigError(Exception):
@@ -54,19 +70,72 @@ class ConfigError(Exception):
 
 
 class Monk:
-    def __init__(self, *, conf_fn: str = "jobs.dsl") -> None:
+    def __init__(
+        self,
+        *,
+        conf_fn: str = "jobs.dsl",
+        baseURL: str = None,
+        user: str = None,
+        pw: str = None,
+        trace: str = None,
+    ) -> None:
+        """
+        Credentials default to mpapi's get_credentials; pass baseURL, user and pw to
+        talk to a different server, e.g. the offline stand-in in test/fake_ria.py.
+
+        trace: path of a Chrome trace-event file with the timeline of all requests
+        """
         self.conf_fn = conf_fn
-        user, pw, baseURL = get_credentials()
+        if baseURL is None:
+            user, pw, baseURL = get_credentials()
         self.baseURL = baseURL
         self.user = user
         self.pw = pw
+        self.trace = trace
+        self.tracer = Tracer() if trace is not None else None
+        self.chunk_size = 1000  # default
+        self.chunk_target = None  # (target, unit) if 'chunkSize auto'
         self.exclude_modules = []
         self.parallel_chunks = 1  # default
         self.semaphore = 11  # default
+        self.stream = False  # default
+        self.adaptive = None  # (min, max) if 'semaphore adaptive'
+        self.limiter = None  # job-scoped AdaptiveLimiter, see _init_cmd
+        self.post_workers = 0  # default: post-processing in the event loop
+        self.retry = RetryPolicy()  # job-scoped, see 'retry' and 'retry_budget'
+        self.transfer = Transfer()  # job-scoped byte counts
+        self.metrics = Metrics(enabled=False)  # see 'metrics'; written at job end
+        self.related_batch = None  # default: one query per related module
+        self.cache = None  # job-scoped RelatedCache, see _init_cmd
+        self.cache_size = None  # default: no cache
+        self.cache_file = None  # default: in memory only
+        self.store = None  # RecordStore, see _init_cmd
+        self.attachments = None  # job-scoped Attachments, see _init_cmd
+        self.sink_names = ["zip"]  # default: zipped XML per chunk
+        self.sinks = None  # job-scoped sinks, see _init_cmd
+        self.attachment_workers = 0  # default: no attachments
+        self.verify_attachments = False  # default: compare size only
+        self.use_store = False  # default
+        self.incremental = False  # default
+        self.checkpoint = True  # default: resume interrupted runs
+        self.snapshot = False  # default: chunks by offset
+        self.validate = True  # default: validate every search
+        self.fields = dict()  # mtype -> fields to request, default: all
+        self.exclude_fields = dict()  # mtype -> fields not to request
+        self.definition_ttl = 86400  # seconds; definitions cached in jobname/
+        self.commands = None  # default: one command after the other, see 'commands'
+        self.records = 0  # records downloaded in this run, see History
         # related modules NOT to include in chunks
         # specify in jobs.dsl
 
-    async def apack(self, *, qtype: str, ID: int):
+    async def apack(
+        self,
+        *,
+        qtype: str,
+        ID: int,
+        session: aiohttp.ClientSession = None,
+        sem: asyncio.Semaphore = None,
+    ):
         """
         We need to get data for every module mentioned in self.modules. We need to chunk the
         responses and save results as zip file. This time we want deterministic chunks, so we
@@ -79,46 +148,74 @@ class Monk:
         plan the chunks; for each chunk
            get the objects
            find out which related target records in that data
+
+        If session is given, the command uses it (and sem as job-wide budget) instead
+        of opening its own, see _run_commands.
         """
 
         print(f"apack with {qtype} {ID}")
-        chnkr = self._init_cmd()
-
-        async with Session(user=self.user, pw=self.pw, max_connection=100) as session:
-            try:
+        chnkr = self._init_cmd(sem=sem)
+        try:
+            if session is not None:
                 await chnkr.apack_all_chunks(
-                    session,
-                    ID=ID,
-                    job=self.job,
-                    qtype=qtype,
+                    session, ID=ID, job=self.job, qtype=qtype
                 )
-            except* Exception as e:
-                print("... attempting graceful shutdown (monk.py:105)")
-                await session.close()
-                raise e
+                return
 
-    async def query(self, *, ID, target):
-        print(f"query with {ID} {target}")
-        chnkr = self._init_cmd()
+            async with self._session() as session:
+                try:
+                    await chnkr.apack_all_chunks(
+                        session,
+                        ID=ID,
+                        job=self.job,
+                        qtype=qtype,
+                    )
+                except* Exception as e:
+                    # Session closes on leaving the with block
+                    print("... attempting graceful shutdown (monk.py:105)")
+                    raise e
+        finally:
+            self.records += chnkr.records
 
-        async with Session(user=self.user, pw=self.pw, max_connection=100) as session:
-            try:
+    async def query(
+        self,
+        *,
+        ID,
+        target,
+        session: aiohttp.ClientSession = None,
+        sem: asyncio.Semaphore = None,
+    ):
+        print(f"query with {ID} {target}")
+        chnkr = self._init_cmd(sem=sem)
+        try:
+            if session is not None:
                 await chnkr.query_all_chunks(
-                    session,
-                    ID=ID,
-                    job=self.job,
-                    target=target,
+                    session, ID=ID, job=self.job, target=target
                 )
-            except* Exception as e:
-                print("... attempting graceful shutdown (monk.py:113)")
-                await session.close()
-                raise e
+                return
 
-    def run_job(self, *, job: str) -> None:
+            async with self._session() as session:
+                try:
+                    await chnkr.query_all_chunks(
+                        session,
+                        ID=ID,
+                        job=self.job,
+                        target=target,
+                    )
+                except* Exception as e:
+                    # Session closes on leaving the with block
+                    print("... attempting graceful shutdown (monk.py:113)")
+                    raise e
+        finally:
+            self.records += chnkr.records
+
+    def parse_job(self, *, job: str) -> JobPlan:
         """
-        Parse the dsl file at self.conf_fn and run the provided job.
+        Parse the dsl file at self.conf_fn: apply the config values and return the
+        commands of the provided job as a JobPlan.
         """
         self.job = job
+        plan = JobPlan(job=job)
         any_job = False
         with open(self.conf_fn, mode="r") as file:
             c = 0  # line counter
@@ -149,7 +246,16 @@ class Monk:
                         inside_conf = False
                 else:
                     if inside_conf:
-                        if parts[0] == "chunkSize":
+                        if parts[0] == "chunkSize" and parts[1] == "auto":
+                            try:
+                                self.chunk_target = parse_target(parts[2])
+                            except (IndexError, ValueError):
+                                raise ConfigError(
+                                    "Expected 'chunkSize auto 20MB|30s [initial]'"
+                                )
+                            if len(parts) > 3:
+                                self.chunk_size = int(parts[3])
+                        elif parts[0] == "chunkSize":
                             self.chunk_size = int(parts[1])
                         elif parts[0] == "exclude_modules":
                             for each in parts[1:]:
@@ -158,7 +264,66 @@ class Monk:
                         elif parts[0] == "chunks":
                             self.parallel_chunks = int(parts[1].strip())
                         elif parts[0] == "semaphore":
-                            self.semaphore = int(parts[1].strip())
+                            if parts[1].strip() == "adaptive":
+                                # semaphore adaptive [min max]
+                                limits = [int(each) for each in parts[2:4]]
+                                self.adaptive = tuple(limits) if limits else (2, 150)
+                            else:
+                                self.semaphore = int(parts[1].strip())
+                        elif parts[0] == "post_workers":
+                            self.post_workers = int(parts[1].strip())
+                        elif parts[0] == "retry":
+                            # retry 4 search=6 definition=2
+                            self.retry.attempts = int(parts[1].strip())
+                            for each in parts[2:]:
+                                endpoint, attempts = each.split("=", 1)
+                                self.retry.endpoints[endpoint] = int(attempts)
+                        elif parts[0] == "retry_budget":
+                            budget = parts[1].strip()
+                            self.retry.budget = None if budget == "none" else int(budget)
+                        elif parts[0] == "cache":
+                            self.cache_size = int(parts[1].strip())
+                            if len(parts) > 2:
+                                self.cache_file = parts[2].strip()
+                        elif parts[0] == "store":
+                            self.use_store = self._bool(parts)
+                        elif parts[0] == "sinks":
+                            self.sink_names = [
+                                each.strip().replace(",", "") for each in parts[1:]
+                            ]
+                            if not set(self.sink_names) <= set(sink_types):
+                                raise ConfigError(
+                                    f"Unknown sinks: {self.sink_names}; "
+                                    f"expected some of {sink_types}"
+                                )
+                        elif parts[0] == "attachments":
+                            self.attachment_workers = int(parts[1].strip())
+                            self.verify_attachments = "verify" in parts[2:]
+                        elif parts[0] == "incremental":
+                            self.incremental = self._bool(parts)
+                        elif parts[0] == "related_batch":
+                            self.related_batch = int(parts[1].strip())
+                        elif parts[0] in ("fields", "exclude_fields"):
+                            # fields Person __id PerNennformTxt
+                            projection = getattr(self, parts[0])
+                            for each in parts[2:]:
+                                each = each.strip().replace(",", "")
+                                if each:
+                                    projection.setdefault(parts[1], []).append(each)
+                        elif parts[0] == "definition_ttl":
+                            self.definition_ttl = int(parts[1].strip())
+                        elif parts[0] == "metrics":
+                            self.metrics.enabled = self._bool(parts)
+                        elif parts[0] == "commands":
+                            self.commands = int(parts[1].strip())
+                        elif parts[0] == "checkpoint":
+                            self.checkpoint = self._bool(parts)
+                        elif parts[0] == "snapshot":
+                            self.snapshot = self._bool(parts)
+                        elif parts[0] == "validate":
+                            self.validate = self._bool(parts)
+                        elif parts[0] == "stream":
+                            self.stream = self._bool(parts)
                         else:
                             print(
                                 f"WARNING: Ignoring unknown config value '{parts[0]}'"
@@ -166,43 +331,258 @@ class Monk:
 
                     if active_job:
                         if parts[0] == "apack":
-                            try:
-                                asyncio.run(
-                                    self.apack(qtype=parts[1], ID=int(parts[2]))
-                                )
-                            except KeyboardInterrupt:
-                                asyncio.run(self._close())
+                            plan.add(
+                                Command(action="apack", qtype=parts[1], ID=parts[2])
+                            )
                         elif parts[0] == "query":
-                            try:
-                                asyncio.run(
-                                    self.query(ID=int(parts[1]), target=parts[2])
-                                )
-                            except KeyboardInterrupt:
-                                asyncio.run(self._close())
+                            plan.add(
+                                Command(action="query", ID=parts[1], target=parts[2])
+                            )
                         else:
                             print(
                                 f"WARNING: Ignoring unknown command keyword '{parts[0]}'"
                             )
         if any_job == False:
             print("Didn't find a matching job in dsl file!")
+        return plan
+
+    def plan_job(self, *, job: str) -> None:
+        """
+        Parse the dsl file and print how many records and chunks every command of
+        the job would download, and an estimate how long it would take. Counts all
+        commands concurrently; downloads no records.
+        """
+        plan = self.parse_job(job=job)
+        counts = asyncio.run(self._count_plan(plan))
+        # with 'chunkSize auto' the chunk size changes during the run
+        estimated = self.chunk_target is not None
+        print(
+            plan.report(counts=counts, history=self._history(), estimated=estimated)
+        )
+
+    def run_job(self, *, job: str) -> None:
+        """
+        Parse the dsl file at self.conf_fn and run the provided job.
+        """
+        plan = self.parse_job(job=job)
+        start = time.perf_counter()
+        if self.commands:
+            try:
+                asyncio.run(self._run_commands(plan))
+            except KeyboardInterrupt:
+                asyncio.run(self._close())
+        else:
+            for command in plan:
+                try:
+                    asyncio.run(self._command(command))
+                except KeyboardInterrupt:
+                    asyncio.run(self._close())
+        self._history().add(
+            records=self.records,
+            seconds=time.perf_counter() - start,
+            wire=self.transfer.wire,
+        )
+        if self.cache is not None:
+            self.cache.save()
+            print(self.cache.report())
+        print(self.retry.report())
+        print(self.transfer.report())
+        if self.tracer is not None:
+            self.tracer.write(self.trace)
+        if self.metrics.enabled:
+            project_dir = Path(self.job)
+            project_dir.mkdir(parents=True, exist_ok=True)
+            self.metrics.write(
+                prometheus=project_dir / "metrics.prom",
+                json=project_dir / "metrics.json",
+            )
+            print(f"metrics written to {project_dir}/metrics.{{prom,json}}")
+        if self.limiter is not None:
+            print(self.limiter.report())
+        if self.attachments is not None:
+            print(self.attachments.report())
+        for sink in self.sinks or []:
+            sink.close()
+        if self.store is not None:
+            print(f"record store {self.store.path}: {len(self.store)} records")
+            self.store.close()
 
     #
     # helpers
     #
 
     async def _close(self) -> None:
+        # asyncio.run has cancelled the command and its session is closed already
         print("...graceful shutdown (monk.py 173)!")
-        await self.session.close()
+        if self.checkpoint:
+            print("interrupted; run the job again to resume where it stopped")
+
+    def _command(self, command: Command, **kwargs):
+        """
+        Return the coro that runs the command; kwargs go to apack or query.
+        """
+        if command.action == "apack":
+            return self.apack(qtype=command.qtype, ID=command.ID, **kwargs)
+        return self.query(ID=command.ID, target=command.target, **kwargs)
+
+    async def _count_plan(self, plan: JobPlan) -> list:
+        """
+        Return (number of results, number of chunks) for every command of the plan.
+        In snapshot mode chunks are cut from the list of IDs, as in Chunky._size_run.
+        """
+        chnkr = Chunky(
+            baseURL=self.baseURL,
+            chunk_size=self.chunk_size,
+            semaphore=self._semaphore(),
+            retry=self.retry,
+        )
+        sem = asyncio.Semaphore(self._semaphore())
+
+        async def count(command: Command) -> tuple:
+            target = "Object" if command.action == "apack" else command.target
+            async with sem:
+                rno, cmax = await chnkr._count_results(
+                    session, qtype=command.qtype, target=target, ID=command.ID
+                )
+            if self.snapshot:
+                cmax = -(-rno // self.chunk_size)
+            return rno, cmax
+
+        async with self._session() as session:
+            return await asyncio.gather(*[count(command) for command in plan])
+
+    def _history(self) -> History:
+        return History(path=Path(self.job) / "history.json")
 
-    def _init_cmd(self) -> Chunky:
+    async def _run_commands(self, plan: JobPlan) -> None:
+        """
+        Run the commands of the job in one event loop on one shared Session,
+        up to self.commands of them at a time. They share one semaphore, so the
+        semaphore value is a job-wide budget rather than one per command.
+        """
+        semaphore = self._semaphore()
+        # every chunk holds one permit while it waits for its related records
+        holders = self.commands * self.parallel_chunks
+        if semaphore <= holders:
+            raise ConfigError(
+                f"semaphore {semaphore} too small for {self.commands} commands with "
+                f"{self.parallel_chunks} chunks each; needs more than {holders}"
+            )
+        sem = asyncio.Semaphore(semaphore)
+        slots = asyncio.Semaphore(self.commands)
+        print(f"running {len(plan)} commands, {self.commands} at a time")
+
+        async def run(command: Command) -> None:
+            async with slots:
+                await self._command(command, session=session, sem=sem)
+
+        async with self._session() as session:
+            async with asyncio.TaskGroup() as tg:
+                for command in plan:
+                    tg.create_task(run(command))
+
+    def _session(self) -> Session:
+        trace_configs = None
+        if self.tracer is not None:
+            trace_configs = [self.tracer.trace_config()]
+        return Session(
+            user=self.user,
+            pw=self.pw,
+            max_connection=self._max_connection(),
+            compress=True,  # Client decompresses and counts the bytes
+            trace_configs=trace_configs,
+        )
+
+    def _semaphore(self) -> int:
+        if self.adaptive is not None:
+            return self.adaptive[1]  # the limiter does the limiting
+        return self.semaphore
+
+    def _max_connection(self) -> int:
+        """
+        In adaptive mode, the connector shouldn't cap the limiter's maximum.
+        """
+        if self.adaptive is not None:
+            return max(100, self.adaptive[1])
+        return 100
+
+    def _bool(self, parts: list) -> bool:
+        """
+        A config value that is switched on by its keyword alone or by true/yes/on.
+        """
+        if len(parts) == 1:
+            return True
+        value = parts[1].strip().lower()
+        if value in ("true", "yes", "on"):
+            return True
+        elif value in ("false", "no", "off"):
+            return False
+        raise ConfigError(f"Expected true or false for '{parts[0]}', got '{parts[1]}'")
+
+    def _init_cmd(self, *, sem: asyncio.Semaphore = None) -> Chunky:
         # chunk_size and exclude_modules are set during run_job
         print(f"chunk_size {self.chunk_size} objects per chunk")
+        if self.chunk_target is not None:
+            if not self.checkpoint:
+                raise ConfigError("'chunkSize auto' needs 'checkpoint true'")
+            target, unit = self.chunk_target
+            print(f"   adaptive: aiming for {target:g} {unit} per chunk")
         print(f"exclude modules {self.exclude_modules}")
+        if self.cache_size and self.cache is None:
+            path = None
+            if self.cache_file is not None:
+                path = Path(self.job) / self.cache_file
+                path.parent.mkdir(parents=True, exist_ok=True)
+            self.cache = RelatedCache(max_items=self.cache_size, path=path)
+            self.cache.load()
+        if (self.use_store or self.incremental) and self.store is None:
+            project_dir = Path(self.job)
+            project_dir.mkdir(parents=True, exist_ok=True)
+            self.store = RecordStore(path=project_dir / "records.sqlite")
+        if self.sinks is None:
+            self.sinks = make_sinks(self.sink_names)
+        if self.attachment_workers and self.attachments is None:
+            self.attachments = Attachments(
+                path=Path(self.job) / "attachments",
+                workers=self.attachment_workers,
+                verify=self.verify_attachments,
+            )
+        if self.adaptive is not None:
+            minimum, maximum = self.adaptive
+            if self.limiter is None:
+                self.limiter = AdaptiveLimiter(
+                    initial=min(max(10, minimum), maximum),
+                    minimum=minimum,
+                    maximum=maximum,
+                )
         chnkr = Chunky(
             baseURL=self.baseURL,
             chunk_size=self.chunk_size,
+            chunk_target=self.chunk_target,
             exclude_modules=self.exclude_modules,
-            semaphore=self.semaphore,
+            semaphore=self._semaphore(),
+            job_semaphore=sem,
             parallel_chunks=self.parallel_chunks,
+            stream=self.stream,
+            related_batch=self.related_batch,
+            cache=self.cache,
+            store=self.store,
+            incremental=self.incremental,
+            limiter=self.limiter,
+            retry=self.retry,
+            post_workers=self.post_workers,
+            checkpoint=self.checkpoint,
+            definitions=DefinitionCache(
+                path=Path(self.job) / "definitions", ttl=self.definition_ttl
+            ),
+            fields=self.fields,
+            exclude_fields=self.exclude_fields,
+            transfer=self.transfer,
+            metrics=self.metrics,
+            tracer=self.tracer,
+            snapshot=self.snapshot,
+            attachments=self.attachments,
+            sinks=self.sinks,
+            validate=self.validate,
         )
         return chnkr
@@ -0,0 +1,143 @@
+"""
+Job plan: the commands of a job in jobs.dsl, parsed once and then either run or just
+counted (monk --plan). Counting asks the server for the number of results of every
+command, all at the same time, without downloading any records, and estimates the
+time from the throughput of earlier runs of the job (jobname/history.json).
+
+USAGE
+    from MpApi.aio.plan import Command, JobPlan, History
+
+    plan = JobPlan(job="test")
+    plan.add(Command(action="apack", qtype="group", ID=1234))
+    plan.add(Command(action="query", ID=5678, target="Object"))
+
+    history = History(path="test/history.json")
+    print(plan.report(counts=[(2500, 3), (20, 1)], history=history))
+    history.add(records=2520, seconds=93.2, wire=31457280)
+
+    monk -j test --plan
+"""
+
+import datetime
+import json
+from pathlib import Path
+
+
+class Command:
+    def __init__(
+        self, *, action: str, ID: int, qtype: str = "query", target: str = "Object"
+    ) -> None:
+        """
+        action: apack or query
+        qtype:  query type of apack (approval, exhibit, group, loc); query for query
+        target: module type the query gets back; apack always gets Objects
+        """
+        self.action = action
+        self.ID = int(ID)
+        self.qtype = qtype
+        self.target = target
+
+    def __str__(self) -> str:
+        if self.action == "query":
+            return f"query {self.ID} {self.target}"
+        return f"{self.action} {self.qtype} {self.ID}"
+
+
+class JobPlan:
+    def __init__(self, *, job: str) -> None:
+        self.job = job
+        self.commands: list = list()
+
+    def __iter__(self):
+        return iter(self.commands)
+
+    def __len__(self) -> int:
+        return len(self.commands)
+
+    def add(self, command: Command) -> None:
+        self.commands.append(command)
+
+    def report(
+        self, *, counts: list, history: "History | None" = None, estimated: bool = False
+    ) -> str:
+        """
+        counts:    (number of results, number of chunks) per command, in order
+        estimated: chunk counts are only estimates (e.g. 'chunkSize auto')
+        """
+        tilde = "~" if estimated else " "
+        lines = [f"plan for job '{self.job}': {len(self)} commands"]
+        for command, (rno, cmax) in zip(self.commands, counts):
+            lines.append(
+                f"   {str(command):<30} {rno:>9} records {tilde}{cmax:>5} chunks"
+                f"{self._estimate(rno, history)}"
+            )
+        total = sum(rno for rno, _ in counts)
+        chunks = sum(cmax for _, cmax in counts)
+        lines.append(
+            f"   {'total':<30} {total:>9} records {tilde}{chunks:>5} chunks"
+            f"{self._estimate(total, history)}"
+        )
+        if estimated:
+            lines.append(
+                "~ chunk counts are estimates: the chunk size adapts during the run"
+            )
+        if history is None or not history.runs:
+            lines.append("no estimate: no earlier runs of this job")
+        else:
+            lines.append(
+                f"estimate based on {len(history.runs)} earlier runs: "
+                f"{history.records_per_second():.1f} records/s"
+            )
+        return "\n".join(lines)
+
+    #
+    # helpers
+    #
+
+    def _estimate(self, records: int, history: "History | None") -> str:
+        if history is None or not history.runs:
+            return ""
+        seconds = records / history.records_per_second()
+        estimate = f"   ~{datetime.timedelta(seconds=round(seconds))}"
+        bytes_per_record = history.bytes_per_record()
+        if bytes_per_record:
+            estimate += f" ~{records * bytes_per_record / 2**20:.1f} MB"
+        return estimate
+
+
+class History:
+    """
+    Throughput of the last runs of a job: records, seconds and bytes on the wire.
+    """
+
+    def __init__(self, *, path: str | Path, keep: int = 10) -> None:
+        self.path = Path(path)
+        self.keep = keep
+        self.runs: list = list()
+        if self.path.exists():
+            with open(self.path, mode="r") as f:
+                self.runs = json.load(f)
+
+    def add(self, *, records: int, seconds: float, wire: int) -> None:
+        if not records or not seconds:
+            return  # nothing was downloaded, e.g. everything existed already
+        self.runs.append(
+            {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "records": records,
+                "seconds": seconds,
+                "wire": wire,
+            }
+        )
+        self.runs = self.runs[-self.keep :]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, mode="w") as f:
+            json.dump(self.runs, f, indent=1)
+
+    def bytes_per_record(self) -> float:
+        records = sum(run["records"] for run in self.runs)
+        return sum(run["wire"] for run in self.runs) / records if records else 0
+
+    def records_per_second(self) -> float:
+        seconds = sum(run["seconds"] for run in self.runs)
+        return sum(run["records"] for run in self.runs) / seconds if seconds else 0
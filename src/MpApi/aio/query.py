@@ -0,0 +1,116 @@
+"""
+Search XML for the queries we send all the time (records by ID, one or more
+equalsField criteria, a projection, saved queries), written directly as a string
+instead of being built with mpapi's Search and serialized.
+
+Queries are validated against the search schema, which is parsed and compiled only
+once per process. Validation can be switched off (Client's validate, validate false
+in jobs.dsl) once the queries of a job are known to be good.
+
+USAGE
+    from MpApi.aio.query import ids_xml, search_xml, validate_xml
+
+    xml = search_xml(
+        mtype="Object",
+        criteria=[("equalsField", "ObjObjectGroupsRef.__id", 1234)],
+        fields=["__id", "ObjObjectNumberTxt"],
+        limit=100,
+        offset=200,
+    )
+    xml = ids_xml(mtype="Person", IDs=[1, 2, 3], fields=["PerNennformTxt"])
+    validate_xml(xml)  # raises lxml.etree.DocumentInvalid
+"""
+
+import functools
+from lxml import etree  # type: ignore
+import mpapi
+from mpapi.search import Search
+from pathlib import Path
+from xml.sax.saxutils import quoteattr
+
+SEARCH_NS = "http://www.zetcom.com/ria/ws/module/search"
+
+
+def search_xml(
+    *,
+    mtype: str,
+    criteria: list | None = None,
+    join: str = "and",
+    fields: list | None = None,
+    limit: int = -1,
+    offset: int = 0,
+) -> str:
+    """
+    Return the search XML for mtype; the same as Search would produce.
+
+    criteria: list of (operator, field, value), e.g. ("equalsField", "__id", 1)
+    join:     "and" or "or", only used if there is more than one criterion
+    fields:   fields to request (select), None for all
+    """
+    if join not in ("and", "or"):
+        raise ValueError(f"Unknown join: {join}")
+    parts = [
+        f'<application xmlns="{SEARCH_NS}"><modules><module name={quoteattr(mtype)}>'
+        f'<search limit="{int(limit)}" offset="{int(offset)}">'
+    ]
+    if fields:
+        parts.append("<select>")
+        parts += [f"<field fieldPath={quoteattr(field)}/>" for field in fields]
+        parts.append("</select>")
+    if criteria:
+        parts.append(f"<expert module={quoteattr(mtype)}>")
+        if len(criteria) > 1:
+            parts.append(f"<{join}>")
+        for operator, field, value in criteria:
+            operand = quoteattr(str(value))
+            parts.append(f"<{operator} fieldPath={quoteattr(field)} operand={operand}/>")
+        if len(criteria) > 1:
+            parts.append(f"</{join}>")
+        parts.append("</expert>")
+    parts.append("</search></module></modules></application>")
+    return "".join(parts)
+
+
+def ids_xml(
+    *, mtype: str, IDs: list, fields: list | None = None, limit: int = -1
+) -> str:
+    """
+    Return the search XML for the records of mtype with the given IDs.
+    """
+    criteria = [("equalsField", "__id", ID) for ID in IDs]
+    return search_xml(
+        mtype=mtype, criteria=criteria, join="or", fields=fields, limit=limit
+    )
+
+
+def validate_xml(xml: str) -> None:
+    """
+    Validate search XML against the search schema; raises etree.DocumentInvalid.
+    Without the schema on disk, falls back to mpapi's Search.validate.
+    """
+    schema = _schema()
+    if schema is None:
+        Search(fromString=xml).validate(mode="search")
+        return
+    schema.assertValid(etree.fromstring(xml.encode()))
+
+
+@functools.cache
+def _schema() -> etree.XMLSchema | None:
+    """
+    The newest search schema shipped with mpapi, parsed and compiled once per
+    process.
+    """
+    found = sorted(Path(mpapi.__file__).parent.rglob("search_*.xsd"), key=_version)
+    if not found:
+        return None
+    return etree.XMLSchema(etree.parse(str(found[-1])))
+
+
+def _version(path: Path) -> tuple:
+    """
+    Version of a schema file as numbers, e.g. (1, 10) for search_1_10.xsd, so that
+    it sorts after search_1_9.xsd.
+    """
+    parts = path.stem.split("_")[1:]
+    return tuple(int(part) for part in parts if part.isdigit())
@@ -0,0 +1,119 @@
+"""
+Retry policy for Client: transient failures (503 and friends, timeouts, dropped
+connections) are retried with exponential backoff and full jitter instead of
+failing the whole chunk or job.
+
+- max attempts can be set per endpoint (definition, search, savedQuery)
+- a Retry-After header sent by the server takes precedence over our own backoff
+- a budget limits the number of retries per job, so a server that is really down
+  still fails the job eventually
+- retries are counted per chunk (see current_chunk in MpApi.aio.client)
+
+USAGE
+    from MpApi.aio.retry import RetryPolicy
+
+    retry = RetryPolicy(attempts=4, endpoints={"search": 6}, budget=200)
+    c = Client(baseURL=baseURL, retry=retry)
+    ...
+    print(retry.report())
+"""
+
+import aiohttp
+from aiohttp.client_exceptions import ClientResponseError
+import asyncio
+from collections import Counter
+import datetime
+from email.utils import parsedate_to_datetime
+import random
+
+retry_status = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        *,
+        attempts: int = 4,
+        endpoints: dict | None = None,
+        base: float = 1.0,
+        cap: float = 60.0,
+        budget: int | None = 100,
+    ) -> None:
+        """
+        attempts:  max number of attempts per request (1 = no retries)
+        endpoints: max attempts for specific endpoints, e.g. {"definition": 2}
+        base:      backoff before the first retry in seconds; doubles every retry
+        cap:       max backoff in seconds, also caps Retry-After
+        budget:    max number of retries per job, None for no limit
+        """
+        self.attempts = int(attempts)
+        self.endpoints = endpoints if endpoints is not None else dict()
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.retries = 0
+        self.per_chunk: Counter = Counter()
+        self.per_endpoint: Counter = Counter()
+
+    def delay(self, exc: BaseException, *, attempt: int) -> float:
+        """
+        Seconds to wait before the next attempt: Retry-After if the server sent it,
+        otherwise exponential backoff with full jitter.
+        """
+        retry_after = self._retry_after(exc)
+        if retry_after is not None:
+            return min(self.cap, retry_after)
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def max_attempts(self, endpoint: str) -> int:
+        return int(self.endpoints.get(endpoint, self.attempts))
+
+    def report(self) -> str:
+        endpoints = ", ".join(f"{k} {v}" for k, v in sorted(self.per_endpoint.items()))
+        budget = f" of {self.budget}" if self.budget is not None else ""
+        return f"retries: {self.retries}{budget} ({endpoints or 'none'})"
+
+    def retryable(self, exc: BaseException) -> bool:
+        if isinstance(exc, ClientResponseError):
+            return exc.status in retry_status
+        return isinstance(
+            exc,
+            (
+                asyncio.TimeoutError,
+                aiohttp.ClientConnectionError,
+                aiohttp.ClientPayloadError,
+            ),
+        )
+
+    def spend(self, *, endpoint: str, attempt: int, exc: BaseException, chunk) -> bool:
+        """
+        Decide whether to retry after exc; if so, count the retry (per job, chunk
+        and endpoint) and return True.
+        """
+        if not self.retryable(exc) or attempt >= self.max_attempts(endpoint):
+            return False
+        if self.budget is not None and self.retries >= self.budget:
+            print(f"   retry budget of {self.budget} exhausted")
+            return False
+        self.retries += 1
+        self.per_chunk[chunk] += 1
+        self.per_endpoint[endpoint] += 1
+        return True
+
+    #
+    # helpers
+    #
+
+    def _retry_after(self, exc: BaseException) -> float | None:
+        headers = getattr(exc, "headers", None)
+        if not headers or "Retry-After" not in headers:
+            return None
+        value = headers["Retry-After"].strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        now = datetime.datetime.now(tz=when.tzinfo)
+        return max(0.0, (when - now).total_seconds())
@@ -3,20 +3,31 @@ This is an experimental version of session that
 - actually returns the ClientSession and 
 - doesn't contain baseURL
 - provides only context manager
+- with compress, negotiates compressed responses (gzip, deflate and br if brotli
+  is installed); they are not decompressed by aiohttp, but by
+  MpApi.aio.client.Client, which counts the bytes on the wire and after
+  decompression. Only use such a session with Client.
 
 from MpApi.aio.session2 import Session
     with Session(user=user, pw=pw) as session:
         print (session)
 
+    # for Client: compressed bodies, decompressed and counted by Client
+    with Session(user=user, pw=pw, compress=True) as session:
+        m = await client.search2(session, query=q)
+
 """
 
 import aiohttp
-import asyncio
 from types import TracebackType
-from typing import Any, Optional, Self, Type
-from yarl import URL
+from typing import Optional, Self, Type
+
+try:
+    import brotli  # type: ignore # noqa: F401
 
-DEBUG = True
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
 
 
 class Session:
@@ -34,6 +45,8 @@ class Session:
         pw: str,
         max_connection: int = 100,
         timeout: float | None = None,
+        compress: bool = False,
+        trace_configs: list | None = None,
     ) -> None:
         """
         * user
@@ -42,33 +55,41 @@ class Session:
           None the connector has no limit (default: 100)" (aiohttp.ClientSession.limit)
         * timeout controls "total number of seconds for the whole request"
           (aiohttp.ClientTimeout.total), None by default
+        * compress: ask for compressed responses (incl. br); the session then hands
+          out raw (compressed) bodies, which only Client decompresses. False by
+          default: aiohttp decompresses as usual and Client can only count bytes on
+          the wire if the server sends Content-Length
+        * trace_configs: aiohttp.TraceConfigs, e.g. from MpApi.aio.trace.Tracer
         """
         self.user = user
         self.pw = pw
         self.max_connection = int(max_connection)
         self.timeout = timeout
+        self.compress = compress
+        self.trace_configs = trace_configs
 
     async def __aenter__(self) -> Self:  # params from init? ,
         """
         We could expose parameters like Accept-Language.
         """
-        if DEBUG:
-            print("DEBUG-session:")
-            print(f"   aiohttp timeout {self.timeout} seconds")
-            print(f"   max connections {self.max_connection}")
         timeout = aiohttp.ClientTimeout(total=self.timeout)
         conn = aiohttp.TCPConnector(limit=self.max_connection)
+        headers = {
+            "Content-Type": "application/xml",
+            "Accept": "application/xml;charset=UTF-8",
+            "Accept-Language": "de",
+        }
+        if self.compress:
+            headers["Accept-Encoding"] = ACCEPT_ENCODING
         session = aiohttp.ClientSession(
             auth=aiohttp.BasicAuth(self.user, password=self.pw),
             connector=conn,
             # accepts only absolute base_urls without path part
             # base_url=self.appURL
-            headers={
-                "Content-Type": "application/xml",
-                "Accept": "application/xml;charset=UTF-8",
-                "Accept-Language": "de",
-            },
+            headers=headers,
+            auto_decompress=not self.compress,
             raise_for_status=True,
+            trace_configs=self.trace_configs,
             timeout=timeout,
         )
         self.session = session
@@ -0,0 +1,199 @@
+"""
+Sinks: where the records of a chunk go. Besides the zipped XML file per chunk
+(ZipSink), records can be written to NDJSON files (one moduleItem per line) and to a
+SQLite database, so that later steps don't need to unzip and parse whole chunks.
+
+NdjsonSink and SqliteSink get the records of a chunk as they are fetched (first the
+main records, then every related module), not only when the chunk is complete. A
+chunk counts as done if it is done in all sinks of the job.
+
+USAGE
+    from MpApi.aio.sink import NdjsonSink, SqliteSink, ZipSink
+
+    chnkr = Chunky(baseURL=baseURL, sinks=[ZipSink(), NdjsonSink(), SqliteSink()])
+
+    # NDJSON lines look like this
+    {"module": "Person", "id": 1234, "PerNennformTxt": "...",
+     "PerAddressRef": [5678], "PerNameGrp": [{"NameTxt": "..."}]}
+
+    # SQLite: jobname/YYYYMMDD/records.sqlite with the tables records (see
+    # MpApi.aio.store) and chunks
+    sqlite3 jobname/20240101/records.sqlite "SELECT count(*) FROM records"
+"""
+
+from abc import ABC, abstractmethod
+import json
+from lxml import etree  # type: ignore
+from mpapi.constants import NSMAP
+from mpapi.module import Module
+from MpApi.aio.store import RecordStore
+from pathlib import Path
+
+sink_types = ["zip", "ndjson", "sqlite"]  # for jobs.dsl
+
+
+class Sink(ABC):
+    # True if the sink needs the assembled chunk when it's complete; Chunky then
+    # cleans, zips and validates it (see post_process_chunk in MpApi.aio.chunky)
+    whole_chunk = False
+
+    @abstractmethod
+    def done(self, chunk_fn: Path) -> bool:
+        """
+        True if the chunk is complete in this sink, i.e. it can be skipped.
+        """
+
+    def write(self, chunk_fn: Path, m: Module) -> None:
+        """
+        Records that belong to the chunk, as they are fetched.
+        """
+
+    def finish(self, chunk_fn: Path) -> None:
+        """
+        All records of the chunk have been written.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class ZipSink(Sink):
+    """
+    One zipped XML file per chunk. Chunky writes it when the chunk is complete, in a
+    process pool with post_workers (see post_process_chunk in MpApi.aio.chunky).
+    """
+
+    whole_chunk = True
+
+    def done(self, chunk_fn: Path) -> bool:
+        return chunk_fn.with_suffix(".zip").exists()
+
+
+class NdjsonSink(Sink):
+    """
+    One NDJSON file per chunk, written to .ndjson.part and renamed when the chunk is
+    complete.
+    """
+
+    def __init__(self) -> None:
+        self._files: dict = dict()  # chunk_fn -> open file
+
+    def done(self, chunk_fn: Path) -> bool:
+        return chunk_fn.with_suffix(".ndjson").exists()
+
+    def write(self, chunk_fn: Path, m: Module) -> None:
+        f = self._files.get(chunk_fn)
+        if f is None:
+            # a chunk always starts from scratch, also when it's resumed
+            f = open(self._part(chunk_fn), mode="w", encoding="utf-8")
+            self._files[chunk_fn] = f
+        for moduleN in m.xpath("/m:application/m:modules/m:module"):
+            mtype = moduleN.get("name")
+            for itemN in moduleN.iterfind("m:moduleItem", namespaces=NSMAP):
+                f.write(json.dumps(item_dict(itemN, mtype=mtype), ensure_ascii=False))
+                f.write("\n")
+
+    def finish(self, chunk_fn: Path) -> None:
+        f = self._files.pop(chunk_fn, None)
+        if f is None:  # no records
+            self._part(chunk_fn).touch()
+        else:
+            f.close()
+        self._part(chunk_fn).replace(chunk_fn.with_suffix(".ndjson"))
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files = dict()
+
+    def _part(self, chunk_fn: Path) -> Path:
+        return chunk_fn.with_suffix(".ndjson.part")
+
+
+class SqliteSink(Sink):
+    """
+    One database per project dir (jobname/YYYYMMDD/records.sqlite) with every record
+    (as XML, see RecordStore) and the chunks that are complete.
+    """
+
+    def __init__(self) -> None:
+        self._stores: dict = dict()  # project dir -> RecordStore
+
+    def done(self, chunk_fn: Path) -> bool:
+        if not (chunk_fn.parent / "records.sqlite").exists():
+            return False
+        con = self._store(chunk_fn).con
+        sql = "SELECT 1 FROM chunks WHERE chunk = ?"
+        return con.execute(sql, (chunk_fn.stem,)).fetchone() is not None
+
+    def write(self, chunk_fn: Path, m: Module) -> None:
+        self._store(chunk_fn).put_module(m)
+
+    def finish(self, chunk_fn: Path) -> None:
+        con = self._store(chunk_fn).con
+        sql = "INSERT OR REPLACE INTO chunks (chunk) VALUES (?)"
+        con.execute(sql, (chunk_fn.stem,))
+        con.commit()
+
+    def close(self) -> None:
+        for store in self._stores.values():
+            store.close()
+        self._stores = dict()
+
+    def _store(self, chunk_fn: Path) -> RecordStore:
+        store = self._stores.get(chunk_fn.parent)
+        if store is None:
+            chunk_fn.parent.mkdir(parents=True, exist_ok=True)
+            store = RecordStore(path=chunk_fn.parent / "records.sqlite")
+            store.con.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (chunk TEXT PRIMARY KEY)"
+            )
+            self._stores[chunk_fn.parent] = store
+        return store
+
+
+def make_sinks(names: list) -> list:
+    """
+    Return sinks for names from jobs.dsl, e.g. ["zip", "ndjson"].
+    """
+    classes = {"zip": ZipSink, "ndjson": NdjsonSink, "sqlite": SqliteSink}
+    unknown = [name for name in names if name not in classes]
+    if unknown:
+        raise ValueError(f"Unknown sinks: {unknown}; expected some of {sink_types}")
+    return [classes[name]() for name in names]
+
+
+def item_dict(itemN: etree._Element, *, mtype: str) -> dict:
+    """
+    A moduleItem as a flat dict: fields by name with their value, references as
+    lists of IDs, repeatable groups as lists of dicts.
+    """
+    record = {"module": mtype, "id": int(itemN.get("id"))}
+    record.update(_fields(itemN))
+    return record
+
+
+def _fields(node: etree._Element) -> dict:
+    fields: dict = dict()
+    for child in node:
+        tag = etree.QName(child).localname
+        name = child.get("name")
+        if tag in ("systemField", "dataField", "virtualField"):
+            fields[name] = child.findtext("m:value", namespaces=NSMAP)
+        elif tag == "moduleReference":
+            fields[name] = [
+                int(ref.get("moduleItemId"))
+                for ref in child.iterfind("m:moduleReferenceItem", namespaces=NSMAP)
+            ]
+        elif tag == "vocabularyReference":
+            fields[name] = child.findtext(
+                "m:vocabularyReferenceItem/m:formattedValue", namespaces=NSMAP
+            )
+        elif tag == "repeatableGroup":
+            fields[name] = [
+                _fields(groupItem)
+                for groupItem in child.iterfind(
+                    "m:repeatableGroupItem", namespaces=NSMAP
+                )
+            ]
+    return fields
@@ -0,0 +1,86 @@
+"""
+Adaptive chunk size: instead of a fixed number of objects per chunk, aim for a
+number of bytes or seconds per chunk. After every chunk the sizer learns what one
+object costs (including its related records) and sizes the next chunk accordingly.
+
+Chunky records the boundaries (offset, size) of every chunk in the run's manifest, so
+chunks stay the same when an interrupted run is resumed.
+
+USAGE
+    from MpApi.aio.sizer import ChunkSizer, parse_target
+
+    target, unit = parse_target("20MB")  # or "30s" or "5000000" (bytes)
+    sizer = ChunkSizer(target=target, unit=unit, initial=1000)
+    size = sizer.next_size()
+    sizer.observe(records=size, body=..., seconds=...)
+"""
+
+
+units = {"KB": 2**10, "MB": 2**20, "GB": 2**30}
+
+
+def parse_target(value: str) -> tuple:
+    """
+    Return (target, unit) for a chunk target like "20MB", "500KB", "30s" or a
+    number of bytes.
+    """
+    value = value.strip()
+    if value.endswith("s"):
+        return float(value[:-1]), "seconds"
+    for suffix, factor in units.items():
+        if value.upper().endswith(suffix):
+            return float(value[: -len(suffix)]) * factor, "bytes"
+    return float(value), "bytes"
+
+
+class ChunkSizer:
+    def __init__(
+        self,
+        *,
+        target: float,
+        unit: str = "bytes",
+        initial: int = 1000,
+        minimum: int = 10,
+        maximum: int = 10000,
+        smoothing: float = 0.5,
+    ) -> None:
+        """
+        target:    bytes (decompressed) or seconds per chunk
+        unit:      bytes or seconds
+        initial:   size of the first chunk(s) in objects, before we know anything
+        minimum:   never make chunks smaller
+        maximum:   never make chunks bigger
+        smoothing: weight of the newest chunk in the average cost per object
+        """
+        if unit not in ("bytes", "seconds"):
+            raise ValueError(f"Unknown unit for chunk target: {unit}")
+        self.target = target
+        self.unit = unit
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self.size = max(minimum, min(maximum, int(initial)))
+        self.cost: float | None = None  # bytes or seconds per object
+
+    def next_size(self) -> int:
+        return self.size
+
+    def observe(self, *, records: int, body: int, seconds: float) -> None:
+        """
+        Learn from a finished chunk: records objects, body bytes (decompressed, of
+        all its requests) and seconds it took.
+        """
+        if not records:
+            return
+        cost = (body if self.unit == "bytes" else seconds) / records
+        if self.cost is None:
+            self.cost = cost
+        else:
+            self.cost += self.smoothing * (cost - self.cost)
+        if self.cost > 0:
+            size = int(self.target / self.cost)
+            self.size = max(self.minimum, min(self.maximum, size))
+
+    def report(self) -> str:
+        cost = "n/a" if self.cost is None else f"{self.cost:.4g} {self.unit}/object"
+        return f"next chunk size {self.size} objects ({cost})"
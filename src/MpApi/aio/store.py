@@ -0,0 +1,113 @@
+"""
+Local SQLite record store. Remembers module, __id and __lastModified (plus the
+record itself) of everything Chunky saves, so that later runs only need to download
+records that are new or have changed since (see Chunky's incremental mode).
+
+USAGE
+    from MpApi.aio.store import RecordStore
+
+    store = RecordStore(path="myjob/records.sqlite")
+    store.put_module(m)
+    changedL = store.changed(mtype="Object", meta=[(1234, "2023-08-11 10:00:00.000")])
+    itemsL = store.get_many(mtype="Object", IDs=[1234, 1235])
+    store.close()
+"""
+
+from lxml import etree  # type: ignore
+from mpapi.constants import NSMAP
+from mpapi.module import Module
+from pathlib import Path
+import sqlite3
+
+BATCH = 500  # max number of IDs per SELECT ... IN (...)
+
+
+def item_meta(itemN: etree._Element) -> tuple:
+    """
+    Return (__id, __lastModified) of a moduleItem; __lastModified is None if the
+    item doesn't have it.
+    """
+    modified = itemN.findtext(
+        "m:systemField[@name='__lastModified']/m:value", namespaces=NSMAP
+    )
+    return int(itemN.get("id")), modified
+
+
+class RecordStore:
+    def __init__(self, *, path: str | Path) -> None:
+        self.path = Path(path)
+        self.con = sqlite3.connect(self.path)
+        self.con.execute(
+            """CREATE TABLE IF NOT EXISTS records (
+                module TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                last_modified TEXT,
+                xml BLOB NOT NULL,
+                PRIMARY KEY (module, id)
+            )"""
+        )
+        self.con.commit()
+
+    def __len__(self) -> int:
+        return self.con.execute("SELECT count(*) FROM records").fetchone()[0]
+
+    def close(self) -> None:
+        self.con.commit()
+        self.con.close()
+
+    def changed(self, *, mtype: str, meta: list) -> list:
+        """
+        Expects a list of (ID, lastModified) pairs as reported by the server; returns
+        the IDs which are not in the store or whose lastModified differs.
+        """
+        stored = self._last_modified(mtype=mtype, IDs=[ID for ID, _ in meta])
+        return [
+            ID
+            for ID, modified in meta
+            if int(ID) not in stored or stored[int(ID)] != modified
+        ]
+
+    def get_many(self, *, mtype: str, IDs: list) -> list:
+        """
+        Return new moduleItem elements for the given IDs in the given order; IDs that
+        are not in the store are skipped.
+        """
+        found = dict()
+        for batch in self._batches(IDs):
+            sql = f"SELECT id, xml FROM records WHERE module = ? AND id IN ({','.join('?' * len(batch))})"
+            for ID, xml in self.con.execute(sql, [mtype, *batch]):
+                found[ID] = xml
+        return [etree.fromstring(found[int(ID)]) for ID in IDs if int(ID) in found]
+
+    def put(self, *, mtype: str, item: etree._Element) -> None:
+        ID, modified = item_meta(item)
+        self.con.execute(
+            "INSERT OR REPLACE INTO records (module, id, last_modified, xml) VALUES (?, ?, ?, ?)",
+            (mtype, ID, modified, etree.tostring(item)),
+        )
+
+    def put_module(self, m: Module) -> None:
+        """
+        Store every moduleItem of every module in m and commit.
+        """
+        for moduleN in m.xpath("/m:application/m:modules/m:module"):
+            mtype = moduleN.get("name")
+            for itemN in moduleN.iterfind("m:moduleItem", namespaces=NSMAP):
+                self.put(mtype=mtype, item=itemN)
+        self.con.commit()
+
+    #
+    # helpers
+    #
+
+    def _batches(self, IDs: list) -> list:
+        IDs = [int(ID) for ID in IDs]
+        return [IDs[i : i + BATCH] for i in range(0, len(IDs), BATCH)]
+
+    def _last_modified(self, *, mtype: str, IDs: list) -> dict:
+        stored = dict()
+        for batch in self._batches(IDs):
+            sql = f"SELECT id, last_modified FROM records WHERE module = ? AND id IN ({','.join('?' * len(batch))})"
+            for ID, modified in self.con.execute(sql, [mtype, *batch]):
+                stored[ID] = modified
+        return stored
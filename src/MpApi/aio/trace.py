@@ -0,0 +1,159 @@
+"""
+Request timeline in Chrome's trace-event format (chrome://tracing, ui.perfetto.dev).
+
+Every request is one async event tagged with its chunk (see current_chunk in
+MpApi.aio.client), target module and endpoint, with its phases nested inside:
+- queued:   waiting for a free connection in the connector's pool
+- dns, connect: setting up a new connection (missing if a connection is reused)
+- ttfb:     from sending the request to the response headers; includes the above
+- transfer: reading (and decompressing) the body; in streaming mode this includes
+            parsing, which happens while the body arrives
+- parse:    building the XML document from the body (not streaming)
+
+aiohttp's TraceConfig hooks report the phases up to the response headers, Client
+reports the rest.
+
+USAGE
+    from MpApi.aio.trace import Tracer
+
+    tracer = Tracer()
+    async with Session(user=user, pw=pw, trace_configs=[tracer.trace_config()]) as s:
+        c = Client(baseURL=baseURL, tracer=tracer)
+        ...
+    tracer.write("out.json")
+
+    monk -j job --trace out.json
+"""
+
+import aiohttp
+import contextlib
+import itertools
+import json
+import os
+import time
+from yarl import URL
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.events: list = list()
+        self._start = time.perf_counter()
+        self._ids = itertools.count(1)
+        self.pid = os.getpid()
+
+    def request(self, *, endpoint: str, url: URL, chunk=None) -> "TracedRequest":
+        """
+        Begin the event for one request (one attempt, if it is retried).
+        """
+        return TracedRequest(
+            self,
+            name=f"{endpoint} {_target(url) or ''}".strip(),
+            args={"chunk": chunk, "target": _target(url), "endpoint": endpoint},
+        )
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        """
+        An event of its own that is not part of a request, e.g. parsing.
+        """
+        ID = next(self._ids)
+        self._event("b", name=name, ID=ID, args=args)
+        try:
+            yield
+        finally:
+            self._event("e", name=name, ID=ID)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Return a TraceConfig for the session; it reports into the TracedRequest
+        that Client passes to the request as trace_request_ctx.
+        """
+        config = aiohttp.TraceConfig()
+        phases = [
+            ("request", "ttfb"),
+            ("connection_queued", "queued"),
+            ("connection_create", "connect"),
+            ("dns_resolvehost", "dns"),
+        ]
+        for signal, phase in phases:
+            getattr(config, f"on_{signal}_start").append(_hook("begin", phase))
+            getattr(config, f"on_{signal}_end").append(_hook("end", phase))
+
+        async def on_request_exception(session, ctx, params) -> None:
+            request = ctx.trace_request_ctx
+            if isinstance(request, TracedRequest):
+                request.fail(params.exception)
+
+        config.on_request_exception.append(on_request_exception)
+        return config
+
+    def write(self, path: str) -> None:
+        with open(path, mode="w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        print(f"trace with {len(self.events)} events written to {path}")
+
+    #
+    # helpers
+    #
+
+    def _event(self, ph: str, *, name: str, ID: int, args: dict = None) -> None:
+        event = {
+            "name": name,
+            "cat": "request",
+            "ph": ph,
+            "id": ID,
+            "ts": (time.perf_counter() - self._start) * 1e6,  # microseconds
+            "pid": self.pid,
+            "tid": 1,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+
+class TracedRequest:
+    def __init__(self, tracer: Tracer, *, name: str, args: dict) -> None:
+        self.tracer = tracer
+        self.ID = next(tracer._ids)
+        self.name = name
+        self.open: list = list()  # phases begun, but not ended
+        tracer._event("b", name=name, ID=self.ID, args=args)
+
+    def begin(self, phase: str) -> None:
+        self.open.append(phase)
+        self.tracer._event("b", name=phase, ID=self.ID)
+
+    def end(self, phase: str, **args) -> None:
+        if phase in self.open:
+            self.open.remove(phase)
+            self.tracer._event("e", name=phase, ID=self.ID, args=args)
+
+    def fail(self, exc: BaseException) -> None:
+        for phase in reversed(list(self.open)):
+            self.end(phase, error=type(exc).__name__)
+
+    def close(self, **args) -> None:
+        for phase in reversed(list(self.open)):
+            self.end(phase)
+        self.tracer._event("e", name=self.name, ID=self.ID, args=args)
+
+
+def _hook(action: str, phase: str):
+    async def hook(session, ctx, params) -> None:
+        request = ctx.trace_request_ctx
+        if isinstance(request, TracedRequest):
+            getattr(request, action)(phase)
+
+    return hook
+
+
+def _target(url: URL) -> str | None:
+    """
+    Module type from a ria-ws url, e.g. Object for .../module/Object/search
+    """
+    parts = URL(url).parts
+    if "module" in parts:
+        target = parts[parts.index("module") + 1 : parts.index("module") + 2]
+        if target and target[0] != "definition":
+            return target[0]
+    return None
@@ -0,0 +1,105 @@
+"""
+Benchmark chunk assembly: the object page plus n related modules merged one after
+the other with Module's += versus assemble_chunk in one pass; for comparison also
+moving the module elements over instead of copying them. Modules are made up in
+memory; no server needed.
+
+USAGE
+    python test/bench_assemble.py  # 1000 objects, 8 and 12 related modules
+    python test/bench_assemble.py --objects 5000 --modules 8 16 --items 1000
+"""
+
+import argparse
+import gc
+from mpapi.module import Module
+from MpApi.aio.assemble import assemble_chunk
+import time
+
+NS = "http://www.zetcom.com/ria/ws/module"
+
+
+def module(mtype: str, *, items: int, fields: int) -> Module:
+    item = "".join(
+        f'<dataField dataType="Varchar" name="{mtype}Field{no}"><value>{"x" * 20}'
+        f"</value></dataField>"
+        for no in range(fields)
+    )
+    itemsL = "".join(
+        f'<moduleItem hasAttachments="false" id="{ID}">{item}</moduleItem>'
+        for ID in range(1, items + 1)
+    )
+    return Module(
+        xml=f'<application xmlns="{NS}"><modules>'
+        f'<module name="{mtype}" totalSize="{items}">{itemsL}</module>'
+        f"</modules></application>"
+    )
+
+
+def bench(*, objects: int, modules: int, items: int, fields: int, repeat: int) -> dict:
+    def make() -> tuple:
+        chunk = module("Object", items=objects, fields=fields)
+        related = [
+            module(f"Related{no}", items=items, fields=fields) for no in range(modules)
+        ]
+        gc.collect()
+        return chunk, related
+
+    def add(chunk: Module, related: list) -> Module:
+        for relatedM in related:
+            chunk += relatedM
+        return chunk
+
+    def assemble(chunk: Module, related: list) -> Module:
+        return assemble_chunk(chunk=chunk, related=related)
+
+    def move(chunk: Module, related: list) -> Module:
+        modulesN = chunk.xpath("/m:application/m:modules")[0]
+        for relatedM in related:
+            modulesN.extend(relatedM.xpath("/m:application/m:modules/m:module"))
+        return chunk
+
+    result = {"modules": modules, "records": objects + modules * items}
+    for name, fn in (("+=", add), ("assemble", assemble), ("move", move)):
+        best = float("inf")
+        for _ in range(repeat):
+            chunk, related = make()
+            start = time.perf_counter()
+            chunk = fn(chunk, related)
+            best = min(best, time.perf_counter() - start)
+            assert len(chunk) == result["records"]
+        result[name] = best
+    return result
+
+
+def report(results: list) -> str:
+    lines = [
+        f"{'modules':>8} {'records':>8} {'+= s':>8} {'assemble s':>10} {'move s':>8}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['modules']:>8} {r['records']:>8} {r['+=']:>8.3f} "
+            f"{r['assemble']:>10.3f} {r['move']:>8.3f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chunk assembly")
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--modules", type=int, nargs="+", default=[8, 12])
+    parser.add_argument("--items", type=int, default=500, help="per related module")
+    parser.add_argument("--fields", type=int, default=10, help="per record")
+    parser.add_argument("--repeat", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    results = [
+        bench(
+            objects=args.objects,
+            modules=n,
+            items=args.items,
+            fields=args.fields,
+            repeat=args.repeat,
+        )
+        for n in args.modules
+    ]
+    print(report(results))
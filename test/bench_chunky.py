@@ -0,0 +1,144 @@
+"""
+Benchmark whole monk jobs against the offline stand-in in fake_ria.py.
+
+For every size, a fresh fake_ria server is started in a subprocess and one monk job
+(apack group by default) runs in a separate process, so that peak RSS belongs to
+monk alone. Reports records/s and bytes/s as served by the stand-in and the peak RSS
+of the monk process.
+
+USAGE
+    python test/bench_chunky.py  # 1k, 10k and 100k objects
+    python test/bench_chunky.py --sizes 1000 --latency 0.05 --chunks 2 --out bench_output.txt
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+here = Path(__file__).parent
+
+dsl = """
+.conf:
+    chunkSize {chunk_size}
+    chunks {chunks}
+    semaphore {semaphore}
+bench:
+    {command}
+"""
+
+
+def run_monk(*, conf_fn: str, job: str, baseURL: str, queue) -> None:
+    """
+    Runs in a child process; reports peak RSS in kB (ru_maxrss is kB on Linux).
+    """
+    from MpApi.aio.monk import Monk
+
+    sys.stdout = open(os.devnull, "w")
+    m = Monk(conf_fn=conf_fn, baseURL=baseURL, user="bench", pw="bench")
+    m.run_job(job=job)
+    queue.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def bench(*, size: int, args, port: int) -> dict:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            str(here / "fake_ria.py"),
+            f"--objects={size}",
+            f"--latency={args.latency}",
+            f"--record-size={args.record_size}",
+            f"--port={port}",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        server.stdout.readline()  # wait for "listening on"
+        baseURL = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory() as tmp:
+            conf_fn = Path(tmp) / "jobs.dsl"
+            conf_fn.write_text(
+                dsl.format(
+                    chunk_size=args.chunk_size,
+                    chunks=args.chunks,
+                    semaphore=args.semaphore,
+                    command=args.command,
+                )
+            )
+            ctx = multiprocessing.get_context("spawn")
+            queue = ctx.Queue()
+            cwd = os.getcwd()
+            os.chdir(tmp)  # monk writes chunks relative to cwd
+            try:
+                start = time.perf_counter()
+                p = ctx.Process(
+                    target=run_monk,
+                    kwargs={
+                        "conf_fn": str(conf_fn),
+                        "job": "bench",
+                        "baseURL": baseURL,
+                        "queue": queue,
+                    },
+                )
+                p.start()
+                rss = queue.get()
+                p.join()
+                duration = time.perf_counter() - start
+            finally:
+                os.chdir(cwd)
+        with urllib.request.urlopen(f"{baseURL}/_stats") as response:
+            stats = json.load(response)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "objects": size,
+        "seconds": duration,
+        "records/s": stats["items"] / duration,
+        "bytes/s": stats["bytes"] / duration,
+        "requests": stats["requests"],
+        "peak RSS MB": rss / 1024,
+    }
+
+
+def report(results: list) -> str:
+    lines = [
+        f"{'objects':>8} {'seconds':>8} {'records/s':>10} {'MB/s':>8} {'requests':>8} {'RSS MB':>8}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['objects']:>8} {r['seconds']:>8.2f} {r['records/s']:>10.0f} "
+            f"{r['bytes/s'] / 1e6:>8.2f} {r['requests']:>8} {r['peak RSS MB']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark monk against fake_ria")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--command", default="apack group 1")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunks", type=int, default=1)
+    parser.add_argument("--semaphore", type=int, default=11)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--record-size", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(report(results), flush=True)
+    for size in args.sizes:
+        results.append(bench(size=size, args=args, port=args.port))
+        print(report(results).splitlines()[-1], flush=True)
+    txt = report(results)
+    if args.out:
+        Path(args.out).write_text(txt + "\n")
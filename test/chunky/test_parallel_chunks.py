@@ -0,0 +1,24 @@
+import asyncio
+from collections import deque
+from MpApi.aio.chunky import Chunky
+import time
+
+
+def test_sliding_window():
+    """
+    With two workers, a slow first chunk must not hold up the following ones and
+    chunks start in FIFO order.
+    """
+    started = list()
+
+    async def chunk(cno: int, duration: float) -> None:
+        started.append(cno)
+        await asyncio.sleep(duration)
+
+    chnkr = Chunky(baseURL="http://localhost", parallel_chunks=2)
+    tasks = deque([chunk(1, 0.3), chunk(2, 0.1), chunk(3, 0.1), chunk(4, 0.1)])
+    start = time.perf_counter()
+    asyncio.run(chnkr._parallel_chunks(tasks=tasks))
+    duration = time.perf_counter() - start
+    assert started == [1, 2, 3, 4]
+    assert duration < 0.35  # batch barrier would take 0.3 + 0.1
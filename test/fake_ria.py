@@ -0,0 +1,429 @@
+"""
+fake_ria - an offline stand-in for the parts of MuseumPlus' ria-ws/application that
+MpApi.aio.client uses, so that Client, Chunky and monk can be tested and benchmarked
+without credentials or a real server.
+
+Serves synthetic Object, Person, Multimedia, Address and ObjectGroup records. Every
+module has the IDs 1..n; Objects reference a Person, a Multimedia, an Address and the
+ObjectGroup that was queried, so apack produces the usual related lookups.
+
+Endpoints
+    GET  /ria-ws/application/module/definition
+    GET  /ria-ws/application/module/{mtype}/definition
+    POST /ria-ws/application/module/{mtype}/search
+    POST /ria-ws/application/module/{mtype}/search/savedQuery/{ID}
+    GET  /ria-ws/application/module/Multimedia/{ID}/attachment  (Range, If-Range)
+    GET  /_stats  (not part of the RIA API; json with requests, items and bytes served)
+
+Definitions are sent with an ETag and answered with 304 Not Modified if the request's
+If-None-Match matches. Responses are compressed if the client accepts gzip or deflate;
+stats count bytes before compression.
+
+Search understands the subset of the search language MpApi.aio sends: and/or/not,
+equalsField and greater; criteria on unknown fields match every record. Object
+criteria on groups, locations etc. therefore always match all Objects.
+
+USAGE
+    from fake_ria import FakeRia
+
+    async with FakeRia(objects=1000, latency=0.05, max_concurrent=100) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.search2(session, query=q)
+
+    # standalone, e.g. for monk or bench_chunky.py
+    python test/fake_ria.py --objects 10000 --port 8181
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import random
+from aiohttp import web
+from lxml import etree  # type: ignore
+
+NS = "http://www.zetcom.com/ria/ws/module"
+SEARCH_NS = "http://www.zetcom.com/ria/ws/module/search"
+EPOCH = datetime.datetime(2023, 1, 1)
+
+# per module: prefix for field names and the field used as title
+schema: dict = {
+    "Object": {"prefix": "Obj", "title": "ObjObjectTitleVrt"},
+    "Person": {"prefix": "Per", "title": "PerNennformTxt"},
+    "Multimedia": {"prefix": "Mul", "title": "MulOriginalFileTxt"},
+    "Address": {"prefix": "Adr", "title": "AdrSortTxt"},
+    "ObjectGroup": {"prefix": "Ogr", "title": "OgrNameTxt"},
+}
+
+
+def attachment(ID: int, *, size: int) -> bytes:
+    """
+    The (made up) attachment of Multimedia record ID.
+    """
+    seed = hashlib.sha256(str(ID).encode()).digest()
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class FakeRia:
+    def __init__(
+        self,
+        *,
+        objects: int = 1000,
+        persons: int | None = None,
+        record_size: int = 200,
+        attachment_size: int = 4096,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        max_concurrent: int | None = None,
+        fail_rate: float = 0.0,
+        retry_after: int | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 1,
+        compress: bool = True,
+    ) -> None:
+        """
+        objects:        number of Object records (also number of Multimedia records)
+        persons:        number of Person/Address records, defaults to objects/10
+        record_size:    characters of filler text per record
+        attachment_size: bytes per Multimedia attachment
+        latency:        seconds every request waits before it is answered
+        jitter:         additional random latency between 0 and jitter seconds
+        max_concurrent: answer with 503 if more requests are in flight, None = no limit
+        fail_rate:      probability (0..1) of a random 503
+        retry_after:    value of the Retry-After header sent with every 503
+        port:           0 picks a free port, see baseURL
+        compress:       compress responses if the client accepts it
+        """
+        self.sizes = {
+            "Object": objects,
+            "Multimedia": objects,
+            "Person": persons if persons is not None else max(1, objects // 10),
+            "ObjectGroup": 1,
+        }
+        self.sizes["Address"] = self.sizes["Person"]
+        self.record_size = record_size
+        self.attachment_size = attachment_size
+        self.latency = latency
+        self.jitter = jitter
+        self.max_concurrent = max_concurrent
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.compress = compress
+        self.modified: dict = {}  # (mtype, ID) -> datetime, see touch
+        self.in_flight = 0
+        self.stats = {"requests": 0, "items": 0, "bytes": 0, "503": 0}
+
+    async def __aenter__(self) -> "FakeRia":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/ria-ws/application/module/definition", self.definition),
+                web.get("/ria-ws/application/module/{mtype}/definition", self.definition),
+                web.post("/ria-ws/application/module/{mtype}/search", self.search),
+                web.post(
+                    "/ria-ws/application/module/{mtype}/search/savedQuery/{ID}",
+                    self.saved_query,
+                ),
+                web.get(
+                    "/ria-ws/application/module/Multimedia/{ID}/attachment",
+                    self.attachment,
+                ),
+                web.get("/_stats", self.get_stats),
+            ]
+        )
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+    @property
+    def baseURL(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def touch(self, *, mtype: str, IDs: list, when: datetime.datetime = None) -> None:
+        """
+        Mark records as modified (now by default), e.g. to test incremental downloads.
+        """
+        if when is None:
+            when = datetime.datetime.now()
+        for ID in IDs:
+            self.modified[(mtype, int(ID))] = when
+
+    #
+    # handlers
+    #
+
+    async def definition(self, request: web.Request) -> web.Response:
+        mtype = request.match_info.get("mtype")
+        mtypes = [mtype] if mtype is not None else sorted(self.sizes)
+        xml = self._definition_xml(mtypes)
+        etag = f'"{hashlib.sha1(xml.encode()).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.stats["requests"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        response = await self._answer(xml, items=0)
+        response.headers["ETag"] = etag
+        return response
+
+    async def search(self, request: web.Request) -> web.Response:
+        mtype = request.match_info["mtype"]
+        body = await request.read()
+        return await self._answer_search(mtype=mtype, body=body, saved=False)
+
+    async def saved_query(self, request: web.Request) -> web.Response:
+        mtype = request.match_info["mtype"]
+        body = await request.read()
+        return await self._answer_search(mtype=mtype, body=body, saved=True)
+
+    async def attachment(self, request: web.Request) -> web.Response:
+        ID = int(request.match_info["ID"])
+        if not 0 < ID <= self.sizes["Multimedia"]:
+            return web.Response(status=404, text=f"Unknown Multimedia {ID}")
+        self.stats["requests"] += 1
+        data = attachment(ID, size=self.attachment_size)
+        etag = f'"{ID}-{len(data)}"'
+        start = 0
+        if_range = request.headers.get("If-Range")
+        if request.http_range.start is not None and if_range in (None, etag):
+            start = request.http_range.start
+            if start >= len(data):
+                return web.Response(
+                    status=416, headers={"Content-Range": f"bytes */{len(data)}"}
+                )
+        self.stats["bytes"] += len(data) - start
+        if not start:
+            return web.Response(
+                body=data, content_type="image/jpeg", headers={"ETag": etag}
+            )
+        return web.Response(
+            status=206,
+            body=data[start:],
+            content_type="image/jpeg",
+            headers={
+                "Content-Range": f"bytes {start}-{len(data) - 1}/{len(data)}",
+                "ETag": etag,
+            },
+        )
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    #
+    # helpers
+    #
+
+    async def _answer(self, xml: str, *, items: int) -> web.Response:
+        self.stats["requests"] += 1
+        self.in_flight += 1
+        try:
+            overloaded = (
+                self.max_concurrent is not None and self.in_flight > self.max_concurrent
+            )
+            if overloaded or self.random.random() < self.fail_rate:
+                self.stats["503"] += 1
+                headers = {}
+                if self.retry_after is not None:
+                    headers["Retry-After"] = str(self.retry_after)
+                return web.Response(status=503, headers=headers)
+            delay = self.latency + self.random.random() * self.jitter
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        body = xml.encode("UTF-8")
+        self.stats["items"] += items
+        self.stats["bytes"] += len(body)
+        response = web.Response(body=body, content_type="application/xml", charset="UTF-8")
+        if self.compress:
+            response.enable_compression()
+        return response
+
+    async def _answer_search(
+        self, *, mtype: str, body: bytes, saved: bool
+    ) -> web.Response:
+        if mtype not in self.sizes:
+            return web.Response(status=404, text=f"Unknown module {mtype}")
+        try:
+            root = etree.fromstring(body)
+        except etree.XMLSyntaxError:
+            return web.Response(status=400, text="Invalid search")
+        search = root.find(f".//{{{SEARCH_NS}}}search")
+        limit = int(search.get("limit", -1))
+        offset = int(search.get("offset", 0))
+        select = [
+            f.get("fieldPath") for f in search.iterfind(f"{{{SEARCH_NS}}}select/*")
+        ]
+        expert = search.find(f"{{{SEARCH_NS}}}expert")
+        if saved or expert is None or len(expert) == 0:
+            IDs = range(1, self.sizes[mtype] + 1)
+        else:
+            IDs = sorted(self._evaluate(mtype, expert[0]))
+        total = len(IDs)
+        IDs = IDs[offset:] if limit == -1 else IDs[offset : offset + limit]
+        xml = self._search_xml(mtype=mtype, IDs=IDs, total=total, select=select)
+        return await self._answer(xml, items=len(IDs))
+
+    def _evaluate(self, mtype: str, node) -> set:
+        """
+        Evaluate a search criterion recursively; returns a set of matching IDs.
+        """
+        tag = etree.QName(node).localname
+        everything = range(1, self.sizes[mtype] + 1)
+        if tag == "and":
+            result = set(everything)
+            for child in node:
+                result &= self._evaluate(mtype, child)
+            return result
+        elif tag == "or":
+            result = set()
+            for child in node:
+                result |= self._evaluate(mtype, child)
+            return result
+        elif tag == "not":
+            return set(everything) - self._evaluate(mtype, node[0])
+        field = node.get("fieldPath")
+        operand = node.get("operand")
+        if field == "__id" and tag == "equalsField":
+            ID = int(operand)
+            return {ID} if 0 < ID <= self.sizes[mtype] else set()
+        elif field == "__lastModified" and tag == "greater":
+            since = datetime.datetime.fromisoformat(operand.replace("T", " "))
+            return {ID for ID in everything if self._modified(mtype, ID) > since}
+        return set(everything)
+
+    def _modified(self, mtype: str, ID: int) -> datetime.datetime:
+        return self.modified.get((mtype, ID), EPOCH + datetime.timedelta(seconds=ID))
+
+    def _search_xml(self, *, mtype: str, IDs, total: int, select: list) -> str:
+        items = "".join(self._item_xml(mtype, ID, select) for ID in IDs)
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<application xmlns="{NS}"><modules>'
+            f'<module name="{mtype}" totalSize="{total}">{items}</module>'
+            f"</modules></application>"
+        )
+
+    def _item_xml(self, mtype: str, ID: int, select: list) -> str:
+        modified = self._modified(mtype, ID).strftime("%Y-%m-%d %H:%M:%S.000")
+        prefix = schema[mtype]["prefix"]
+        title = f"{mtype} {ID}" if mtype != "Multimedia" else f"IMG_{ID}.JPG"
+        parts = [
+            ("__id", f'<systemField dataType="Long" name="__id"><value>{ID}</value></systemField>'),
+            (
+                "__lastModified",
+                f'<systemField dataType="Timestamp" name="__lastModified">'
+                f"<value>{modified}</value></systemField>",
+            ),
+            (
+                schema[mtype]["title"],
+                f'<dataField dataType="Varchar" name="{schema[mtype]["title"]}">'
+                f"<value>{title}</value></dataField>",
+            ),
+            (
+                f"{prefix}NotesClb",
+                f'<dataField dataType="Clob" name="{prefix}NotesClb">'
+                f'<value>{"x" * self.record_size}</value></dataField>',
+            ),
+        ]
+        for name, target, targetID in self._references(mtype, ID):
+            parts.append(
+                (
+                    name,
+                    f'<moduleReference name="{name}" targetModule="{target}" '
+                    f'multiplicity="M:N" size="1"><moduleReferenceItem '
+                    f'moduleItemId="{targetID}" uuid="{targetID}" seqNo="0"/>'
+                    f"</moduleReference>",
+                )
+            )
+        body = "".join(xml for name, xml in parts if not select or name in select)
+        attachments = "true" if mtype == "Multimedia" else "false"
+        return (
+            f'<moduleItem hasAttachments="{attachments}" id="{ID}" uuid="{ID}">'
+            f"{body}</moduleItem>"
+        )
+
+    def _references(self, mtype: str, ID: int) -> list:
+        if mtype == "Object":
+            person = (ID - 1) % self.sizes["Person"] + 1
+            return [
+                ("ObjObjectGroupsRef", "ObjectGroup", 1),
+                ("ObjMultimediaRef", "Multimedia", ID),
+                ("ObjPerAssociationRef", "Person", person),
+                ("ObjOwnerRef", "Address", person),
+            ]
+        elif mtype == "Multimedia":
+            return [("MulObjectRef", "Object", ID)]
+        elif mtype == "Person":
+            return [("PerAddressRef", "Address", ID)]
+        return []
+
+    def _definition_xml(self, mtypes: list) -> str:
+        modules = ""
+        for mtype in mtypes:
+            fields = "".join(
+                f'<{tag} name="{name}"/>' for name, tag in self._fields(mtype)
+            )
+            modules += f'<module name="{mtype}">{fields}</module>'
+        return (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<application xmlns="{NS}"><modules>{modules}</modules></application>'
+        )
+
+    def _fields(self, mtype: str) -> list:
+        prefix = schema[mtype]["prefix"]
+        fields = [("__id", "systemField"), ("__lastModified", "systemField")]
+        fields.append((schema[mtype]["title"], "dataField"))
+        fields.append((f"{prefix}NotesClb", "dataField"))
+        fields.extend((name, "moduleReference") for name, *_ in self._references(mtype, 1))
+        return fields
+
+
+async def serve(ria: FakeRia) -> None:
+    async with ria:
+        print(f"fake ria-ws listening on {ria.baseURL}", flush=True)
+        await asyncio.Event().wait()  # forever
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for MuseumPlus")
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--persons", type=int, default=None)
+    parser.add_argument("--record-size", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=None)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8181)
+    args = parser.parse_args()
+    ria = FakeRia(
+        objects=args.objects,
+        persons=args.persons,
+        record_size=args.record_size,
+        latency=args.latency,
+        jitter=args.jitter,
+        max_concurrent=args.max_concurrent,
+        fail_rate=args.fail_rate,
+        retry_after=args.retry_after,
+        port=args.port,
+    )
+    try:
+        asyncio.run(serve(ria))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,72 @@
+from mpapi.module import Module
+from MpApi.aio.assemble import assemble_chunk
+from MpApi.aio.chunky import ReferenceIndex
+
+NS = "http://www.zetcom.com/ria/ws/module"
+
+
+def module(mtype: str, IDs: list) -> Module:
+    items = "".join(f'<moduleItem id="{ID}"/>' for ID in IDs)
+    return Module(
+        xml=f'<application xmlns="{NS}"><modules>'
+        f'<module name="{mtype}" totalSize="{len(IDs)}">{items}</module>'
+        f"</modules></application>"
+    )
+
+
+def test_assemble_chunk():
+    chunk = module("Object", [1, 2, 3])
+    person = module("Person", [7, 8])
+    related = [person, module("Object", [3, 4]), module("Multimedia", [1])]
+    m = assemble_chunk(chunk=chunk, related=related)
+    assert m is chunk
+    assert m.xpath("/m:application/m:modules/m:module/@name") == [
+        "Object",
+        "Person",
+        "Multimedia",
+    ]
+    assert m.xpath("//m:module[@name = 'Object']/m:moduleItem/@id") == [
+        "1",
+        "2",
+        "3",
+        "4",
+    ]
+    assert len(m) == 4 + 2 + 1
+    assert len(person) == 2
+
+
+def test_reference_index():
+    def ref(target: str, IDs: list) -> str:
+        items = "".join(f'<moduleReferenceItem moduleItemId="{ID}"/>' for ID in IDs)
+        return f'<moduleReference targetModule="{target}">{items}</moduleReference>'
+
+    group = (
+        '<repeatableGroup name="ObjPerAssociationGrp"><repeatableGroupItem>'
+        + ref("Address", [5])
+        + "</repeatableGroupItem></repeatableGroup>"
+    )
+    m = Module(
+        xml=f'<application xmlns="{NS}"><modules><module name="Object">'
+        f'<moduleItem id="1">{ref("Person", [10, 9])}{ref("Multimedia", [3])}'
+        f"{group}</moduleItem>"
+        f'<moduleItem id="2">{ref("Person", [9, 100])}</moduleItem>'
+        f"</module></modules></application>"
+    )
+    index = ReferenceIndex(m)
+    assert index.targets == {"Person", "Multimedia"}  # only direct references
+    assert index.IDs == {"Person": [9, 10, 100], "Multimedia": [3], "Address": [5]}
+    assert index.counts == {"Person": 4, "Multimedia": 1, "Address": 1}
+
+
+
+def test_reference_index_other_nodes():
+    m = Module(
+        xml=f'<application xmlns="{NS}"><modules><module name="Object">'
+        '<moduleItem id="1"><moduleReference targetModule="Person">'
+        '<!-- comment --><?pi data?><moduleReferenceItem moduleItemId="7"/>'
+        "<moduleReferenceItem/></moduleReference></moduleItem>"
+        "</module></modules></application>"
+    )
+    index = ReferenceIndex(m)
+    assert index.IDs == {"Person": [7]}
+    assert index.counts == {"Person": 1}
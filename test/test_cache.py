@@ -0,0 +1,49 @@
+from lxml import etree
+from MpApi.aio.cache import RelatedCache
+
+
+def item(ID: int):
+    return etree.fromstring(
+        f'<moduleItem xmlns="http://www.zetcom.com/ria/ws/module" id="{ID}"/>'
+    )
+
+
+def test_hit_miss():
+    cache = RelatedCache(max_items=10)
+    assert cache.get(mtype="Person", ID=1) is None
+    cache.put(mtype="Person", ID=1, item=item(1))
+    itemN = cache.get(mtype="Person", ID="1")
+    assert itemN.get("id") == "1"
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_lru_eviction():
+    cache = RelatedCache(max_items=2)
+    cache.put(mtype="Person", ID=1, item=item(1))
+    cache.put(mtype="Person", ID=2, item=item(2))
+    cache.get(mtype="Person", ID=1)  # 2 is now least recently used
+    cache.put(mtype="Person", ID=3, item=item(3))
+    assert ("Person", 1) in cache
+    assert ("Person", 2) not in cache
+    assert cache.evictions == 1
+
+
+def test_persist(tmp_path):
+    path = tmp_path / "related.cache"
+    cache = RelatedCache(path=path)
+    cache.put(mtype="Address", ID=5, item=item(5))
+    cache.put(mtype="Person", ID=6, item=item(6))
+    cache.save()
+    cache2 = RelatedCache(path=path, max_items=1)
+    cache2.load()
+    assert cache2.get(mtype="Address", ID=5) is None  # least recently used
+    assert cache2.get(mtype="Person", ID=6).get("id") == "6"
+
+
+def test_not_a_cache_file(tmp_path):
+    path = tmp_path / "related.cache"
+    path.write_bytes(b"\x80\x04garbage")  # e.g. a pickle from an older version
+    cache = RelatedCache(path=path)
+    cache.load()
+    assert len(cache) == 0
@@ -0,0 +1,638 @@
+"""
+Offline tests against the stand-in in fake_ria.py; no credentials needed.
+"""
+from aiohttp import ClientResponseError
+import asyncio
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+from fake_ria import FakeRia, attachment
+from mpapi.search import Search
+from MpApi.aio.attachments import Attachments
+from MpApi.aio.cache import RelatedCache
+from MpApi.aio import chunky
+from MpApi.aio.chunky import Chunky
+from MpApi.aio.client import Client
+from MpApi.aio.definition import DefinitionCache, field_names
+from MpApi.aio.metrics import Metrics
+from MpApi.aio.manifest import Manifest
+from MpApi.aio.monk import Monk
+from MpApi.aio.retry import RetryPolicy
+from MpApi.aio.session import Session
+from MpApi.aio.sink import NdjsonSink, Sink, SqliteSink, ZipSink
+from MpApi.aio.store import RecordStore
+from MpApi.aio.trace import Tracer
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_definition():
+    async with FakeRia(objects=10) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.get_definition2(session, mtype="Object")
+    assert m.xpath("/m:application/m:modules/m:module[@name = 'Object']")
+
+
+@pytest.mark.asyncio
+async def test_search2():
+    q = Search(module="Object", limit=5, offset=0)
+    q.addCriterion(
+        field="ObjObjectGroupsRef.__id",
+        operator="equalsField",
+        value="1",
+    )
+    async with FakeRia(objects=20) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.search2(session, query=q)
+    assert m.totalSize(module="Object") == 20
+    assert len(m) == 5
+
+
+@pytest.mark.asyncio
+async def test_run_saved_query2():
+    async with FakeRia(objects=20) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.run_saved_query2(
+                session, ID=1, mtype="Object", limit=12, offset=10
+            )
+    assert len(m) == 10
+
+
+@pytest.mark.asyncio
+async def test_iter_search():
+    q = Search(module="Object", limit=-1, offset=0)
+    q.addCriterion(field="ObjObjectGroupsRef.__id", operator="equalsField", value="1")
+    async with FakeRia(objects=23) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            pages = [
+                len(m)
+                async for m in c.iter_search(session, query=q, page_size=5, prefetch=2)
+            ]
+            IDs = [
+                int(itemN.get("id"))
+                async for itemN in c.iter_saved_query(
+                    session, ID=1, mtype="Object", page_size=10, items=True
+                )
+            ]
+            requests = ria.stats["requests"]
+            async for m in c.iter_search(session, query=q, page_size=5, prefetch=2):
+                break  # pages in flight are cancelled
+    assert pages == [5, 5, 5, 5, 3]
+    assert IDs == list(range(1, 24))
+    assert ria.stats["requests"] - requests <= 3
+
+
+@pytest.mark.asyncio
+async def test_get_items():
+    items = [("Object", ID) for ID in range(1, 8)] + [("Person", 2), ("Object", 1)]
+    async with FakeRia(objects=10, persons=5) as ria:
+        c = Client(baseURL=ria.baseURL)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.get_items(session, items=items, batch_size=3)
+            empty = await c.get_items(session, items=[])
+    assert ria.stats["requests"] == 3 + 1
+    assert len(m.xpath("//m:module[@name = 'Object']/m:moduleItem")) == 7
+    assert m.xpath("//m:module[@name = 'Person']/m:moduleItem/@id") == ["2"]
+    assert len(empty) == 0
+
+
+@pytest.mark.asyncio
+async def test_apack_all_chunks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=25) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10)
+        async with Session(user="user", pw="pw") as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    assert len(list(tmp_path.glob("test/*/group-1-chunk*.zip"))) == 3
+
+
+@pytest.mark.asyncio
+async def test_search2_stream():
+    q = Search(module="Object", limit=5, offset=0)
+    async with FakeRia(objects=20) as ria:
+        c = Client(baseURL=ria.baseURL, stream=True, read_size=100)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.search2(session, query=q)
+            items = [itemN async for itemN in c.search_items(session, query=q)]
+    assert len(m) == 5
+    assert [itemN.get("id") for itemN in items] == ["1", "2", "3", "4", "5"]
+
+
+@pytest.mark.asyncio
+async def test_related_batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=10, persons=10) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, related_batch=3)
+        sem = asyncio.Semaphore(10)
+        async with Session(user="user", pw="pw") as session:
+            data = await chnkr.get_by_type(session, qtype="group", ID=1)
+            requests = ria.stats["requests"]
+            m = await chnkr.get_related_items(
+                session, data=data, sem=sem, target="Person"
+            )
+        assert ria.stats["requests"] - requests == 4  # 3+3+3+1 IDs
+    assert len(m) == 10
+
+
+@pytest.mark.asyncio
+async def test_related_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = RelatedCache(max_items=100)
+    async with FakeRia(objects=10, persons=5) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, cache=cache)
+        sem = asyncio.Semaphore(10)
+        async with Session(user="user", pw="pw") as session:
+            data = await chnkr.get_by_type(session, qtype="group", ID=1)
+            m = await chnkr.get_related_items(session, data=data, sem=sem, target="Person")
+            requests = ria.stats["requests"]
+            m2 = await chnkr.get_related_items(session, data=data, sem=sem, target="Person")
+        assert ria.stats["requests"] == requests
+    assert len(m) == len(m2) == 5
+    assert cache.hits == 5
+
+
+@pytest.mark.asyncio
+async def test_incremental(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = RecordStore(path=tmp_path / "records.sqlite")
+    async with FakeRia(objects=20) as ria:
+        chnkr = Chunky(
+            baseURL=ria.baseURL, chunk_size=10, store=store, incremental=True
+        )
+        async with Session(user="user", pw="pw") as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+            for zipN in tmp_path.glob("test/*/*.zip"):
+                zipN.unlink()  # as if it was the next day
+            ria.touch(mtype="Object", IDs=[3])
+            items = ria.stats["items"]
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    # light pages list all records again, but only Object 3 is downloaded in full
+    # count, Object, Multimedia; Person, Address and ObjectGroup per chunk
+    light = 1 + 20 + 20 + 2 * 2 + 2 * 2 + 2 * 1
+    assert ria.stats["items"] - items == light + 1
+    assert list(tmp_path.glob("test/*/group-1-chunk1.zip"))
+    assert list(tmp_path.glob("test/*/group-1-chunk2.zip"))
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_retry():
+    retry = RetryPolicy(attempts=10, base=0.01, budget=None)
+    async with FakeRia(objects=20, fail_rate=0.5) as ria:
+        c = Client(baseURL=ria.baseURL, retry=retry)
+        async with Session(user="user", pw="pw") as session:
+            for _ in range(5):
+                m = await c.run_saved_query2(session, ID=1, mtype="Object")
+                assert len(m) == 20
+        assert retry.retries == ria.stats["503"]
+
+
+@pytest.mark.asyncio
+async def test_post_workers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=25) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, post_workers=2)
+        async with Session(user="user", pw="pw") as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    assert len(list(tmp_path.glob("test/*/group-1-chunk*.zip"))) == 3
+    assert chnkr._pool is None
+
+
+@pytest.mark.asyncio
+async def test_post_workers_parallel_chunks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=42) as ria:
+        chnkr = Chunky(
+            baseURL=ria.baseURL, chunk_size=5, parallel_chunks=4, post_workers=1
+        )
+        async with Session(user="user", pw="pw") as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    assert len(list(tmp_path.glob("test/*/group-1-chunk*.zip"))) == 9
+    assert chnkr._pool is None
+
+
+@pytest.mark.asyncio
+async def test_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    post_process_chunk = chunky.post_process_chunk
+
+    def crash_in_chunk2(*, chunk, chunk_fn):
+        if chunk_fn.stem.endswith("chunk2"):
+            raise RuntimeError("crash")
+        post_process_chunk(chunk=chunk, chunk_fn=chunk_fn)
+
+    async with FakeRia(objects=25) as ria:
+        async with Session(user="user", pw="pw") as session:
+            chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, checkpoint=True)
+            monkeypatch.setattr(chunky, "post_process_chunk", crash_in_chunk2)
+            with pytest.raises(ExceptionGroup):
+                await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+            # pretend the run started yesterday
+            manifest_fn = tmp_path / "test" / "group-1.manifest.json"
+            manifest = json.loads(manifest_fn.read_text())
+            assert list(manifest["chunks"]) == ["group-1-chunk2"]
+            restored = Manifest.open(job="test", run="group-1")
+            assert restored.size(chunk="group-1-chunk2", key="objects") > 0
+            assert restored.size(chunk="group-1-chunk2", key="missing") == 0
+            (tmp_path / "test" / manifest["date"]).rename(tmp_path / "test/20000101")
+            manifest["date"] = "20000101"
+            manifest_fn.write_text(json.dumps(manifest))
+
+            monkeypatch.setattr(chunky, "post_process_chunk", post_process_chunk)
+            requests = ria.stats["requests"]
+            chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, checkpoint=True)
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    # count and chunk3 (objects + 4 related); chunk2 comes from the checkpoint
+    assert ria.stats["requests"] - requests == 1 + 5
+    assert len(list(tmp_path.glob("test/20000101/group-1-chunk*.zip"))) == 3
+    assert json.loads(manifest_fn.read_text())["complete"]
+    assert not list(tmp_path.glob("test/20000101/.partial/*"))
+
+
+def test_batch_key():
+    key = chunky._batch_key
+    assert key(target="Person", IDs=[1, 5, 9], fields=None) != key(
+        target="Person", IDs=[1, 6, 9], fields=None
+    )
+    assert key(target="Person", IDs=[9, 1, 5], fields=None) == key(
+        target="Person", IDs=["1", "5", "9"], fields=None
+    )
+    assert key(target="Person", IDs=[1], fields=["__id"]) != key(
+        target="Person", IDs=[1], fields=None
+    )
+
+
+@pytest.mark.asyncio
+async def test_adaptive_chunk_size(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=50) as ria:
+        async with Session(user="user", pw="pw") as session:
+            chnkr = Chunky(
+                baseURL=ria.baseURL,
+                chunk_size=10,
+                chunk_target=(2**30, "bytes"),  # more than the rest of the objects
+                checkpoint=True,
+            )
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    manifest = json.loads((tmp_path / "test" / "group-1.manifest.json").read_text())
+    assert manifest["boundaries"] == [[0, 10], [10, 10000]]
+    assert len(list(tmp_path.glob("test/*/group-1-chunk*.zip"))) == 2
+    assert chnkr.records == 50
+
+
+@pytest.mark.asyncio
+async def test_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=25) as ria:
+        async with Session(user="user", pw="pw") as session:
+            chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, snapshot=True)
+            await chnkr.query_all_chunks(session, ID=1, job="test", target="Object")
+            assert chnkr.records == 25
+            assert len(list(tmp_path.glob("test/*/query-1-chunk*.zip"))) == 3
+
+            # a resumed run keeps the IDs it got first
+            Manifest.open(job="test", run="group-1").put_snapshot(list(range(1, 13)))
+            keys = list()
+            put = Manifest.put
+
+            def record_put(self, *, chunk, key, data):
+                keys.append(key)
+                put(self, chunk=chunk, key=key, data=data)
+
+            monkeypatch.setattr(Manifest, "put", record_put)
+            chnkr = Chunky(
+                baseURL=ria.baseURL, chunk_size=10, snapshot=True, checkpoint=True
+            )
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    assert chnkr.records == 12
+    # main records and related records are checkpointed apart
+    assert any(key.startswith("page-Object-") for key in keys)
+    assert any(key.startswith("related-") for key in keys)
+    assert len(list(tmp_path.glob("test/*/group-1-chunk*.zip"))) == 2
+    assert not (tmp_path / "test" / "group-1.snapshot.json").exists()
+
+
+@pytest.mark.asyncio
+async def test_attachments(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    attachments = Attachments(path=tmp_path / "attachments", workers=2)
+    async with FakeRia(objects=5, attachment_size=5000) as ria:
+        async with Session(user="user", pw="pw") as session:
+            chnkr = Chunky(baseURL=ria.baseURL, attachments=attachments)
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+            assert (tmp_path / "attachments" / "3.jpg").read_bytes() == attachment(
+                3, size=5000
+            )
+            # present files are skipped, also by a new Attachments
+            attachments = Attachments(path=tmp_path / "attachments", verify=True)
+            requests = ria.stats["requests"]
+            m = await chnkr.client.get_items(
+                session, items=[("Multimedia", ID) for ID in range(1, 6)]
+            )
+            await attachments.download(session, client=chnkr.client, data=m)
+            assert attachments.skipped == 5
+            assert ria.stats["requests"] - requests == 1
+
+            # the same attachment from two chunks at once is downloaded once
+            attachments = Attachments(path=tmp_path / "again", workers=2)
+            requests = ria.stats["requests"]
+            await asyncio.gather(
+                attachments.download(session, client=chnkr.client, data=m),
+                attachments.download(session, client=chnkr.client, data=m),
+            )
+            assert ria.stats["requests"] - requests == 5
+            assert attachments.downloaded == 5
+
+            # downloads that finished are kept when another one fails
+            attachments = Attachments(path=tmp_path / "failed")
+            itemN = m.xpath("//m:moduleItem")[0]
+            unknown = copy.deepcopy(itemN)
+            unknown.set("id", "999")
+            itemN.getparent().append(unknown)
+            with pytest.raises(ClientResponseError):
+                await attachments.download(session, client=chnkr.client, data=m)
+            index = json.loads((tmp_path / "failed" / "index.json").read_text())
+            assert sorted(index) == ["1", "2", "3", "4", "5"]
+
+            # a partial file is resumed if the server's file is the same
+            path = tmp_path / "resumed.jpg"
+            part = path.with_name("resumed.jpg.part")
+            validator = path.with_name("resumed.jpg.part.validator")
+            part.write_bytes(attachment(2, size=5000)[:3000])
+            validator.write_text('"2-5000"')
+            sent = ria.stats["bytes"]
+            size, sha256 = await chnkr.client.get_attachment(session, ID=2, path=path)
+            assert ria.stats["bytes"] - sent == 2000
+            assert not validator.exists()
+
+            # ... and downloaded whole if it changed or we can't tell
+            for tag in ('"2-4000"', None):
+                part.write_bytes(attachment(2, size=4000)[:3000])
+                if tag:
+                    validator.write_text(tag)
+                sent = ria.stats["bytes"]
+                await chnkr.client.get_attachment(session, ID=2, path=path)
+                assert ria.stats["bytes"] - sent == 5000
+                assert path.read_bytes() == attachment(2, size=5000)
+
+            # a part as big as the file is complete only if it has the file's size
+            part.write_bytes(attachment(2, size=6000))
+            validator.write_text('"2-5000"')
+            await chnkr.client.get_attachment(session, ID=2, path=path)
+            assert path.read_bytes() == attachment(2, size=5000)
+    assert size == 5000
+    assert sha256 == hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_sink_types():
+    with pytest.raises(TypeError):
+        Sink()  # done is abstract
+    assert ZipSink().whole_chunk
+    assert not NdjsonSink().whole_chunk
+
+
+@pytest.mark.asyncio
+async def test_sinks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sinks = [NdjsonSink(), SqliteSink()]
+    async with FakeRia(objects=15) as ria:
+        async with Session(user="user", pw="pw") as session:
+            chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, sinks=sinks)
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+            requests = ria.stats["requests"]
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+            assert ria.stats["requests"] - requests == 1  # count only
+    for sink in sinks:
+        sink.close()
+    assert not list(tmp_path.glob("test/*/*.zip"))
+    ndjson = sorted(tmp_path.glob("test/*/group-1-chunk*.ndjson"))
+    assert len(ndjson) == 2
+    records = [json.loads(line) for line in ndjson[1].read_text().splitlines()]
+    objects = [r for r in records if r["module"] == "Object"]
+    assert [r["id"] for r in objects] == list(range(11, 16))
+    assert objects[0]["ObjObjectTitleVrt"] == "Object 11"
+    assert objects[0]["ObjMultimediaRef"] == [11]
+    con = sqlite3.connect(ndjson[0].parent / "records.sqlite")
+    assert con.execute("SELECT count(*) FROM chunks").fetchone()[0] == 2
+    sql = "SELECT count(*) FROM records WHERE module = 'Object'"
+    assert con.execute(sql).fetchone()[0] == 15
+
+
+@pytest.mark.asyncio
+async def test_definition_cache(tmp_path):
+    definitions = DefinitionCache(path=tmp_path, ttl=3600)
+    async with FakeRia(objects=10) as ria:
+        c = Client(baseURL=ria.baseURL, definitions=definitions)
+        async with Session(user="user", pw="pw") as session:
+            m = await c.get_definition2(session, mtype="Person")
+            await c.get_definition2(session, mtype="Person")
+            assert ria.stats["requests"] == 1
+            definitions.ttl = 0  # stale: ask the server, which says 304
+            m2 = await c.get_definition2(session, mtype="Person")
+            assert ria.stats["requests"] == 2
+            assert ria.stats["bytes"] == len(definitions.get("Person")[0])
+    assert field_names(m, mtype="Person") == field_names(m2, mtype="Person")
+    assert "PerNennformTxt" in field_names(m, mtype="Person")
+
+
+@pytest.mark.asyncio
+async def test_projection(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    async with FakeRia(objects=10, persons=10) as ria:
+        chnkr = Chunky(
+            baseURL=ria.baseURL,
+            fields={"Person": ["PerNennformTxt"]},
+            exclude_fields={"Object": ["ObjNotesClb"]},
+        )
+        sem = asyncio.Semaphore(10)
+        async with Session(user="user", pw="pw") as session:
+            await chnkr._prepare_projection(session)
+            data = await chnkr.get_by_type(session, qtype="group", ID=1)
+            persons = await chnkr.get_related_items(
+                session, data=data, sem=sem, target="Person"
+            )
+            chnkr = Chunky(baseURL=ria.baseURL, fields={"Person": ["PerUnknownTxt"]})
+            with pytest.raises(ValueError):
+                await chnkr._prepare_projection(session)
+    assert not data.xpath("//m:dataField[@name = 'ObjNotesClb']")
+    assert data.xpath("//m:moduleReference[@name = 'ObjPerAssociationRef']")
+    names = {n.get("name") for n in persons.xpath("//m:moduleItem/*")}
+    assert names == {"__id", "__lastModified", "PerNennformTxt"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_compression(stream):
+    q = Search(module="Object", limit=-1, offset=0)
+    async with FakeRia(objects=20, record_size=1000) as ria:
+        c = Client(baseURL=ria.baseURL, stream=stream)
+        async with Session(user="user", pw="pw", compress=True) as session:
+            m = await c.search2(session, query=q)
+            items = [itemN async for itemN in c.search_items(session, query=q)]
+        served = ria.stats["bytes"]
+        # by default, Session decompresses like any aiohttp session
+        async with Session(user="user", pw="pw") as session:
+            url = f"{ria.baseURL}/ria-ws/application/module/Object/search"
+            async with session.post(url, data=q.toString()) as response:
+                assert (await response.text()).startswith("<")
+    assert len(m) == 20 and len(items) == 20
+    assert c.transfer.requests == 2
+    assert c.transfer.body == served
+    assert c.transfer.wire < c.transfer.body / 5
+
+
+@pytest.mark.asyncio
+async def test_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics = Metrics()
+    async with FakeRia(objects=15) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, metrics=metrics)
+        async with Session(user="user", pw="pw") as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    requests = sum(metrics.counters["mpapi_requests_total"].values())
+    assert requests == ria.stats["requests"]
+    summary = metrics.to_json()
+    stages = {e["stage"] for e in summary["gauges"]["mpapi_chunk_stage_seconds"]}
+    assert stages == {"objects", "related", "save"}
+    assert all(e["value"] == 0 for e in summary["gauges"]["mpapi_requests_in_flight"])
+
+
+@pytest.mark.asyncio
+async def test_trace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tracer = Tracer()
+    async with FakeRia(objects=15) as ria:
+        chnkr = Chunky(baseURL=ria.baseURL, chunk_size=10, tracer=tracer)
+        session = Session(user="user", pw="pw", trace_configs=[tracer.trace_config()])
+        async with session as session:
+            await chnkr.apack_all_chunks(session, ID=1, job="test", qtype="group")
+    tracer.write(tmp_path / "trace.json")
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    begun = [(e["id"], e["name"]) for e in events if e["ph"] == "b"]
+    ended = [(e["id"], e["name"]) for e in events if e["ph"] == "e"]
+    assert sorted(begun) == sorted(ended)
+    names = {name for _, name in begun}
+    assert {"ttfb", "connect", "transfer", "parse", "search Person"} <= names
+    chunks = {
+        e["args"]["chunk"]
+        for e in events
+        if e["name"] == "search Person" and e["ph"] == "b"
+    }
+    assert chunks == {"group-1-chunk1", "group-1-chunk2"}
+
+
+@pytest.fixture
+def ria_thread():
+    """
+    FakeRia in a thread of its own, for code that runs its own event loops (monk).
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    ria = FakeRia(objects=25)
+    asyncio.run_coroutine_threadsafe(ria.start(), loop).result()
+    yield ria
+    asyncio.run_coroutine_threadsafe(ria.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_job_mode(tmp_path, monkeypatch, ria_thread):
+    monkeypatch.chdir(tmp_path)
+    dsl = tmp_path / "jobs.dsl"
+    dsl.write_text(
+        ".conf:\n"
+        "    chunkSize 10\n"
+        "    commands 2\n"
+        "    semaphore 10\n"
+        "test:\n"
+        "    apack group 1\n"
+        "    apack group 2\n"
+        "    query 5 Object\n"
+    )
+    m = Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw")
+    m.run_job(job="test")
+    for run in ("group-1", "group-2", "query-5"):
+        assert len(list(tmp_path.glob(f"test/*/{run}-chunk*.zip"))) == 3
+
+
+def test_plan(tmp_path, monkeypatch, capsys, ria_thread):
+    monkeypatch.chdir(tmp_path)
+    dsl = tmp_path / "jobs.dsl"
+    dsl.write_text(
+        ".conf:\n"
+        "    chunkSize 10\n"
+        "test:\n"
+        "    apack group 1\n"
+        "    query 5 Object\n"
+    )
+    m = Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw")
+    m.plan_job(job="test")
+    out = capsys.readouterr().out
+    assert ria_thread.stats["items"] == 2  # one per count
+    assert not list(tmp_path.glob("test/*/*.zip"))
+    assert "apack group 1" in out and "query 5 Object" in out
+    assert "no estimate" in out
+
+    Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw").run_job(
+        job="test"
+    )
+    capsys.readouterr()
+    m = Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw")
+    m.plan_job(job="test")
+    out = capsys.readouterr().out
+    assert "estimate based on 1 earlier runs" in out
+
+
+def test_plan_chunks(tmp_path, monkeypatch, capsys, ria_thread):
+    monkeypatch.chdir(tmp_path)
+    dsl = tmp_path / "jobs.dsl"
+    conf = ".conf:\n    chunkSize 5\n    snapshot true\ntest:\n    query 5 Object\n"
+    dsl.write_text(conf)
+    Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw").plan_job(
+        job="test"
+    )
+    out = capsys.readouterr().out
+    # 25 IDs in the snapshot make exactly 5 chunks
+    assert "25 records      5 chunks" in out
+    assert "estimates" not in out
+
+    dsl.write_text(conf.replace("chunkSize 5", "chunkSize auto 20MB 5"))
+    Monk(conf_fn=dsl, baseURL=ria_thread.baseURL, user="user", pw="pw").plan_job(
+        job="test"
+    )
+    out = capsys.readouterr().out
+    assert "25 records ~    5 chunks" in out
+    assert "chunk counts are estimates" in out
+
+
+@pytest.mark.asyncio
+async def test_failing_command_keeps_shared_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("related lookup failed")
+
+    async with FakeRia(objects=10) as ria:
+        async with Session(user="user", pw="pw") as session:
+            failing = Chunky(baseURL=ria.baseURL, chunk_size=5)
+            monkeypatch.setattr(failing, "get_related_items", fail)
+            chnkr = Chunky(baseURL=ria.baseURL, chunk_size=5)
+            with pytest.raises(ExceptionGroup):
+                async with asyncio.TaskGroup() as tg:
+                    tg.create_task(
+                        failing.query_all_chunks(
+                            session, ID=1, job="test", target="Object"
+                        )
+                    )
+                    tg.create_task(asyncio.sleep(0))
+            # the session belongs to the caller; a failed command leaves it open
+            assert not session.closed
+            await chnkr.query_all_chunks(session, ID=2, job="test", target="Object")
+    assert chnkr.records == 10
@@ -0,0 +1,68 @@
+from aiohttp.client_exceptions import ClientResponseError
+import asyncio
+from MpApi.aio.limiter import AdaptiveLimiter
+import pytest
+
+
+async def request(limiter, *, status: int = 200, seen: list = None):
+    async with limiter.slot():
+        if seen is not None:
+            seen.append(limiter.in_flight)
+        await asyncio.sleep(0.001)
+        if status != 200:
+            raise ClientResponseError(None, (), status=status)
+
+
+def test_grows_while_latency_is_stable():
+    limiter = AdaptiveLimiter(initial=2, maximum=10)
+
+    async def main():
+        for _ in range(50):
+            await request(limiter)
+
+    asyncio.run(main())
+    assert limiter.limit > 2
+    assert limiter.latency is not None
+
+
+def test_backs_off_on_503():
+    limiter = AdaptiveLimiter(initial=8, minimum=2, maximum=10)
+
+    async def main():
+        with pytest.raises(ClientResponseError):
+            await request(limiter, status=503)
+
+    asyncio.run(main())
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+
+
+def test_never_exceeds_limit():
+    limiter = AdaptiveLimiter(initial=3, minimum=3, maximum=3)
+    seen = list()
+
+    async def main():
+        await asyncio.gather(*[request(limiter, seen=seen) for _ in range(20)])
+
+    asyncio.run(main())
+    assert max(seen) == 3
+    assert limiter.in_flight == 0
+
+
+def test_latency_until_headers_per_endpoint():
+    limiter = AdaptiveLimiter(initial=2, maximum=10)
+
+    async def main():
+        async with limiter.slot(endpoint="definition"):
+            await asyncio.sleep(0.001)
+        for _ in range(20):
+            async with limiter.slot(endpoint="search") as slot:
+                await asyncio.sleep(0.02)
+                slot.responded()
+                await asyncio.sleep(0.05)  # reading a large body
+
+    asyncio.run(main())
+    search, best = limiter.latencies["search"]
+    assert search < 0.05
+    assert limiter.latencies["definition"][1] < best
+    assert limiter.limit > 2  # search isn't compared with definition's best
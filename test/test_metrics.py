@@ -0,0 +1,36 @@
+import json
+from MpApi.aio.metrics import Metrics, NO_METRICS
+
+
+def test_prometheus():
+    metrics = Metrics(buckets=(0.1, 1, float("inf")))
+    metrics.inc("mpapi_requests_total", endpoint="search")
+    metrics.inc("mpapi_requests_total", endpoint="search")
+    metrics.add("mpapi_requests_in_flight", 1, endpoint="search")
+    for seconds in (0.05, 0.5, 5):
+        metrics.observe("mpapi_request_seconds", seconds, endpoint="search")
+    text = metrics.to_prometheus()
+    assert 'mpapi_requests_total{endpoint="search"} 2' in text
+    assert 'mpapi_requests_in_flight{endpoint="search"} 1' in text
+    assert 'mpapi_request_seconds_bucket{endpoint="search",le="1"} 2' in text
+    assert 'mpapi_request_seconds_bucket{endpoint="search",le="+Inf"} 3' in text
+    assert 'mpapi_request_seconds_count{endpoint="search"} 3' in text
+
+
+def test_json(tmp_path):
+    metrics = Metrics()
+    with metrics.timer("mpapi_stage_seconds", stage="related"):
+        pass
+    metrics.add("mpapi_requests_in_flight", 2)
+    metrics.add("mpapi_requests_in_flight", -2)
+    metrics.write(json=tmp_path / "metrics.json")
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert summary["histograms"]["mpapi_stage_seconds"][0]["count"] == 1
+    assert summary["gauges"]["mpapi_requests_in_flight"][0] == {"value": 0, "max": 2}
+
+
+def test_disabled():
+    NO_METRICS.inc("mpapi_requests_total", endpoint="search")
+    with NO_METRICS.timer("mpapi_stage_seconds", stage="save"):
+        pass
+    assert not NO_METRICS.counters and not NO_METRICS.histograms
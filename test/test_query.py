@@ -0,0 +1,70 @@
+from lxml import etree  # type: ignore
+from MpApi.aio import query
+from MpApi.aio.chunky import Chunky
+from MpApi.aio.query import SEARCH_NS, ids_xml, search_xml, validate_xml
+from pathlib import Path
+import pytest
+
+NS = {"s": SEARCH_NS}
+
+
+def test_search_xml():
+    xml = search_xml(
+        mtype="Object",
+        criteria=[("equalsField", "ObjObjectGroupsRef.__id", 1234)],
+        fields=["__id", "ObjTitle<Txt>"],
+        limit=10,
+        offset=20,
+    )
+    root = etree.fromstring(xml.encode())
+    searchN = root.xpath("/s:application/s:modules/s:module/s:search", namespaces=NS)[0]
+    assert (searchN.get("limit"), searchN.get("offset")) == ("10", "20")
+    assert searchN.xpath("s:select/s:field/@fieldPath", namespaces=NS) == [
+        "__id",
+        "ObjTitle<Txt>",
+    ]
+    criterion = searchN.xpath("s:expert/s:equalsField", namespaces=NS)[0]
+    assert criterion.get("operand") == "1234"
+
+
+def test_ids_xml():
+    root = etree.fromstring(ids_xml(mtype="Person", IDs=[1, 2, 3]).encode())
+    assert root.xpath("//s:expert/s:or/s:equalsField/@operand", namespaces=NS) == [
+        "1",
+        "2",
+        "3",
+    ]
+    assert not root.xpath("//s:select", namespaces=NS)
+    root = etree.fromstring(ids_xml(mtype="Person", IDs=[1]).encode())
+    assert root.xpath("//s:expert/s:equalsField/@operand", namespaces=NS) == ["1"]
+    with pytest.raises(ValueError):
+        search_xml(mtype="Person", join="xor")
+
+
+def test_validate_xml(tmp_path, monkeypatch):
+    xsd = tmp_path / "search.xsd"
+    xsd.write_text(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+        f'targetNamespace="{SEARCH_NS}"><xs:element name="application"/></xs:schema>'
+    )
+    schema = etree.XMLSchema(etree.parse(str(xsd)))
+    monkeypatch.setattr(query, "_schema", lambda: schema)
+    validate_xml(search_xml(mtype="Object"))
+    with pytest.raises(etree.DocumentInvalid):
+        validate_xml(f'<modules xmlns="{SEARCH_NS}"/>')
+
+
+def test_schema_version():
+    names = ["search_1_10.xsd", "search_1_9.xsd", "search_1_6.xsd"]
+    paths = sorted((Path(name) for name in names), key=query._version)
+    assert paths[-1].name == "search_1_10.xsd"
+
+
+def test_chunky_queries():
+    chnkr = Chunky(baseURL="http://localhost")
+    xml = chnkr._query_xml(ID=1234, qtype="approval", target="Multimedia", limit=1)
+    root = etree.fromstring(xml.encode())
+    assert len(root.xpath("//s:expert/s:and/s:equalsField", namespaces=NS)) == 4
+    assert root.xpath("//s:search/@limit", namespaces=NS) == ["1"]
+    with pytest.raises(ValueError):
+        chnkr._query_xml(ID=1, qtype="approval", target="Address")
@@ -0,0 +1,43 @@
+from aiohttp.client_exceptions import ClientResponseError
+import asyncio
+from multidict import CIMultiDict
+from MpApi.aio.retry import RetryPolicy
+
+
+def error(status: int, headers: dict = None):
+    return ClientResponseError(
+        None, (), status=status, headers=CIMultiDict(headers or {})
+    )
+
+
+def test_retryable():
+    retry = RetryPolicy()
+    assert retry.retryable(error(503))
+    assert retry.retryable(asyncio.TimeoutError())
+    assert not retry.retryable(error(404))
+    assert not retry.retryable(ValueError())
+
+
+def test_attempts_per_endpoint():
+    retry = RetryPolicy(attempts=2, endpoints={"search": 3})
+    exc = error(503)
+    assert retry.spend(endpoint="definition", attempt=1, exc=exc, chunk="c1")
+    assert not retry.spend(endpoint="definition", attempt=2, exc=exc, chunk="c1")
+    assert retry.spend(endpoint="search", attempt=2, exc=exc, chunk="c2")
+    assert retry.per_chunk == {"c1": 1, "c2": 1}
+
+
+def test_budget():
+    retry = RetryPolicy(attempts=10, budget=2)
+    exc = error(503)
+    assert retry.spend(endpoint="search", attempt=1, exc=exc, chunk=None)
+    assert retry.spend(endpoint="search", attempt=1, exc=exc, chunk=None)
+    assert not retry.spend(endpoint="search", attempt=1, exc=exc, chunk=None)
+
+
+def test_delay():
+    retry = RetryPolicy(base=1, cap=10)
+    assert retry.delay(error(503, {"Retry-After": "7"}), attempt=1) == 7
+    assert retry.delay(error(503, {"Retry-After": "70"}), attempt=1) == 10
+    for attempt in range(1, 6):
+        assert 0 <= retry.delay(error(503), attempt=attempt) <= min(10, 2 ** (attempt - 1))
@@ -0,0 +1,20 @@
+import pytest
+from MpApi.aio.sizer import ChunkSizer, parse_target
+
+
+def test_parse_target():
+    assert parse_target("20MB") == (20 * 2**20, "bytes")
+    assert parse_target("500kb") == (500 * 2**10, "bytes")
+    assert parse_target("30s") == (30, "seconds")
+    assert parse_target("4096") == (4096, "bytes")
+
+
+def test_sizer():
+    sizer = ChunkSizer(target=1000, unit="bytes", initial=50, minimum=10)
+    assert sizer.next_size() == 50
+    sizer.observe(records=50, body=5000, seconds=1)  # 100 bytes per object
+    assert sizer.next_size() == 10
+    sizer.observe(records=10, body=100, seconds=1)  # 10 bytes per object
+    assert sizer.next_size() == int(1000 / 55)
+    with pytest.raises(ValueError):
+        ChunkSizer(target=10, unit="records")
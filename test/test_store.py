@@ -0,0 +1,35 @@
+from lxml import etree
+from MpApi.aio.store import RecordStore
+
+
+def item(ID: int, modified: str):
+    return etree.fromstring(
+        f"""<moduleItem xmlns="http://www.zetcom.com/ria/ws/module" id="{ID}">
+            <systemField dataType="Timestamp" name="__lastModified">
+                <value>{modified}</value>
+            </systemField>
+        </moduleItem>"""
+    )
+
+
+def test_put_get(tmp_path):
+    store = RecordStore(path=tmp_path / "records.sqlite")
+    store.put(mtype="Object", item=item(1, "2023-01-01 00:00:00.000"))
+    store.put(mtype="Object", item=item(2, "2023-01-01 00:00:00.000"))
+    itemsL = store.get_many(mtype="Object", IDs=[2, 3, 1])
+    assert [itemN.get("id") for itemN in itemsL] == ["2", "1"]
+    assert len(store) == 2
+    store.close()
+
+
+def test_changed(tmp_path):
+    store = RecordStore(path=tmp_path / "records.sqlite")
+    store.put(mtype="Object", item=item(1, "2023-01-01 00:00:00.000"))
+    store.put(mtype="Object", item=item(2, "2023-01-01 00:00:00.000"))
+    meta = [
+        (1, "2023-01-01 00:00:00.000"),  # unchanged
+        (2, "2023-02-01 00:00:00.000"),  # changed
+        (3, "2023-01-01 00:00:00.000"),  # new
+    ]
+    assert store.changed(mtype="Object", meta=meta) == [2, 3]
+    store.close()